@@ -6,15 +6,34 @@ Utilise les données JSON des référentiels métier
 
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px
 import json
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import sqlite3
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy import create_engine, Column, Integer, String, Float, Date, DateTime, Boolean, Text, ForeignKey, Index, UniqueConstraint, event, func, select, insert, update, case, cast
+from sqlalchemy.orm import Session, sessionmaker, relationship, declarative_base
 import os
+import threading
+import heapq
+import time
+import hashlib
+from types import MappingProxyType
+from functools import lru_cache
+from decimal import Decimal
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+import io
+import re
+import copy
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import docx
+import tempfile
+import xlsxwriter
+import openpyxl
+import unicodedata
 
 # Configuration page
 st.set_page_config(
@@ -100,50 +119,3495 @@ st.markdown("""
 # 1. CONFIGURATION & CHARGEMENT DONNÉES
 # ==============================================================================
 
-@st.cache_data
+FICHIERS_REFERENCE = {
+    "demo_data": "data/demo_data.json",
+    "templates_phases": "data/templates_phases.json",
+    "workflow_modules": "data/workflow_modules.json"
+}
+
+def _figer(valeur):
+    """Copie immuable d'un document JSON (dict -> MappingProxyType, list -> tuple)"""
+    if isinstance(valeur, dict):
+        return MappingProxyType({cle: _figer(v) for cle, v in valeur.items()})
+    if isinstance(valeur, list):
+        return tuple(_figer(v) for v in valeur)
+    return valeur
+
+def _degeler(valeur):
+    """Inverse de _figer (pour sérialisation JSON)"""
+    if isinstance(valeur, MappingProxyType):
+        return {cle: _degeler(v) for cle, v in valeur.items()}
+    if isinstance(valeur, tuple):
+        return [_degeler(v) for v in valeur]
+    return valeur
+
+class RegistreReference:
+    """
+    Fichiers JSON de référence partagés par toutes les sessions, rechargés à chaud
+    - Contrôle mtime/taille à chaque accès, empreinte SHA-256 si le fichier a été touché
+    - Seul le fichier modifié est reparsé ; les snapshots publiés sont immuables
+    - En cas de JSON invalide, le dernier snapshot valide reste en service
+    """
+    
+    def __init__(self, fichiers):
+        self._lock = threading.Lock()
+        self.fichiers = dict(fichiers)
+        self._etats = {}
+        self._versions = {nom: 0 for nom in fichiers}
+        self._abonnes = []
+    
+    def abonner(self, callback):
+        """callback(nom) appelé après le rechargement d'un fichier déjà chargé"""
+        self._abonnes.append(callback)
+    
+    def version(self, nom):
+        with self._lock:
+            return self._versions[nom]
+    
+    def get(self, nom):
+        chemin = self.fichiers[nom]
+        recharge = False
+        with self._lock:
+            etat = self._etats.get(nom)
+            try:
+                stat = os.stat(chemin)
+            except FileNotFoundError:
+                st.error(f"❌ Fichier {chemin} non trouvé")
+                return etat['donnees'] if etat else MappingProxyType({})
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if etat and etat['signature'] == signature:
+                return etat['donnees']
+            
+            with open(chemin, 'rb') as f:
+                contenu = f.read()
+            empreinte = hashlib.sha256(contenu).hexdigest()
+            if etat and etat['empreinte'] == empreinte:
+                # Fichier touché sans modification du contenu
+                etat['signature'] = signature
+                return etat['donnees']
+            
+            try:
+                donnees = _figer(json.loads(contenu.decode('utf-8')))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                st.error(f"❌ Erreur format JSON dans {os.path.basename(chemin)}")
+                return etat['donnees'] if etat else MappingProxyType({})
+            
+            recharge = etat is not None
+            self._etats[nom] = {"signature": signature, "empreinte": empreinte, "donnees": donnees}
+            self._versions[nom] += 1
+        
+        if recharge:
+            for callback in self._abonnes:
+                callback(nom)
+        return donnees
+
+@st.cache_resource
+def get_registre_reference():
+    """Registre unique par processus"""
+    return RegistreReference(FICHIERS_REFERENCE)
+
 def load_demo_data():
-    """Charge demo_data.json avec gestion d'erreur"""
-    try:
-        with open('data/demo_data.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        st.error("❌ Fichier data/demo_data.json non trouvé")
-        return {}
-    except json.JSONDecodeError:
-        st.error("❌ Erreur format JSON dans demo_data.json")
-        return {}
-
-@st.cache_data
+    """Données de démonstration (snapshot immuable)"""
+    return get_registre_reference().get("demo_data")
+
 def load_templates_phases():
-    """Charge templates_phases.json avec gestion d'erreur"""
+    """Référentiel des phases par type d'opération (snapshot immuable)"""
+    return get_registre_reference().get("templates_phases")
+
+def load_workflow_modules():
+    """Paramétrage des workflows des modules (snapshot immuable)"""
+    return get_registre_reference().get("workflow_modules")
+
+def get_couleur_statut(statut):
+    """Retourne la couleur selon le statut de phase"""
+    couleurs = {
+        "VALIDEE": "#4CAF50",         # Vert
+        "EN_COURS": "#2196F3",        # Bleu
+        "EN_ATTENTE": "#FFC107",      # Jaune
+        "RETARD": "#F44336",          # Rouge
+        "CRITIQUE": "#E91E63",        # Rose
+        "NON_DEMARREE": "#9E9E9E",    # Gris
+        "VALIDATION_REQUISE": "#FF9800",  # Orange
+        "EN_REVISION": "#673AB7"      # Violet
+    }
+    return couleurs.get(statut, "#0066cc")
+
+# ==============================================================================
+# 2. BASE DE DONNÉES - MODÈLES SQLALCHEMY
+# ==============================================================================
+
+# URL configurable (PostgreSQL en production), SQLite WAL par défaut en local
+DATABASE_URL = os.environ.get("OPCOPILOT_DATABASE_URL", "sqlite:///data/opcopilot.db")
+
+# Montants stockés en euros entiers, comme dans les référentiels JSON
+Base = declarative_base()
+
+def _parse_date(valeur):
+    """Convertit une date ISO (str/datetime/date) en date, None sinon"""
+    if valeur is None or valeur == "":
+        return None
+    if isinstance(valeur, datetime):
+        return valeur.date()
+    if isinstance(valeur, date):
+        return valeur
     try:
-        with open('data/templates_phases.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        st.error("❌ Fichier data/templates_phases.json non trouvé")
-        return {}
-    except json.JSONDecodeError:
-        st.error("❌ Erreur format JSON dans templates_phases.json")
-        return {}
+        return datetime.fromisoformat(str(valeur)[:10]).date()
+    except ValueError:
+        return None
+
+class SerializableMixin:
+    """Conversion d'un enregistrement ORM en dict compatible avec les pages"""
+    
+    def to_dict(self):
+        donnees = {}
+        for colonne in self.__table__.columns:
+            valeur = getattr(self, colonne.key)
+            if isinstance(valeur, (date, datetime)):
+                valeur = valeur.isoformat()
+            donnees[colonne.key] = valeur
+        return donnees
+
+class Operation(SerializableMixin, Base):
+    """Opération immobilière suivie par un ACO"""
+    __tablename__ = "operations"
+    
+    id = Column(Integer, primary_key=True)
+    nom = Column(String(200), nullable=False)
+    type_operation = Column(String(30), nullable=False, index=True)
+    aco_responsable = Column(String(100), index=True)
+    commune = Column(String(100), index=True)
+    adresse = Column(String(300))
+    parcelle_cadastrale = Column(String(50))
+    nb_logements_total = Column(Integer, default=0)
+    nb_lls = Column(Integer, default=0)
+    nb_lts = Column(Integer, default=0)
+    nb_pls = Column(Integer, default=0)
+    nb_pli = Column(Integer, default=0)
+    type_logement = Column(String(30))
+    budget_total = Column(Integer, default=0)
+    rem_totale_prevue = Column(Integer, default=0)
+    date_creation = Column(Date)
+    date_debut_prevue = Column(Date)
+    date_fin_prevue = Column(Date, index=True)
+    statut = Column(String(30), index=True)
+    avancement = Column(Integer, default=0, index=True)
+    freins_actifs = Column(Integer, default=0, index=True)
+    # Champs spécifiques au type (VEFA, mandats...) stockés en JSON
+    details = Column(Text)
+    
+    phases = relationship("Phase", back_populates="operation", cascade="all, delete-orphan", lazy="select")
+    
+    def to_dict(self):
+        donnees = super().to_dict()
+        details = donnees.pop('details', None)
+        if details:
+            donnees.update(json.loads(details))
+        return donnees
+
+class Phase(SerializableMixin, Base):
+    """Phase du planning d'une opération"""
+    __tablename__ = "phases"
+    __table_args__ = (Index("ix_phases_operation_ordre", "operation_id", "ordre"),)
+    
+    id = Column(Integer, primary_key=True)
+    operation_id = Column(Integer, ForeignKey("operations.id", ondelete="CASCADE"), nullable=False, index=True)
+    ordre = Column(Integer, nullable=False)
+    nom = Column(String(200), nullable=False)
+    statut = Column(String(30), default="NON_DEMARREE", index=True)
+    date_debut_prevue = Column(Date)
+    date_fin_prevue = Column(Date)
+    date_debut_reelle = Column(Date)
+    date_fin_reelle = Column(Date)
+    responsable = Column(String(100))
+    est_critique = Column(Boolean, default=False)
+    est_jalon = Column(Boolean, default=False)
+    
+    operation = relationship("Operation", back_populates="phases")
+
+class RemTrimestre(SerializableMixin, Base):
+    """Suivi trimestriel REM et dépenses travaux"""
+    __tablename__ = "rem_trimestres"
+    __table_args__ = (UniqueConstraint("operation_id", "trimestre", name="uq_rem_operation_trimestre"),)
+    
+    id = Column(Integer, primary_key=True)
+    operation_id = Column(Integer, ForeignKey("operations.id", ondelete="CASCADE"), nullable=False, index=True)
+    trimestre = Column(String(10), nullable=False)
+    annee = Column(Integer, index=True)
+    numero_trimestre = Column(Integer)
+    rem_projetee = Column(Integer, default=0)
+    rem_realisee = Column(Integer, default=0)
+    depenses_projetees = Column(Integer, default=0)
+    depenses_facturees = Column(Integer, default=0)
+    # Écarts et avancements : dérivés à la lecture, jamais stockés
+
+def _pourcentage_sql(realise, projete):
+    """Arrondi au plus proche de realise/projete en % (0 si rien de projeté)"""
+    return case((projete > 0, cast(realise * 100.0 / projete + 0.5, Integer)), else_=0)
+
+# Colonnes calculées par SQL pour les lectures en flux (exports)
+COLONNES_CALCULEES = {
+    RemTrimestre: {
+        "ecart_rem": RemTrimestre.rem_realisee - RemTrimestre.rem_projetee,
+        "ecart_depenses": RemTrimestre.depenses_facturees - RemTrimestre.depenses_projetees,
+        "avancement_rem": _pourcentage_sql(RemTrimestre.rem_realisee, RemTrimestre.rem_projetee),
+        "avancement_travaux": _pourcentage_sql(RemTrimestre.depenses_facturees, RemTrimestre.depenses_projetees)
+    }
+}
+
+class Avenant(SerializableMixin, Base):
+    """Avenant au marché d'une opération"""
+    __tablename__ = "avenants"
+    __table_args__ = (UniqueConstraint("operation_id", "numero", name="uq_avenant_operation_numero"),)
+    
+    id = Column(Integer, primary_key=True)
+    operation_id = Column(Integer, ForeignKey("operations.id", ondelete="CASCADE"), nullable=False, index=True)
+    numero = Column(String(30), nullable=False)
+    date = Column(Date)
+    motif = Column(String(100), index=True)
+    description = Column(Text)
+    impact_budget = Column(Integer, default=0)
+    impact_delai = Column(Integer, default=0)
+    statut = Column(String(30), index=True)
+    validateur = Column(String(100))
+
+class Med(SerializableMixin, Base):
+    """Mise en demeure adressée à un intervenant"""
+    __tablename__ = "meds"
+    
+    id = Column(Integer, primary_key=True)
+    operation_id = Column(Integer, ForeignKey("operations.id", ondelete="CASCADE"), nullable=False, index=True)
+    reference = Column(String(30), nullable=False, unique=True)
+    type = Column(String(30))
+    destinataire = Column(String(200))
+    motif = Column(Text)
+    date_envoi = Column(Date)
+    delai_conformite = Column(Integer, default=15)
+    statut = Column(String(30), index=True)
+    relance_effectuee = Column(Boolean, default=False)
+    date_relance = Column(Date)
+    date_resolution = Column(Date)
+
+class EvenementMed(SerializableMixin, Base):
+    """Relance ou escalade d'une mise en demeure (historique du workflow MED)"""
+    __tablename__ = "med_evenements"
+    
+    id = Column(Integer, primary_key=True)
+    med_id = Column(Integer, ForeignKey("meds.id", ondelete="CASCADE"), nullable=False, index=True)
+    operation_id = Column(Integer, ForeignKey("operations.id", ondelete="CASCADE"), nullable=False, index=True)
+    type = Column(String(20))
+    date = Column(Date)
+    echeance = Column(Date)
+    automatique = Column(Boolean, default=True)
+
+class EtapeConcessionnaire(SerializableMixin, Base):
+    """Étape de raccordement concessionnaire (EDF, EAU, FIBRE...)"""
+    __tablename__ = "etapes_concessionnaires"
+    __table_args__ = (Index("ix_concess_operation_concessionnaire", "operation_id", "concessionnaire"),)
+    
+    id = Column(Integer, primary_key=True)
+    operation_id = Column(Integer, ForeignKey("operations.id", ondelete="CASCADE"), nullable=False, index=True)
+    concessionnaire = Column(String(30), nullable=False)
+    statut_global = Column(String(30))
+    ordre = Column(Integer, nullable=False)
+    nom = Column(String(200), nullable=False)
+    statut = Column(String(30))
+    # Saisie libre conservée telle quelle ("2024-03-15", "Semaine 35"...)
+    date = Column(String(50))
+
+class LotDGD(SerializableMixin, Base):
+    """Lot du Décompte Général Définitif"""
+    __tablename__ = "lots_dgd"
+    
+    id = Column(Integer, primary_key=True)
+    operation_id = Column(Integer, ForeignKey("operations.id", ondelete="CASCADE"), nullable=False, index=True)
+    nom = Column(String(100), nullable=False)
+    marche_initial = Column(Integer, default=0)
+    quantites_reelles = Column(Float, default=100)
+    plus_moins_value = Column(Integer, default=0)
+    penalites = Column(Integer, default=0)
+    montant_final = Column(Integer)
+    statut = Column(String(30))
+
+class ReclamationGPA(SerializableMixin, Base):
+    """Réclamation locataire en Garantie de Parfait Achèvement"""
+    __tablename__ = "reclamations_gpa"
+    
+    id = Column(Integer, primary_key=True)
+    operation_id = Column(Integer, ForeignKey("operations.id", ondelete="CASCADE"), nullable=False, index=True)
+    date = Column(Date)
+    logement = Column(String(20))
+    type = Column(String(50))
+    description = Column(Text)
+    locataire = Column(String(100))
+    statut = Column(String(30))
+    delai_intervention = Column(Integer)
+    entreprise = Column(String(100))
+    date_resolution = Column(Date)
+
+class ElementCloture(SerializableMixin, Base):
+    """Élément manuel de la checklist de clôture validé par son responsable"""
+    __tablename__ = "elements_cloture"
+    __table_args__ = (UniqueConstraint("operation_id", "item", name="uq_cloture_operation_item"),)
+    
+    id = Column(Integer, primary_key=True)
+    operation_id = Column(Integer, ForeignKey("operations.id", ondelete="CASCADE"), nullable=False, index=True)
+    item = Column(String(100), nullable=False)
+    valide = Column(Boolean, default=False)
+    auteur = Column(String(100))
+    date_validation = Column(Date)
+
+class ActiviteMensuelle(Base):
+    """Agrégat mensuel d'activité par ACO et commune (mis à jour incrémentalement)"""
+    __tablename__ = "activite_mensuelle"
+    __table_args__ = (UniqueConstraint("mois", "aco_responsable", "commune", name="uq_activite_mois_aco_commune"),)
+    
+    id = Column(Integer, primary_key=True)
+    mois = Column(Date, nullable=False, index=True)
+    aco_responsable = Column(String(100), nullable=False, default="", index=True)
+    commune = Column(String(100), nullable=False, default="", index=True)
+    rem_realisee = Column(Integer, default=0)
+    operations_actives = Column(Integer, default=0)
+    phases_validees = Column(Integer, default=0)
+    alertes_resolues = Column(Integer, default=0)
+
+class Alerte(SerializableMixin, Base):
+    """Alerte calculée par le planificateur (une ligne par clé de déduplication)"""
+    __tablename__ = "alertes"
+    
+    id = Column(Integer, primary_key=True)
+    cle = Column(String(100), nullable=False, unique=True)
+    operation_id = Column(Integer, ForeignKey("operations.id", ondelete="CASCADE"), nullable=False, index=True)
+    aco_responsable = Column(String(100), index=True)
+    commune = Column(String(100))
+    module = Column(String(50))
+    type = Column(String(50))
+    niveau = Column(String(20))
+    valeur = Column(Float)
+    seuil = Column(Float)
+    message = Column(Text)
+    action_requise = Column(String(200))
+    active = Column(Boolean, default=True, index=True)
+    date_creation = Column(DateTime)
+    date_maj = Column(DateTime)
+    date_resolution = Column(DateTime)
+
+OPERATION_COLUMNS = set(Operation.__table__.columns.keys())
+COLONNES_REM_SAISIES = ['trimestre', 'annee', 'numero_trimestre', 'rem_projetee', 'rem_realisee',
+                        'depenses_projetees', 'depenses_facturees']
+
+def _configurer_sqlite(dbapi_connection, connection_record):
+    """Active le mode WAL et les clés étrangères sur chaque connexion SQLite"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+def _operation_depuis_json(op):
+    """Construit une Operation à partir d'un enregistrement operations_demo"""
+    colonnes = {k: v for k, v in op.items() if k in OPERATION_COLUMNS}
+    details = {k: v for k, v in op.items() if k not in OPERATION_COLUMNS}
+    for champ in ('date_creation', 'date_debut_prevue', 'date_fin_prevue'):
+        colonnes[champ] = _parse_date(colonnes.get(champ))
+    colonnes['details'] = json.dumps(_degeler(details), ensure_ascii=False) if details else None
+    return Operation(**colonnes)
+
+def seed_database(session, demo_data):
+    """Initialise la base à partir de demo_data.json (base vide uniquement)"""
+    for op in demo_data.get('operations_demo', []):
+        session.add(_operation_depuis_json(op))
+    session.flush()
+    
+    def par_operation(cle):
+        for nom_cle, valeurs in demo_data.get(cle, {}).items():
+            yield int(nom_cle.replace('operation_', '')), valeurs
+    
+    for operation_id, phases in par_operation('phases_demo'):
+        for phase in phases:
+            session.add(Phase(
+                operation_id=operation_id,
+                ordre=phase['ordre'],
+                nom=phase['nom'],
+                statut=phase.get('statut', 'NON_DEMARREE'),
+                date_debut_prevue=_parse_date(phase.get('date_debut_prevue')),
+                date_fin_prevue=_parse_date(phase.get('date_fin_prevue')),
+                date_debut_reelle=_parse_date(phase.get('date_debut_reelle')),
+                date_fin_reelle=_parse_date(phase.get('date_fin_reelle')),
+                responsable=phase.get('responsable'),
+                est_critique=phase.get('est_critique', False),
+                est_jalon=phase.get('est_jalon', False)
+            ))
+    
+    for operation_id, trimestres in par_operation('rem_demo'):
+        for rem in trimestres:
+            numero, annee = rem['trimestre'].replace('T', '').split()
+            valeurs = {k: v for k, v in rem.items() if k in COLONNES_REM_SAISIES}
+            session.add(RemTrimestre(operation_id=operation_id, annee=int(annee), numero_trimestre=int(numero), **valeurs))
+    
+    for operation_id, avenants in par_operation('avenants_demo'):
+        for avenant in avenants:
+            session.add(Avenant(
+                operation_id=operation_id,
+                numero=avenant['numero'],
+                date=_parse_date(avenant.get('date')),
+                motif=avenant.get('motif'),
+                description=avenant.get('description'),
+                impact_budget=avenant.get('impact_budget', 0),
+                impact_delai=avenant.get('impact_delai', 0),
+                statut=avenant.get('statut'),
+                validateur=avenant.get('validateur')
+            ))
+    
+    for operation_id, meds in par_operation('med_demo'):
+        for med in meds:
+            session.add(Med(
+                operation_id=operation_id,
+                reference=med['reference'],
+                type=med.get('type'),
+                destinataire=med.get('destinataire'),
+                motif=med.get('motif'),
+                date_envoi=_parse_date(med.get('date_envoi')),
+                delai_conformite=med.get('delai_conformite', 15),
+                statut=med.get('statut'),
+                relance_effectuee=med.get('relance_effectuee', False),
+                date_relance=_parse_date(med.get('date_relance')),
+                date_resolution=_parse_date(med.get('date_resolution'))
+            ))
+    
+    for operation_id, concessionnaires in par_operation('concessionnaires_demo'):
+        for concessionnaire, donnees in concessionnaires.items():
+            for ordre, etape in enumerate(donnees.get('etapes', []), start=1):
+                session.add(EtapeConcessionnaire(
+                    operation_id=operation_id,
+                    concessionnaire=concessionnaire,
+                    statut_global=donnees.get('statut_global'),
+                    ordre=ordre,
+                    nom=etape['nom'],
+                    statut=etape.get('statut'),
+                    date=etape.get('date')
+                ))
+    
+    for operation_id, dgd in par_operation('dgd_demo'):
+        for lot in dgd.get('lots', []):
+            session.add(LotDGD(
+                operation_id=operation_id,
+                nom=lot['nom'],
+                marche_initial=lot.get('marche_initial', 0),
+                quantites_reelles=lot.get('quantites_reelles', 100),
+                plus_moins_value=lot.get('plus_moins_value', 0),
+                penalites=lot.get('penalites', 0),
+                montant_final=lot.get('montant_final'),
+                statut=lot.get('statut')
+            ))
+    
+    for operation_id, reclamations in par_operation('gpa_demo'):
+        for reclamation in reclamations:
+            session.add(ReclamationGPA(
+                operation_id=operation_id,
+                date=_parse_date(reclamation.get('date')),
+                logement=reclamation.get('logement'),
+                type=reclamation.get('type'),
+                description=reclamation.get('description'),
+                locataire=reclamation.get('locataire'),
+                statut=reclamation.get('statut'),
+                delai_intervention=reclamation.get('delai_intervention'),
+                entreprise=reclamation.get('entreprise'),
+                date_resolution=_parse_date(reclamation.get('date_resolution'))
+            ))
+
+@st.cache_resource
+def get_engine():
+    """Moteur SQLAlchemy unique par processus, avec pool de connexions"""
+    if DATABASE_URL.startswith("sqlite"):
+        engine = create_engine(
+            DATABASE_URL,
+            pool_size=5,
+            max_overflow=10,
+            pool_pre_ping=True,
+            connect_args={"check_same_thread": False}
+        )
+        event.listen(engine, "connect", _configurer_sqlite)
+    else:
+        engine = create_engine(
+            DATABASE_URL,
+            pool_size=10,
+            max_overflow=20,
+            pool_pre_ping=True,
+            pool_recycle=1800
+        )
+    
+    Base.metadata.create_all(engine)
+    
+    # Première initialisation : import des données de démonstration
+    with Session(engine) as session:
+        if session.scalar(select(func.count(Operation.id))) == 0:
+            seed_database(session, load_demo_data())
+            session.commit()
+        if session.scalar(select(func.count(ActiviteMensuelle.id))) == 0:
+            reconstruire_activite_mensuelle(session)
+            session.commit()
+    
+    return engine
+
+@st.cache_resource
+def get_session_factory():
+    """Fabrique de sessions partagée"""
+    return sessionmaker(bind=get_engine(), expire_on_commit=False)
+
+def get_session():
+    """Nouvelle session (à utiliser dans un bloc with)"""
+    return get_session_factory()()
+
+# Colonnes autorisées pour le tri du portefeuille
+TRIS_OPERATIONS = {
+    "avancement": Operation.avancement,
+    "date_fin_prevue": Operation.date_fin_prevue,
+    "freins_actifs": Operation.freins_actifs
+}
+
+def _filtrer_operations(query, type_operation=None, statut=None, commune=None):
+    """Applique les filtres du portefeuille à une requête SQL"""
+    if type_operation:
+        query = query.where(Operation.type_operation == type_operation)
+    if statut:
+        query = query.where(Operation.statut == statut)
+    if commune:
+        query = query.where(Operation.commune == commune)
+    return query
+
+def load_operations(type_operation=None, statut=None, commune=None, limit=None):
+    """Charge les opérations filtrées directement en SQL"""
+    query = _filtrer_operations(select(Operation).order_by(Operation.id), type_operation, statut, commune)
+    if limit:
+        query = query.limit(limit)
+    
+    with get_session() as session:
+        return [op.to_dict() for op in session.scalars(query)]
+
+def load_operations_par_ids(ids):
+    """Charge les opérations d'une liste d'identifiants, dans l'ordre donné"""
+    ids = [int(i) for i in ids]
+    if not ids:
+        return []
+    with get_session() as session:
+        operations = {op.id: op.to_dict() for op in session.scalars(select(Operation).where(Operation.id.in_(ids)))}
+    return [operations[i] for i in ids if i in operations]
+
+def load_operation(operation_id):
+    """Charge une opération par son identifiant"""
+    with get_session() as session:
+        op = session.get(Operation, operation_id)
+        return op.to_dict() if op else None
+
+def load_operation_records(model, operation_id, *order_by):
+    """Charge les lignes d'une table pour une seule opération (index operation_id)"""
+    query = select(model).where(model.operation_id == operation_id).order_by(*(order_by or (model.id,)))
+    with get_session() as session:
+        return [row.to_dict() for row in session.scalars(query)]
+
+def load_concessionnaires(operation_id):
+    """Étapes concessionnaires d'une opération (table typée du moteur d'étapes)"""
+    requete = select(*EtapeConcessionnaire.__table__.columns).where(EtapeConcessionnaire.operation_id == operation_id)
+    with get_session() as session:
+        return preparer_etapes_concessionnaires(pd.read_sql(requete, session.connection()))
+
+def load_dgd(operation_id):
+    """Lots DGD et synthèse financière d'une opération (recalculées par le moteur DGD)"""
+    requete = select(*LotDGD.__table__.columns).where(LotDGD.operation_id == operation_id)
+    with get_session() as session:
+        lots = pd.read_sql(requete, session.connection())
+    return get_moteur_dgd().calculer(lots).get(operation_id, {})
+
+# ==============================================================================
+# 3. ACCÈS DONNÉES PAR OPÉRATION (CACHE CIBLÉ)
+# ==============================================================================
+
+# Nombre d'opérations gardées en cache (les moins récemment lues sont évincées)
+CAPACITE_CACHE_OPERATIONS = int(os.environ.get("OPCOPILOT_CAPACITE_CACHE", 2000))
+
+class CacheOperations:
+    """
+    Cache process-wide des données d'opération, indexé par operation_id puis domaine
+    - Chaque domaine (phases, rem, avenants...) est chargé à la demande
+    - L'invalidation d'une opération ne touche que ses propres entrées
+    - Au-delà de la capacité, les opérations les moins récemment lues sont évincées (LRU)
+    - Les valeurs retournées sont partagées : ne pas les modifier
+    """
+    
+    def __init__(self, capacite=CAPACITE_CACHE_OPERATIONS):
+        self._lock = threading.RLock()
+        self.capacite = capacite
+        self._operations = OrderedDict()  # operation_id -> {domaine: valeur}, ordre LRU
+        self._globales = {}  # domaine -> (version globale, version de la donnée, valeur)
+        self._versions = {}
+        self._abonnes = []
+        self.version_globale = 0
+    
+    def abonner(self, callback):
+        """callback() appelé après chaque invalidation (écriture en base)"""
+        self._abonnes.append(callback)
+    
+    def _notifier(self):
+        for callback in self._abonnes:
+            callback()
+    
+    def version(self, operation_id):
+        """Version des données d'une opération (incrémentée à chaque invalidation)"""
+        with self._lock:
+            return self._versions.get(operation_id, 0)
+    
+    def get(self, domaine, operation_id, loader):
+        with self._lock:
+            entrees = self._operations.get(operation_id)
+            if entrees is not None:
+                self._operations.move_to_end(operation_id)
+                if domaine in entrees:
+                    return entrees[domaine]
+            version = self._versions.get(operation_id, 0)
+        
+        valeur = loader(operation_id)
+        
+        with self._lock:
+            # Ne pas publier une valeur invalidée pendant son chargement
+            if self._versions.get(operation_id, 0) == version:
+                self._operations.setdefault(operation_id, {})[domaine] = valeur
+                self._operations.move_to_end(operation_id)
+                while len(self._operations) > self.capacite:
+                    self._operations.popitem(last=False)
+        return valeur
+    
+    def absents(self, domaine, operation_ids):
+        """Opérations dont le domaine n'est pas en cache (à charger groupées)"""
+        with self._lock:
+            return [operation_id for operation_id in operation_ids
+                    if domaine not in self._operations.get(operation_id, ())]
+    
+    def versions(self):
+        """Copie des versions de toutes les opérations modifiées depuis le démarrage"""
+        with self._lock:
+            return dict(self._versions)
+    
+    def get_global(self, domaine, loader, version=None):
+        """
+        Donnée de portefeuille, recalculée quand une opération change
+        version : dépendance supplémentaire (jour, paramétrage...) ; une seule entrée par domaine
+        """
+        with self._lock:
+            version_globale = self.version_globale
+            entree = self._globales.get(domaine)
+            if entree is not None and entree[:2] == (version_globale, version):
+                return entree[2]
+        
+        valeur = loader()
+        
+        with self._lock:
+            if self.version_globale == version_globale:
+                self._globales[domaine] = (version_globale, version, valeur)
+        return valeur
+    
+    def invalidate(self, operation_id, domaines=None):
+        """Invalide tout ou partie des domaines d'une seule opération"""
+        with self._lock:
+            if domaines is None:
+                self._operations.pop(operation_id, None)
+            else:
+                entrees = self._operations.get(operation_id, {})
+                for domaine in domaines:
+                    entrees.pop(domaine, None)
+            self._versions[operation_id] = self._versions.get(operation_id, 0) + 1
+            self.version_globale += 1
+        self._notifier()
+    
+    def invalidate_domaines(self, *domaines):
+        """Invalide un domaine pour toutes les opérations (ex : référentiel rechargé)"""
+        with self._lock:
+            for operation_id, entrees in self._operations.items():
+                presents = [domaine for domaine in domaines if domaine in entrees]
+                for domaine in presents:
+                    del entrees[domaine]
+                if presents:
+                    self._versions[operation_id] = self._versions.get(operation_id, 0) + 1
+            for domaine in domaines:
+                self._globales.pop(domaine, None)
+            self.version_globale += 1
+        self._notifier()
+    
+    def clear(self):
+        with self._lock:
+            self._operations.clear()
+            self._globales.clear()
+            for operation_id in self._versions:
+                self._versions[operation_id] += 1
+            self.version_globale += 1
+        self._notifier()
+
+@st.cache_resource
+def get_cache_operations():
+    """Cache partagé par toutes les sessions du processus"""
+    cache = CacheOperations()
+    
+    def referentiel_modifie(nom):
+        if nom == "templates_phases":
+            cache.invalidate_domaines('planning', 'phases_portefeuille')
+    
+    get_registre_reference().abonner(referentiel_modifie)
+    return cache
+
+def invalidate_operation(operation_id, *domaines):
+    """À appeler après toute écriture sur une opération"""
+    get_cache_operations().invalidate(operation_id, set(domaines) or None)
+
+def get_operation(operation_id):
+    """Opération (dict) ou None"""
+    return get_cache_operations().get('operation', operation_id, load_operation)
+
+def get_phases(operation_id):
+    """Phases d'une opération triées par ordre"""
+    return get_cache_operations().get(
+        'phases', operation_id,
+        lambda op_id: load_operation_records(Phase, op_id, Phase.ordre)
+    )
+
+def calculer_indicateurs_rem(rem):
+    """Écarts et pourcentages d'avancement REM/travaux, en une passe vectorisée"""
+    rem = rem.copy()
+    rem['ecart_rem'] = rem['rem_realisee'] - rem['rem_projetee']
+    rem['ecart_depenses'] = rem['depenses_facturees'] - rem['depenses_projetees']
+    for colonne, realise, projete in (('avancement_rem', 'rem_realisee', 'rem_projetee'),
+                                      ('avancement_travaux', 'depenses_facturees', 'depenses_projetees')):
+        base = rem[projete].to_numpy(dtype=float)
+        pourcentage = np.divide(rem[realise].to_numpy(dtype=float) * 100, base, out=np.zeros_like(base), where=base > 0)
+        rem[colonne] = np.floor(pourcentage + 0.5).astype(int)
+    return rem
+
+def load_rem(operation_id):
+    """Trimestres REM d'une opération (table colonnes) avec écarts et avancements calculés"""
+    requete = (select(*(getattr(RemTrimestre, colonne) for colonne in COLONNES_REM_SAISIES))
+               .where(RemTrimestre.operation_id == operation_id)
+               .order_by(RemTrimestre.annee, RemTrimestre.numero_trimestre))
+    with get_session() as session:
+        return calculer_indicateurs_rem(pd.read_sql(requete, session.connection()))
+
+def get_rem(operation_id):
+    """Trimestres REM d'une opération (DataFrame partagé : ne pas modifier)"""
+    return get_cache_operations().get('rem', operation_id, load_rem)
+
+def calculer_cumuls_avenants(avenants):
+    """
+    Impacts cumulés par opération, dans l'ordre chronologique
+    cumul_* : avenants non refusés • cumul_*_valide : avenants validés seuls
+    """
+    avenants = avenants.assign(date=pd.to_datetime(avenants['date']))
+    avenants = avenants.sort_values(['operation_id', 'date', 'numero'], na_position='last', kind='stable').reset_index(drop=True)
+    retenus = avenants['statut'] != 'REFUSE'
+    valides = avenants['statut'] == 'VALIDE'
+    for nom, colonne in (('budget', 'impact_budget'), ('delai', 'impact_delai')):
+        impacts = avenants[colonne].fillna(0).astype(int)
+        avenants[colonne] = impacts
+        avenants[f'cumul_{nom}'] = impacts.where(retenus, 0).groupby(avenants['operation_id']).cumsum()
+        avenants[f'cumul_{nom}_valide'] = impacts.where(valides, 0).groupby(avenants['operation_id']).cumsum()
+    return avenants
+
+def load_avenants(operation_id):
+    """Avenants d'une opération (table colonnes) avec impacts cumulés"""
+    requete = select(*Avenant.__table__.columns).where(Avenant.operation_id == operation_id)
+    with get_session() as session:
+        return calculer_cumuls_avenants(pd.read_sql(requete, session.connection()))
+
+def get_avenants(operation_id):
+    """Avenants d'une opération (DataFrame partagé : ne pas modifier)"""
+    return get_cache_operations().get('avenants', operation_id, load_avenants)
+
+def get_med(operation_id):
+    """Mises en demeure d'une opération"""
+    return get_cache_operations().get(
+        'med', operation_id,
+        lambda op_id: load_operation_records(Med, op_id)
+    )
+
+def get_concessionnaires(operation_id):
+    """Étapes concessionnaires d'une opération (DataFrame partagé : ne pas modifier)"""
+    return get_cache_operations().get('concessionnaires', operation_id, load_concessionnaires)
+
+def get_dgd(operation_id):
+    """Lots DGD et synthèse d'une opération"""
+    return get_cache_operations().get('dgd', operation_id, load_dgd)
+
+def get_gpa(operation_id):
+    """Réclamations GPA d'une opération"""
+    return get_cache_operations().get(
+        'gpa', operation_id,
+        lambda op_id: load_operation_records(ReclamationGPA, op_id)
+    )
+
+class IndexOperations:
+    """
+    Index inversé des opérations sur les champs de filtre du portefeuille
+    - Construit une fois par version des données
+    - Listes de positions triées par valeur, combinées par intersection
+    - Ordres de tri pré-calculés en SQL (avancement, fin prévue, freins)
+    """
+    
+    CHAMPS = ('type_operation', 'statut', 'commune', 'aco_responsable')
+    
+    def __init__(self, session):
+        colonnes = [getattr(Operation, champ) for champ in self.CHAMPS]
+        lignes = session.execute(select(Operation.id, *colonnes).order_by(Operation.id)).all()
+        
+        self.ids = np.array([ligne[0] for ligne in lignes], dtype=np.int64)
+        self.nb_operations = len(lignes)
+        self.valeurs = {}
+        self.codes = {}
+        self.postings = {}
+        
+        for j, champ in enumerate(self.CHAMPS, start=1):
+            codes, valeurs = pd.factorize(pd.Series([ligne[j] or "" for ligne in lignes], dtype=object), sort=True)
+            self.valeurs[champ] = list(valeurs)
+            self.codes[champ] = codes.astype(np.int32)
+            positions = np.argsort(codes, kind='stable').astype(np.int32)
+            bornes = np.searchsorted(codes[positions], np.arange(len(valeurs) + 1))
+            self.postings[champ] = {
+                valeur: positions[bornes[k]:bornes[k + 1]] for k, valeur in enumerate(valeurs)
+            }
+        
+        # Ordres de tri : positions dans l'ordre renvoyé par la base
+        rang = {op_id: i for i, op_id in enumerate(self.ids.tolist())}
+        self.ordres = {}
+        for tri, colonne in TRIS_OPERATIONS.items():
+            for decroissant in (False, True):
+                ordre = colonne.desc() if decroissant else colonne.asc()
+                ids_tries = session.scalars(select(Operation.id).order_by(ordre.nulls_last(), Operation.id)).all()
+                self.ordres[(tri, decroissant)] = np.array([rang[i] for i in ids_tries], dtype=np.int32)
+    
+    def rechercher(self, **filtres):
+        """Positions des opérations satisfaisant tous les filtres (None = toutes)"""
+        listes = []
+        for champ, valeur in filtres.items():
+            if valeur is None:
+                continue
+            liste = self.postings[champ].get(valeur)
+            if liste is None:
+                return np.empty(0, dtype=np.int32)
+            listes.append(liste)
+        
+        if not listes:
+            return None
+        
+        # Intersection en partant de la liste la plus courte
+        listes.sort(key=len)
+        resultat = listes[0]
+        for liste in listes[1:]:
+            resultat = np.intersect1d(resultat, liste, assume_unique=True)
+            if len(resultat) == 0:
+                break
+        return resultat
+    
+    def options(self, champ, **filtres):
+        """Valeurs d'un champ et effectifs, compte tenu des autres filtres"""
+        autres = {c: v for c, v in filtres.items() if c != champ}
+        positions = self.rechercher(**autres)
+        codes = self.codes[champ] if positions is None else self.codes[champ][positions]
+        effectifs = np.bincount(codes, minlength=len(self.valeurs[champ]))
+        return {valeur: int(n) for valeur, n in zip(self.valeurs[champ], effectifs) if valeur}
+    
+    def ids_filtres(self, **filtres):
+        """Identifiants des opérations filtrées, par ordre d'identifiant"""
+        positions = self.rechercher(**filtres)
+        return self.ids if positions is None else self.ids[positions]
+    
+    def page(self, page=1, taille_page=20, tri="avancement", decroissant=False, **filtres):
+        """Identifiants de la page demandée et nombre total d'opérations filtrées"""
+        ordre = self.ordres[(tri, decroissant)]
+        positions = self.rechercher(**filtres)
+        if positions is not None:
+            masque = np.zeros(self.nb_operations, dtype=bool)
+            masque[positions] = True
+            ordre = ordre[masque[ordre]]
+        debut = (max(page, 1) - 1) * taille_page
+        return self.ids[ordre[debut:debut + taille_page]].tolist(), len(ordre)
+
+def construire_index_operations():
+    """Construit l'index inversé à partir de la base"""
+    with get_session() as session:
+        return IndexOperations(session)
+
+def get_index_operations():
+    """Index inversé du portefeuille, reconstruit quand les données changent"""
+    return get_cache_operations().get_global('index_operations', construire_index_operations)
+
+def get_operations_page(page=1, taille_page=20, tri="avancement", decroissant=False, **filtres):
+    """Page d'opérations filtrée et triée via l'index, puis chargée par identifiants"""
+    ids_page, total = get_index_operations().page(page, taille_page, tri, decroissant, **filtres)
+    return load_operations_par_ids(ids_page), total
+
+# ==============================================================================
+# 4. MOTEURS DE CALCUL PORTEFEUILLE
+# ==============================================================================
+
+# --- KPIs ACO -----------------------------------------------------------------
+
+COLONNES_KPIS = ['operations_actives', 'operations_cloturees', 'freins_actifs', 'freins_critiques',
+                 'phases_retard', 'echeances_semaine', 'validations_requises']
+
+def load_frames_kpis(operation_ids=None):
+    """Tables colonnes (opérations, phases, REM, avenants) pour le calcul des KPIs"""
+    requetes = {
+        'operations': select(Operation.id, Operation.aco_responsable, Operation.statut, Operation.freins_actifs),
+        'phases': select(Phase.operation_id, Phase.statut, Phase.est_critique, Phase.date_fin_prevue),
+        'rem': select(RemTrimestre.operation_id, RemTrimestre.annee, RemTrimestre.rem_projetee, RemTrimestre.rem_realisee),
+        'avenants': select(Avenant.operation_id, Avenant.statut)
+    }
+    if operation_ids is not None:
+        ids = list(operation_ids)
+        requetes['operations'] = requetes['operations'].where(Operation.id.in_(ids))
+        for nom, model in (('phases', Phase), ('rem', RemTrimestre), ('avenants', Avenant)):
+            requetes[nom] = requetes[nom].where(model.operation_id.in_(ids))
+    
+    with get_session() as session:
+        return {nom: pd.read_sql(requete, session.connection()) for nom, requete in requetes.items()}
+
+def calculer_contributions_kpis(frames, aujourd_hui):
+    """
+    Contribution de chaque opération aux KPIs (une ligne par opération)
+    Calcul vectorisé : masques booléens puis groupby par operation_id
+    """
+    ops = frames['operations'].set_index('id')
+    contributions = pd.DataFrame(index=ops.index)
+    contributions['aco_responsable'] = ops['aco_responsable'].fillna('')
+    contributions['operations_actives'] = (ops['statut'] != 'CLOTUREE').astype(int)
+    contributions['operations_cloturees'] = (ops['statut'] == 'CLOTUREE').astype(int)
+    contributions['freins_actifs'] = ops['freins_actifs'].fillna(0).astype(int)
+    
+    phases = frames['phases']
+    fin_prevue = pd.to_datetime(phases['date_fin_prevue'])
+    non_validee = phases['statut'] != 'VALIDEE'
+    en_retard = (phases['statut'] == 'RETARD') | (non_validee & (fin_prevue < aujourd_hui))
+    indicateurs_phases = pd.DataFrame({
+        'operation_id': phases['operation_id'],
+        'freins_critiques': (phases['statut'].isin(['RETARD', 'CRITIQUE']) & phases['est_critique'].fillna(False).astype(bool)),
+        'phases_retard': en_retard,
+        'echeances_semaine': non_validee & (fin_prevue >= aujourd_hui) & (fin_prevue < aujourd_hui + pd.Timedelta(days=7)),
+        'validations_phases': phases['statut'] == 'VALIDATION_REQUISE'
+    }).groupby('operation_id').sum()
+    
+    avenants = frames['avenants']
+    validations_avenants = (avenants['statut'] == 'EN_COURS').groupby(avenants['operation_id']).sum()
+    
+    contributions = contributions.join(indicateurs_phases)
+    contributions['validations_requises'] = contributions.pop('validations_phases').fillna(0) + validations_avenants.reindex(contributions.index).fillna(0)
+    return contributions.fillna(0).astype({colonne: int for colonne in COLONNES_KPIS})
+
+def calculer_rem_annuelle(frames):
+    """REM prévue/réalisée par opération et par année"""
+    rem = frames['rem']
+    return rem.groupby(['operation_id', 'annee'], as_index=False)[['rem_projetee', 'rem_realisee']].sum()
+
+class MoteurKPIs:
+    """
+    KPIs ACO calculés depuis les opérations, phases, REM et avenants
+    - Contributions par opération conservées en mémoire
+    - Seules les opérations modifiées (version du cache) sont recalculées
+    - Résultats agrégés mis en cache par ACO
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contributions = None
+        self._rem = None
+        self._versions = {}
+        self._jour = None
+        self._resultats = {}
+    
+    def _rafraichir(self):
+        cache = get_cache_operations()
+        aujourd_hui = pd.Timestamp(date.today())
+        versions = cache.versions()
+        
+        if self._contributions is None or self._jour != aujourd_hui:
+            # Calcul complet (premier appel ou changement de jour pour les échéances)
+            frames = load_frames_kpis()
+            self._contributions = calculer_contributions_kpis(frames, aujourd_hui)
+            self._rem = calculer_rem_annuelle(frames)
+            self._resultats.clear()
+        else:
+            modifiees = [op_id for op_id, version in versions.items() if self._versions.get(op_id) != version]
+            if not modifiees:
+                return
+            
+            frames = load_frames_kpis(modifiees)
+            nouvelles = calculer_contributions_kpis(frames, aujourd_hui)
+            acos_touches = set(self._contributions['aco_responsable'].reindex(modifiees).dropna()) | set(nouvelles['aco_responsable'])
+            
+            self._contributions = pd.concat([self._contributions.drop(index=modifiees, errors='ignore'), nouvelles]).sort_index()
+            self._rem = pd.concat([self._rem[~self._rem['operation_id'].isin(modifiees)], calculer_rem_annuelle(frames)], ignore_index=True)
+            
+            for aco in acos_touches | {None}:
+                self._resultats.pop(aco, None)
+        
+        self._versions = versions
+        self._jour = aujourd_hui
+    
+    def kpis(self, aco=None):
+        """KPIs d'un ACO, ou de tout le portefeuille si aco est None"""
+        with self._lock:
+            self._rafraichir()
+            if aco in self._resultats:
+                return self._resultats[aco]
+            
+            contributions = self._contributions
+            if aco is not None:
+                contributions = contributions[contributions['aco_responsable'] == aco]
+            kpis = {colonne: int(contributions[colonne].sum()) for colonne in COLONNES_KPIS}
+            
+            rem = self._rem[self._rem['operation_id'].isin(contributions.index)]
+            annees_realisees = rem.loc[rem['rem_realisee'] > 0, 'annee']
+            annee = int(annees_realisees.max()) if not annees_realisees.empty else date.today().year
+            rem_annee = rem[rem['annee'] == annee]
+            kpis['annee_rem'] = annee
+            kpis['rem_realisee'] = int(rem_annee['rem_realisee'].sum())
+            kpis['rem_prevue'] = int(rem_annee['rem_projetee'].sum())
+            kpis['taux_realisation_rem'] = round(kpis['rem_realisee'] / kpis['rem_prevue'] * 100) if kpis['rem_prevue'] else 0
+            
+            self._resultats[aco] = kpis
+            return kpis
+    
+    def kpis_par_aco(self):
+        """Tableau des KPIs de tous les ACO (vue direction)"""
+        with self._lock:
+            self._rafraichir()
+            return self._contributions.groupby('aco_responsable')[COLONNES_KPIS].sum()
+
+@st.cache_resource
+def get_moteur_kpis():
+    """Moteur KPIs partagé par toutes les sessions"""
+    return MoteurKPIs()
+
+# --- Activité mensuelle --------------------------------------------------------
+
+COLONNES_ACTIVITE = ['rem_realisee', 'operations_actives', 'phases_validees', 'alertes_resolues']
+
+def _premier_du_mois(dates):
+    """Série de dates ramenée au premier jour du mois"""
+    return pd.to_datetime(dates).dt.to_period('M').dt.to_timestamp().dt.date
+
+def appliquer_deltas_activite(session, deltas):
+    """
+    Ajoute des variations à la table d'agrégats mensuels (upsert groupé)
+    deltas : DataFrame (mois, aco_responsable, commune, + colonnes d'activité)
+    """
+    if deltas.empty:
+        return
+    cles = ['mois', 'aco_responsable', 'commune']
+    deltas = deltas.assign(**{c: deltas[c].fillna('') for c in cles[1:]})
+    deltas = deltas.groupby(cles, as_index=False)[[c for c in COLONNES_ACTIVITE if c in deltas]].sum()
+    
+    existantes = {
+        (ligne.mois, ligne.aco_responsable, ligne.commune): ligne
+        for ligne in session.scalars(select(ActiviteMensuelle).where(ActiviteMensuelle.mois.in_(set(deltas['mois']))))
+    }
+    for enregistrement in deltas.to_dict('records'):
+        cle = tuple(enregistrement[c] for c in cles)
+        ligne = existantes.get(cle)
+        if ligne is None:
+            ligne = ActiviteMensuelle(**dict(zip(cles, cle)), **{c: 0 for c in COLONNES_ACTIVITE})
+            session.add(ligne)
+            existantes[cle] = ligne
+        for colonne in COLONNES_ACTIVITE:
+            if colonne in enregistrement:
+                setattr(ligne, colonne, (getattr(ligne, colonne) or 0) + int(enregistrement[colonne]))
+
+def _mois_actifs(operations):
+    """Une ligne par (opération, mois) entre début et fin prévus"""
+    ops = operations.dropna(subset=['date_debut_prevue', 'date_fin_prevue'])
+    debut = pd.to_datetime(ops['date_debut_prevue']).dt.to_period('M')
+    fin = pd.to_datetime(ops['date_fin_prevue']).dt.to_period('M')
+    nb_mois = (fin.astype('int64') - debut.astype('int64') + 1).clip(lower=0).to_numpy()
+    
+    lignes = ops.loc[ops.index.repeat(nb_mois), ['aco_responsable', 'commune']].reset_index(drop=True)
+    decalages = np.arange(nb_mois.sum()) - np.repeat(np.cumsum(nb_mois) - nb_mois, nb_mois)
+    mois = np.repeat(debut.astype('int64').to_numpy(), nb_mois) + decalages
+    lignes['mois'] = pd.PeriodIndex.from_ordinals(mois, freq='M').to_timestamp().date
+    lignes['operations_actives'] = 1
+    return lignes
+
+def reconstruire_activite_mensuelle(session):
+    """Matérialisation complète des agrégats depuis l'historique (initialisation)"""
+    connexion = session.connection()
+    ops = pd.read_sql(select(Operation.id, Operation.aco_responsable, Operation.commune,
+                             Operation.date_debut_prevue, Operation.date_fin_prevue), connexion)
+    phases = pd.read_sql(select(Phase.operation_id, Phase.date_fin_reelle)
+                         .where(Phase.statut == 'VALIDEE', Phase.date_fin_reelle.isnot(None)), connexion)
+    rem = pd.read_sql(select(RemTrimestre.operation_id, RemTrimestre.annee, RemTrimestre.numero_trimestre,
+                             RemTrimestre.rem_realisee).where(RemTrimestre.rem_realisee > 0), connexion)
+    
+    localisation = ops.set_index('id')[['aco_responsable', 'commune']]
+    
+    phases = phases.join(localisation, on='operation_id')
+    phases['mois'] = _premier_du_mois(phases['date_fin_reelle'])
+    phases['phases_validees'] = 1
+    
+    rem = rem.join(localisation, on='operation_id')
+    # REM rattachée au dernier mois du trimestre
+    rem['mois'] = [date(int(a), int(t) * 3, 1) for a, t in zip(rem['annee'], rem['numero_trimestre'])]
+    
+    session.execute(ActiviteMensuelle.__table__.delete())
+    appliquer_deltas_activite(session, pd.concat([
+        _mois_actifs(ops),
+        phases[['mois', 'aco_responsable', 'commune', 'phases_validees']],
+        rem[['mois', 'aco_responsable', 'commune', 'rem_realisee']]
+    ], ignore_index=True).fillna(0))
+
+def enregistrer_phase_validee(session, operation, date_validation):
+    """Mise à jour incrémentale : une phase vient d'être validée"""
+    appliquer_deltas_activite(session, pd.DataFrame([{
+        'mois': date_validation.replace(day=1),
+        'aco_responsable': operation.get('aco_responsable'),
+        'commune': operation.get('commune'),
+        'phases_validees': 1
+    }]))
+
+def enregistrer_rem_trimestre(session, operation, annee, numero_trimestre, delta_rem_realisee):
+    """Mise à jour incrémentale : saisie ou correction d'un trimestre REM"""
+    appliquer_deltas_activite(session, pd.DataFrame([{
+        'mois': date(int(annee), int(numero_trimestre) * 3, 1),
+        'aco_responsable': operation.get('aco_responsable'),
+        'commune': operation.get('commune'),
+        'rem_realisee': delta_rem_realisee
+    }]))
+
+def enregistrer_alerte_resolue(session, operation, date_resolution):
+    """Mise à jour incrémentale : une alerte vient d'être résolue"""
+    appliquer_deltas_activite(session, pd.DataFrame([{
+        'mois': date_resolution.replace(day=1),
+        'aco_responsable': operation.get('aco_responsable'),
+        'commune': operation.get('commune'),
+        'alertes_resolues': 1
+    }]))
+
+def enregistrer_periode_operation(session, operation_avant, operation_apres):
+    """Mise à jour incrémentale des opérations actives (création ou replanification)"""
+    lignes = []
+    for operation, signe in ((operation_avant, -1), (operation_apres, 1)):
+        if operation:
+            mois = _mois_actifs(pd.DataFrame([operation]))
+            mois['operations_actives'] *= signe
+            lignes.append(mois)
+    if lignes:
+        appliquer_deltas_activite(session, pd.concat(lignes, ignore_index=True))
+
+def load_activite_mensuelle(debut, fin, aco=None, commune=None):
+    """Série mensuelle agrégée (une ligne par mois) sur une période"""
+    query = (select(ActiviteMensuelle.mois, *[func.sum(getattr(ActiviteMensuelle, c)).label(c) for c in COLONNES_ACTIVITE])
+             .where(ActiviteMensuelle.mois >= debut, ActiviteMensuelle.mois <= fin)
+             .group_by(ActiviteMensuelle.mois)
+             .order_by(ActiviteMensuelle.mois))
+    if aco:
+        query = query.where(ActiviteMensuelle.aco_responsable == aco)
+    if commune:
+        query = query.where(ActiviteMensuelle.commune == commune)
+    
+    with get_session() as session:
+        return pd.read_sql(query, session.connection())
+
+# --- Planification : chemin critique ---------------------------------------------
+
+class DagPhases:
+    """
+    Graphe de dépendances (DAG) des phases d'un type d'opération
+    - Prédécesseurs explicites via la clé 'predecesseurs' (liste d'ordres) si présente
+    - Sinon : les phases non jalons démarrent après le jalon précédent,
+      et chaque jalon attend toutes les phases ouvertes depuis ce jalon
+    """
+    
+    def __init__(self, phases_template):
+        phases = sorted(phases_template, key=lambda p: p['ordre'])
+        index = {p['ordre']: i for i, p in enumerate(phases)}
+        
+        self.ordres = tuple(p['ordre'] for p in phases)
+        self.index = index
+        self.noms = tuple(p['nom'] for p in phases)
+        self.durees = tuple(int(p.get('duree_jours') or 0) for p in phases)
+        self.jalons = tuple(bool(p.get('est_jalon', False)) for p in phases)
+        self.responsables = tuple(p.get('responsable_type') or p.get('responsable') for p in phases)
+        
+        preds = []
+        dernier_jalon = None
+        depuis_jalon = []
+        for i, phase in enumerate(phases):
+            if phase.get('predecesseurs'):
+                preds.append(tuple(index[o] for o in phase['predecesseurs'] if o in index))
+            elif self.jalons[i]:
+                preds.append(tuple(depuis_jalon) if depuis_jalon else ((dernier_jalon,) if dernier_jalon is not None else ()))
+                dernier_jalon = i
+                depuis_jalon = []
+            else:
+                preds.append((dernier_jalon,) if dernier_jalon is not None else ())
+                depuis_jalon.append(i)
+        self.preds = tuple(preds)
+        
+        succs = [[] for _ in phases]
+        for i, pr in enumerate(self.preds):
+            for p in pr:
+                succs[p].append(i)
+        self.succs = tuple(tuple(s) for s in succs)
+        
+        # Ordre topologique (Kahn), O(V + E)
+        degres = [len(pr) for pr in self.preds]
+        file = deque(i for i, d in enumerate(degres) if d == 0)
+        topo = []
+        while file:
+            i = file.popleft()
+            topo.append(i)
+            for s in self.succs[i]:
+                degres[s] -= 1
+                if degres[s] == 0:
+                    file.append(s)
+        if len(topo) != len(phases):
+            raise ValueError("Cycle dans les dépendances de phases")
+        self.topo = tuple(topo)
+        self.rang = {i: r for r, i in enumerate(topo)}
+    
+    def __len__(self):
+        return len(self.ordres)
+
+@st.cache_resource(max_entries=64)
+def _construire_dag_phases(type_operation, version_templates):
+    phases = load_templates_phases().get(type_operation, {}).get('phases', [])
+    return DagPhases(phases) if phases else None
+
+def get_dag_phases(type_operation):
+    """DAG du template d'un type d'opération (None si type inconnu), suit les rechargements"""
+    load_templates_phases()
+    return _construire_dag_phases(type_operation, get_registre_reference().version("templates_phases"))
+
+class PlanningOperation:
+    """
+    Planning CPM d'une opération (dates en jours depuis le début de l'opération)
+    - Passe avant : début/fin au plus tôt, dates réelles prioritaires
+    - Passe arrière : début/fin au plus tard, marge totale
+    - Mise à jour incrémentale : seuls les successeurs (puis prédécesseurs) touchés sont recalculés
+    """
+    
+    def __init__(self, dag, date_origine, aujourd_hui=None):
+        n = len(dag)
+        self._lock = threading.Lock()
+        self.dag = dag
+        self.origine = date_origine
+        self.jour = ((aujourd_hui or date.today()) - date_origine).days
+        self.durees = list(dag.durees)
+        self.decalages = [0] * n
+        self.debut_reel = [None] * n
+        self.fin_reel = [None] * n
+        self.statuts = [None] * n
+        self.deduits = [False] * n
+        self.responsables = list(dag.responsables)
+        self.es = [0] * n
+        self.ef = [0] * n
+        self.ls = [0] * n
+        self.lf = [0] * n
+        self.fin_projet = 0
+    
+    def _jours(self, valeur):
+        valeur = _parse_date(valeur)
+        return None if valeur is None else (valeur - self.origine).days
+    
+    def _au_plus_tot(self, i):
+        es = max((self.ef[p] for p in self.dag.preds[i]), default=0)
+        if self.debut_reel[i] is not None:
+            es = self.debut_reel[i]
+        if self.fin_reel[i] is not None:
+            return es, max(self.fin_reel[i], es)
+        ef = es + self.durees[i] + self.decalages[i]
+        if self.debut_reel[i] is not None:
+            # Phase démarrée non terminée : ne peut finir avant aujourd'hui
+            ef = max(ef, self.jour)
+        return es, ef
+    
+    def _deduire_statuts(self):
+        """Phases sans statut antérieures à la dernière phase démarrée : considérées validées"""
+        dernier_demarre = max((i for i, debut in enumerate(self.debut_reel) if debut is not None), default=-1)
+        for i in range(len(self.dag)):
+            if self.deduits[i] and i >= dernier_demarre:
+                self.statuts[i], self.deduits[i] = None, False
+            elif self.statuts[i] is None and i < dernier_demarre:
+                self.statuts[i], self.deduits[i] = 'VALIDEE', True
+    
+    def _au_plus_tard(self, i):
+        lf = min((self.ls[s] for s in self.dag.succs[i]), default=self.fin_projet)
+        return lf - (self.ef[i] - self.es[i]), lf
+    
+    def calculer(self):
+        """Calcul complet (passes avant et arrière)"""
+        for i in self.dag.topo:
+            self.es[i], self.ef[i] = self._au_plus_tot(i)
+        self.fin_projet = max(self.ef, default=0)
+        for i in reversed(self.dag.topo):
+            self.ls[i], self.lf[i] = self._au_plus_tard(i)
+        return self
+    
+    def _propager_avant(self, sources):
+        rang = self.dag.rang
+        tas = [(rang[i], i) for i in sources]
+        heapq.heapify(tas)
+        vus, modifies = set(), []
+        while tas:
+            _, i = heapq.heappop(tas)
+            if i in vus:
+                continue
+            vus.add(i)
+            dates = self._au_plus_tot(i)
+            if dates == (self.es[i], self.ef[i]):
+                continue
+            self.es[i], self.ef[i] = dates
+            modifies.append(i)
+            for s in self.dag.succs[i]:
+                heapq.heappush(tas, (rang[s], s))
+        return modifies
+    
+    def _propager_arriere(self, sources):
+        rang = self.dag.rang
+        tas = [(-rang[i], i) for i in sources]
+        heapq.heapify(tas)
+        vus = set()
+        while tas:
+            _, i = heapq.heappop(tas)
+            if i in vus:
+                continue
+            vus.add(i)
+            dates = self._au_plus_tard(i)
+            if dates == (self.ls[i], self.lf[i]):
+                continue
+            self.ls[i], self.lf[i] = dates
+            for p in self.dag.preds[i]:
+                heapq.heappush(tas, (-rang[p], p))
+    
+    def mettre_a_jour_phase(self, ordre, **changements):
+        """
+        Modifie une phase et recalcule uniquement ce qui en dépend
+        changements : date_debut_reelle, date_fin_reelle, decalage_jours, duree_jours, statut, responsable
+        """
+        i = self.dag.index[ordre]
+        with self._lock:
+            if 'date_debut_reelle' in changements:
+                self.debut_reel[i] = self._jours(changements['date_debut_reelle'])
+            if 'date_fin_reelle' in changements:
+                self.fin_reel[i] = self._jours(changements['date_fin_reelle'])
+            if 'decalage_jours' in changements:
+                self.decalages[i] = int(changements['decalage_jours'])
+            if 'duree_jours' in changements:
+                self.durees[i] = int(changements['duree_jours'])
+            if 'statut' in changements:
+                self.statuts[i], self.deduits[i] = changements['statut'], False
+            if changements.get('responsable'):
+                self.responsables[i] = changements['responsable']
+            self._deduire_statuts()
+            
+            modifies = self._propager_avant([i])
+            if not modifies:
+                return []
+            fin_projet = max(self.ef)
+            if fin_projet != self.fin_projet:
+                # La date de fin change : toutes les dates au plus tard bougent
+                self.fin_projet = fin_projet
+                for j in reversed(self.dag.topo):
+                    self.ls[j], self.lf[j] = self._au_plus_tard(j)
+            else:
+                self._propager_arriere(modifies)
+            return [self.dag.ordres[j] for j in modifies]
+    
+    def date_fin(self):
+        """Date de fin prévisionnelle de l'opération"""
+        return self.origine + timedelta(days=self.fin_projet)
+    
+    def phases(self):
+        """Phases datées au format timeline (toutes les phases du DAG)"""
+        with self._lock:
+            resultat = []
+            for i in range(len(self.dag)):
+                # La marge n'a de sens que pour le reste à faire
+                termine = self.fin_reel[i] is not None or self.statuts[i] == 'VALIDEE'
+                marge = None if termine else self.ls[i] - self.es[i]
+                resultat.append({
+                    "ordre": self.dag.ordres[i],
+                    "nom": self.dag.noms[i],
+                    "statut": self.statuts[i] or 'NON_DEMARREE',
+                    "date_debut_prevue": (self.origine + timedelta(days=self.es[i])).isoformat(),
+                    "date_fin_prevue": (self.origine + timedelta(days=self.ef[i])).isoformat(),
+                    "date_debut_tard": (self.origine + timedelta(days=self.ls[i])).isoformat(),
+                    "date_fin_tard": (self.origine + timedelta(days=self.lf[i])).isoformat(),
+                    "marge_jours": marge,
+                    "responsable": self.responsables[i] or 'Non assigné',
+                    "est_critique": marge is not None and marge <= 0,
+                    "est_jalon": self.dag.jalons[i]
+                })
+            return resultat
+
+def construire_planning(operation, phases_enregistrees):
+    """
+    Planning d'une opération : template du type + phases enregistrées en base
+    Les phases enregistrées fixent dates réelles, durée prévue et statut ;
+    les phases non enregistrées antérieures à une phase démarrée sont considérées validées
+    """
+    dag = get_dag_phases(operation.get('type_operation'))
+    if dag is None:
+        if not phases_enregistrees:
+            return None
+        dag = DagPhases([{**p, 'duree_jours': 0} for p in phases_enregistrees])
+    
+    origine = (_parse_date(operation.get('date_debut_prevue')) or _parse_date(operation.get('date_creation'))
+               or min((_parse_date(p.get('date_debut_reelle') or p.get('date_debut_prevue')) for p in phases_enregistrees
+                       if p.get('date_debut_reelle') or p.get('date_debut_prevue')), default=None)
+               or date.today())
+    planning = PlanningOperation(dag, origine)
+    
+    for phase in phases_enregistrees:
+        i = dag.index.get(phase['ordre'])
+        if i is None:
+            continue
+        debut_prevu, fin_prevue = _parse_date(phase.get('date_debut_prevue')), _parse_date(phase.get('date_fin_prevue'))
+        if debut_prevu and fin_prevue:
+            planning.durees[i] = (fin_prevue - debut_prevu).days
+        planning.debut_reel[i] = planning._jours(phase.get('date_debut_reelle'))
+        planning.fin_reel[i] = planning._jours(phase.get('date_fin_reelle'))
+        planning.statuts[i] = phase.get('statut')
+        planning.responsables[i] = phase.get('responsable') or planning.responsables[i]
+    planning._deduire_statuts()
+    
+    return planning.calculer()
+
+def get_planning(operation):
+    """Planning CPM d'une opération, mis en cache avec ses données"""
+    load_templates_phases()  # déclenche l'invalidation si le référentiel a changé
+    if operation.get('id') is None or get_operation(operation['id']) is None:
+        return construire_planning(operation, [])
+    return get_cache_operations().get(
+        'planning', operation['id'],
+        lambda op_id: construire_planning(get_operation(op_id), get_phases(op_id))
+    )
+
+def enregistrer_phase(operation_id, ordre, **valeurs):
+    """
+    Enregistre les dates réelles / le statut d'une phase
+    Le planning en cache est mis à jour incrémentalement (successeurs seulement)
+    """
+    operation = get_operation(operation_id)
+    planning = get_planning(operation)
+    dag = planning.dag if planning else None
+    
+    with get_session() as session:
+        phase = session.scalar(select(Phase).where(Phase.operation_id == operation_id, Phase.ordre == ordre))
+        if phase is None:
+            i = dag.index[ordre]
+            phase = Phase(operation_id=operation_id, ordre=ordre, nom=dag.noms[i],
+                          est_jalon=dag.jalons[i], responsable=dag.responsables[i])
+            session.add(phase)
+        deja_validee = phase.statut == 'VALIDEE'
+        for champ, valeur in valeurs.items():
+            setattr(phase, champ, _parse_date(valeur) if champ.startswith('date_') else valeur)
+        if valeurs.get('statut') == 'VALIDEE' and not deja_validee:
+            enregistrer_phase_validee(session, operation, phase.date_fin_reelle or date.today())
+        session.flush()
+        # Planning mis à jour avec la phase telle qu'enregistrée (statut par défaut compris),
+        # comme le ferait construire_planning au rechargement
+        changements = {'date_debut_reelle': phase.date_debut_reelle, 'date_fin_reelle': phase.date_fin_reelle,
+                       'statut': phase.statut, 'responsable': phase.responsable}
+        if phase.date_debut_prevue and phase.date_fin_prevue:
+            changements['duree_jours'] = (phase.date_fin_prevue - phase.date_debut_prevue).days
+        session.commit()
+    
+    if planning is not None:
+        planning.mettre_a_jour_phase(ordre, **changements)
+    invalidate_operation(operation_id, 'phases')
+
+class TemplateCompile:
+    """
+    Template de phases pré-calculé pour l'instanciation en masse
+    Décalages et durées (en jours depuis le début de l'opération) issus du CPM,
+    stockés en tableaux numpy en lecture seule partagés par le processus
+    """
+    
+    def __init__(self, dag):
+        origine = date(2000, 1, 1)
+        planning = PlanningOperation(dag, origine, origine).calculer()
+        
+        def fige(valeurs, dtype):
+            tableau = np.array(valeurs, dtype=dtype)
+            tableau.flags.writeable = False
+            return tableau
+        
+        self.ordres = fige(dag.ordres, np.int32)
+        self.decalages = fige(planning.es, 'timedelta64[D]')
+        self.durees = fige([f - d for d, f in zip(planning.es, planning.ef)], 'timedelta64[D]')
+        self.jalons = fige(dag.jalons, bool)
+        self.critiques = fige([lf - ef <= 0 for ef, lf in zip(planning.ef, planning.lf)], bool)
+        self.noms = dag.noms
+        self.responsables = dag.responsables
+        self.duree_totale = int(planning.fin_projet)
+    
+    def __len__(self):
+        return len(self.ordres)
+    
+    def instancier(self, operation_id, date_debut):
+        """Lignes de la table phases (dicts) datées à partir de date_debut"""
+        debuts = np.datetime64(_parse_date(date_debut), 'D') + self.decalages
+        fins = (debuts + self.durees).astype(object)
+        debuts = debuts.astype(object)
+        return [
+            {
+                "operation_id": operation_id,
+                "ordre": int(ordre),
+                "nom": nom,
+                "statut": "NON_DEMARREE",
+                "date_debut_prevue": debut,
+                "date_fin_prevue": fin,
+                "responsable": responsable,
+                "est_critique": bool(critique),
+                "est_jalon": bool(jalon)
+            }
+            for ordre, nom, debut, fin, responsable, critique, jalon in zip(
+                self.ordres, self.noms, debuts, fins, self.responsables, self.critiques, self.jalons)
+        ]
+
+@st.cache_resource(max_entries=64)
+def _compiler_template(type_operation, version_templates):
+    dag = _construire_dag_phases(type_operation, version_templates)
+    return TemplateCompile(dag) if dag is not None else None
+
+def get_template_compile(type_operation):
+    """Template compilé d'un type d'opération (None si type inconnu), suit les rechargements"""
+    load_templates_phases()
+    return _compiler_template(type_operation, get_registre_reference().version("templates_phases"))
+
+def creer_operations(operations):
+    """
+    Crée des opérations et leurs phases datées selon leur template, en une transaction
+    operations : dicts au format operations_demo (date_debut_prevue requise)
+    Retourne les identifiants créés
+    """
+    with get_session() as session:
+        lignes_operations = [_operation_depuis_json(op) for op in operations]
+        session.add_all(lignes_operations)
+        session.flush()
+        
+        lignes_phases = []
+        creees = []
+        for ligne in lignes_operations:
+            ligne.date_debut_prevue = ligne.date_debut_prevue or date.today()
+            template = get_template_compile(ligne.type_operation)
+            if template is not None:
+                lignes_phases.extend(template.instancier(ligne.id, ligne.date_debut_prevue))
+                if ligne.date_fin_prevue is None:
+                    ligne.date_fin_prevue = ligne.date_debut_prevue + timedelta(days=template.duree_totale)
+            creees.append(ligne.to_dict())
+        if lignes_phases:
+            session.execute(insert(Phase), lignes_phases)
+        
+        mois = _mois_actifs(pd.DataFrame(creees))
+        if not mois.empty:
+            appliquer_deltas_activite(session, mois)
+        session.commit()
+    
+    for operation in creees:
+        invalidate_operation(operation['id'])
+    return [operation['id'] for operation in creees]
+
+def rebaser_operations(nouvelles_dates):
+    """
+    Replanifie des opérations sur une nouvelle date de début, en une transaction
+    nouvelles_dates : {operation_id: date_debut}
+    Les dates prévues de l'opération et de ses phases sont décalées d'autant
+    """
+    if not nouvelles_dates:
+        return
+    ids = list(nouvelles_dates)
+    with get_session() as session:
+        avant = {op.id: op.to_dict() for op in session.scalars(select(Operation).where(Operation.id.in_(ids)))}
+        decalages = {}
+        lignes_operations = []
+        for operation_id, operation in avant.items():
+            debut = _parse_date(operation.get('date_debut_prevue')) or _parse_date(operation.get('date_creation'))
+            nouveau_debut = _parse_date(nouvelles_dates[operation_id])
+            decalages[operation_id] = timedelta(days=(nouveau_debut - debut).days if debut else 0)
+            fin = _parse_date(operation.get('date_fin_prevue'))
+            lignes_operations.append({
+                "id": operation_id,
+                "date_debut_prevue": nouveau_debut,
+                "date_fin_prevue": fin + decalages[operation_id] if fin else None
+            })
+        
+        phases = pd.DataFrame(session.execute(
+            select(Phase.id, Phase.operation_id, Phase.date_debut_prevue, Phase.date_fin_prevue)
+            .where(Phase.operation_id.in_(ids))
+        ).all(), columns=['id', 'operation_id', 'date_debut_prevue', 'date_fin_prevue'])
+        if not phases.empty:
+            delta = pd.to_timedelta(phases['operation_id'].map(decalages))
+            for champ in ('date_debut_prevue', 'date_fin_prevue'):
+                dates = pd.to_datetime(phases[champ]) + delta
+                phases[champ] = [d.date() if not pd.isna(d) else None for d in dates]
+            session.execute(update(Phase), phases.drop(columns='operation_id').to_dict('records'))
+        
+        if lignes_operations:
+            session.execute(update(Operation), lignes_operations)
+            apres = [{**avant[ligne['id']], **{k: v.isoformat() if v else None for k, v in ligne.items() if k != 'id'}}
+                     for ligne in lignes_operations]
+            mois = _mois_actifs(pd.DataFrame(list(avant.values())))
+            mois['operations_actives'] *= -1
+            appliquer_deltas_activite(session, pd.concat([mois, _mois_actifs(pd.DataFrame(apres))], ignore_index=True))
+        session.commit()
+    
+    for operation_id in avant:
+        invalidate_operation(operation_id)
+
+# --- Concessionnaires : moteur d'étapes ------------------------------------------
+
+SEMAINE_SAISIE = re.compile(r"^\s*(?:semaine|sem\.?|S)\s*(\d{1,2})(?:\s*[-/ ]\s*(\d{4}))?\s*$", re.IGNORECASE)
+
+@lru_cache(maxsize=4096)
+def interpreter_date_etape(saisie, annee_reference=None):
+    """
+    Date saisie librement sur une étape -> (date, libellé conservé)
+    ISO ("2024-03-15"), JJ/MM/AAAA, ou "Semaine 35" (lundi de la semaine ISO, dans l'année
+    de l'étape précédente si elle n'est pas précisée) ; sinon (None, texte libre)
+    """
+    texte = str(saisie).strip() if saisie is not None else ""
+    if not texte:
+        return None, None
+    valeur = _parse_date(texte)
+    if valeur is None:
+        try:
+            valeur = datetime.strptime(texte, "%d/%m/%Y").date()
+        except ValueError:
+            pass
+    if valeur is not None:
+        return valeur, None
+    semaine = SEMAINE_SAISIE.match(texte)
+    if semaine and (semaine.group(2) or annee_reference):
+        try:
+            return date.fromisocalendar(int(semaine.group(2) or annee_reference), int(semaine.group(1)), 1), texte
+        except ValueError:
+            pass
+    return None, texte
+
+def definitions_etapes_concessionnaires():
+    """Étapes de workflow_concessionnaires (une ligne par concessionnaire et étape)"""
+    concessionnaires = load_workflow_modules().get('workflow_concessionnaires', {}).get('concessionnaires', {})
+    return pd.DataFrame(
+        [(code, etape.get('nom'), etape.get('delai_standard'), etape.get('responsable'))
+         for code, concessionnaire in concessionnaires.items() for etape in concessionnaire.get('etapes', [])],
+        columns=['concessionnaire', 'nom', 'delai_standard', 'responsable']
+    ).drop_duplicates(['concessionnaire', 'nom'])
+
+def preparer_etapes_concessionnaires(etapes):
+    """
+    Table d'étapes typée, quel que soit le nombre de concessionnaires
+    - date_effective : saisie interprétée une seule fois (cache par saisie), libelle_date sinon
+    - delai_standard / responsable : joints depuis workflow_concessionnaires
+    """
+    etapes = etapes.sort_values(['operation_id', 'concessionnaire', 'ordre'], kind='stable').reset_index(drop=True)
+    dates, libelles = [], []
+    groupe, annee = None, None
+    for cle, saisie in zip(zip(etapes['operation_id'], etapes['concessionnaire']), etapes['date']):
+        if cle != groupe:
+            groupe, annee = cle, None
+        valeur, libelle = interpreter_date_etape(saisie if isinstance(saisie, str) else None, annee)
+        annee = valeur.year if valeur is not None else annee
+        dates.append(valeur)
+        libelles.append(libelle)
+    etapes['date_effective'] = pd.to_datetime(pd.Series(dates, index=etapes.index, dtype=object))
+    etapes['libelle_date'] = libelles
+    return etapes.merge(definitions_etapes_concessionnaires(), on=['concessionnaire', 'nom'], how='left')
+
+def load_etapes_concessionnaires():
+    """Étapes concessionnaires de toutes les opérations (une requête)"""
+    requete = select(EtapeConcessionnaire.operation_id, EtapeConcessionnaire.concessionnaire, EtapeConcessionnaire.ordre,
+                     EtapeConcessionnaire.nom, EtapeConcessionnaire.statut, EtapeConcessionnaire.date)
+    with get_session() as session:
+        return preparer_etapes_concessionnaires(pd.read_sql(requete, session.connection()))
+
+def get_etapes_concessionnaires():
+    """Étapes du portefeuille, relues quand une opération ou le paramétrage change"""
+    load_workflow_modules()
+    return get_cache_operations().get_global('etapes_concessionnaires', load_etapes_concessionnaires,
+                                             version=get_registre_reference().version('workflow_modules'))
+
+def calculer_retards_concessionnaires(etapes, aujourd_hui):
+    """
+    Retard en jours de chaque étape, en une passe sur toutes les étapes
+    - EN_COURS : depuis la dernière étape validée du concessionnaire, au-delà du délai standard
+    - PLANIFIE : au-delà de la date programmée
+    """
+    aujourd_hui = pd.Timestamp(aujourd_hui)
+    debut = (etapes['date_effective'].where(etapes['statut'] == 'VALIDEE')
+             .groupby([etapes['operation_id'], etapes['concessionnaire']]).transform('max'))
+    en_cours = (aujourd_hui - debut).dt.days - pd.to_numeric(etapes['delai_standard'])
+    programmee = (aujourd_hui - etapes['date_effective']).dt.days
+    return en_cours.where(etapes['statut'] == 'EN_COURS', programmee.where(etapes['statut'] == 'PLANIFIE'))
+
+def niveaux_retard_concessionnaires(retards):
+    """Règle alertes_delais atteinte par chaque retard ('' si aucune), seuil le plus élevé retenu"""
+    frame = retards.to_frame('retard_concessionnaire_jours')
+    regles = [regle for regle in get_moteur_regles().regles if regle.colonne == 'retard_concessionnaire_jours']
+    return pd.Series(np.select([regle.evaluer(frame) for regle in regles], [regle.type for regle in regles], default=''),
+                     index=retards.index)
+
+# --- DGD : moteur de calcul ----------------------------------------------------
+
+COLONNES_ENTREE_DGD = ['nom', 'marche_initial', 'quantites_reelles', 'plus_moins_value', 'penalites', 'statut']
+
+# Statut d'un lot -> ordre de l'étape de workflow_dgd en cours pour ce lot
+ETAPE_STATUT_LOT_DGD = {
+    'EN_SAISIE': 1,
+    'EN_ATTENTE_VALIDATION': 5,
+    'VALIDE_ENTREPRISE': 6,
+    'EN_VERIFICATION_MOE': 6,
+    'VALIDE_MOE': 7,
+    'VALIDE_SPIC': 8,
+    'DECOMPTE_GENERE': 9
+}
+
+def euros(centimes):
+    """Montant exact en euros (Decimal) depuis des centimes entiers"""
+    return Decimal(int(centimes)).scaleb(-2)
+
+def _division_arrondie(numerateur, denominateur):
+    """Division entière arrondie au plus proche, moitié loin de zéro (tableaux int64)"""
+    return np.sign(numerateur) * ((np.abs(numerateur) + denominateur // 2) // denominateur)
+
+def calculer_lots_dgd(lots):
+    """
+    Montants des lots en centimes entiers (int64) : aucune erreur d'arrondi flottant
+    - plus/moins-value quantitative : marché × (quantités réelles − 100 %), arrondie au centime
+    - plus/moins-value retenue : celle saisie si renseignée, la quantitative sinon
+    - montant final : marché + plus/moins-value − pénalités
+    Quantités réelles prises au centième de pourcent
+    """
+    marche = lots['marche_initial'].fillna(0).to_numpy(dtype=np.int64) * 100
+    quantites = np.rint(lots['quantites_reelles'].fillna(100).to_numpy(dtype=float) * 100).astype(np.int64)
+    pmv_quantites = _division_arrondie(marche * (quantites - 10000), 10000)
+    saisie = lots['plus_moins_value']
+    pmv = np.where(saisie.isna(), pmv_quantites, saisie.fillna(0).to_numpy(dtype=np.int64) * 100)
+    penalites = lots['penalites'].fillna(0).to_numpy(dtype=np.int64) * 100
+    return lots.assign(
+        marche_centimes=marche,
+        pmv_quantites_centimes=pmv_quantites,
+        pmv_centimes=pmv,
+        penalites_centimes=penalites,
+        final_centimes=marche + pmv - penalites,
+        ecart_controle_centimes=pmv - pmv_quantites,
+        etape=lots['statut'].map(ETAPE_STATUT_LOT_DGD).fillna(1).astype(int)
+    )
+
+def synthetiser_dgd(lots):
+    """Synthèse par opération (centimes) et écart final/initial au dixième de pourcent"""
+    synthese = lots.groupby('operation_id').agg(
+        montant_initial=('marche_centimes', 'sum'), plus_moins_values=('pmv_centimes', 'sum'),
+        penalites=('penalites_centimes', 'sum'), montant_final=('final_centimes', 'sum'),
+        ecarts_controle=('ecart_controle_centimes', lambda ecarts: int((ecarts != 0).sum())),
+        etape=('etape', 'min')
+    )
+    initial = synthese['montant_initial'].to_numpy()
+    ecart = _division_arrondie((synthese['montant_final'].to_numpy() - initial) * 1000, np.maximum(initial, 1))
+    synthese['ecart_pour_mille'] = np.where(initial > 0, ecart, 0)
+    return synthese
+
+class MoteurDGD:
+    """
+    DGD recalculés par lots vectorisés, mémorisés par (opération, empreinte de ses lots)
+    - Une opération dont les lots n'ont pas changé n'est pas recalculée
+    - Calcul du portefeuille entier en un seul passage sur les opérations modifiées
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resultats = {}
+    
+    @staticmethod
+    def empreintes(lots):
+        """Empreinte sha256 des entrées DGD de chaque opération (lots triés par id, id compris)"""
+        lignes = pd.util.hash_pandas_object(lots[['id'] + COLONNES_ENTREE_DGD], index=False).to_numpy()
+        operation_ids = lots['operation_id'].to_numpy()
+        bornes = np.flatnonzero(np.diff(operation_ids)) + 1
+        return {
+            int(bloc_ids[0]): hashlib.sha256(bloc.tobytes()).hexdigest()
+            for bloc_ids, bloc in zip(np.split(operation_ids, bornes), np.split(lignes, bornes))
+        }
+    
+    def _resultat(self, lots, synthese):
+        return {
+            'lots': lots,
+            'synthese': {
+                'montant_initial': euros(synthese['montant_initial']),
+                'plus_moins_values': euros(synthese['plus_moins_values']),
+                'penalites': -euros(synthese['penalites']),
+                'montant_final': euros(synthese['montant_final']),
+                'ecart_pourcentage': Decimal(int(synthese['ecart_pour_mille'])).scaleb(-1),
+                'ecarts_controle': int(synthese['ecarts_controle']),
+                'etape': int(synthese['etape'])
+            }
+        }
+    
+    def calculer(self, lots, portefeuille=False):
+        """
+        {operation_id: {'lots', 'synthese'}} pour les opérations présentes dans lots
+        portefeuille=True : lots de toutes les opérations, les empreintes disparues sont oubliées
+        """
+        if lots.empty:
+            return {}
+        lots = lots.sort_values(['operation_id', 'id'], kind='stable').reset_index(drop=True)
+        # Clé (opération, empreinte) : deux opérations aux lots identiques ne partagent pas leur résultat
+        cles = {operation_id: (operation_id, empreinte) for operation_id, empreinte in self.empreintes(lots).items()}
+        with self._lock:
+            a_calculer = [operation_id for operation_id, cle in cles.items() if cle not in self._resultats]
+        
+        if a_calculer:
+            calcules = calculer_lots_dgd(lots[lots['operation_id'].isin(a_calculer)])
+            syntheses = synthetiser_dgd(calcules)
+            nouveaux = {
+                cles[operation_id]: self._resultat(bloc.reset_index(drop=True), syntheses.loc[operation_id])
+                for operation_id, bloc in calcules.groupby('operation_id')
+            }
+            with self._lock:
+                self._resultats.update(nouveaux)
+        
+        with self._lock:
+            resultats = {operation_id: self._resultats[cle] for operation_id, cle in cles.items()}
+            if portefeuille:
+                self._resultats = {cle: self._resultats[cle] for cle in cles.values()}
+        return resultats
+
+@st.cache_resource
+def get_moteur_dgd():
+    """Moteur DGD partagé (mémoire des calculs par empreinte)"""
+    return MoteurDGD()
+
+def load_dgd_portefeuille():
+    """Synthèses DGD de toutes les opérations (une requête, calcul des seules opérations modifiées)"""
+    with get_session() as session:
+        lots = pd.read_sql(select(*LotDGD.__table__.columns), session.connection())
+    resultats = get_moteur_dgd().calculer(lots, portefeuille=True)
+    return pd.DataFrame.from_dict({operation_id: resultat['synthese'] for operation_id, resultat in resultats.items()},
+                                  orient='index')
+
+def montants_finals_dgd(session, operation_ids=None):
+    """{id du lot : montant final exact en euros} recalculé par le moteur DGD (la colonne stockée n'est pas fiable)"""
+    requete = select(*LotDGD.__table__.columns)
+    if operation_ids is not None:
+        requete = requete.where(LotDGD.operation_id.in_(operation_ids))
+    resultats = get_moteur_dgd().calculer(pd.read_sql(requete, session.connection()))
+    return {
+        int(lot_id): euros(centimes)
+        for resultat in resultats.values()
+        for lot_id, centimes in zip(resultat['lots']['id'], resultat['lots']['final_centimes'])
+    }
+
+def get_dgd_portefeuille():
+    """Synthèses DGD du portefeuille, recalculées quand une opération change"""
+    return get_cache_operations().get_global('dgd_portefeuille', load_dgd_portefeuille)
+
+NIVEAUX_ALERTE = ["CRITIQUE", "WARNING", "INFO"]
+
+# Type de règle -> (indicateur évalué, niveau, groupe exclusif, message)
+# Dans un même groupe, seule la règle de seuil le plus élevé déclenchée est retenue
+INDICATEURS_REGLES = {
+    "ECART_CRITIQUE": ("ecart_rem_travaux_pct", "CRITIQUE", None, "Écart REM/Travaux de {valeur:.1f}% (seuil {seuil:g}%)"),
+    "RETARD_SAISIE": ("retard_saisie_rem_jours", "WARNING", None, "Saisie REM trimestrielle en retard de {valeur:.0f} jours"),
+    "IMPACT_BUDGET": ("avenant_budget_en_attente", "WARNING", "avenant_budget", "Avenant de {valeur:,.0f} € en attente de validation"),
+    "IMPACT_MAJEUR": ("avenant_budget_en_attente", "CRITIQUE", "avenant_budget", "Avenant majeur de {valeur:,.0f} € en attente de validation"),
+    "IMPACT_DELAI": ("avenant_delai_en_attente", "WARNING", None, "Avenant de {valeur:.0f} jours en attente de validation"),
+    "RETARD_MINEUR": ("retard_concessionnaire_jours", "INFO", "concessionnaire", "Concessionnaire en retard de {valeur:.0f} jours"),
+    "RETARD_MAJEUR": ("retard_concessionnaire_jours", "WARNING", "concessionnaire", "Concessionnaire en retard de {valeur:.0f} jours"),
+    "RETARD_CRITIQUE": ("retard_concessionnaire_jours", "CRITIQUE", "concessionnaire", "Concessionnaire en retard de {valeur:.0f} jours"),
+    "Respect Budget": ("ecart_budget_pct", "WARNING", None, "Dérive budget de {valeur:.1f}% (acceptable {seuil:g}%)"),
+    "Respect Planning": ("ecart_planning_pct", "WARNING", None, "Dérive planning de {valeur:.1f}% (acceptable {seuil:g}%)"),
+    "Qualité Livraison": ("reclamations_par_logement", "WARNING", None, "{valeur:.2f} réclamation(s) GPA par logement (acceptable {seuil:g})"),
+    "PHASE_RETARD": ("phases_retard_jours", "WARNING", None, "Phase non validée en retard de {valeur:.0f} jours"),
+    "MED_ECHEANCE": ("med_depassement_jours", "CRITIQUE", None, "Délai de mise en conformité MED dépassé de {valeur:.0f} jours")
+}
+
+# Règles sans paramétrage dans workflow_modules.json : (module, type, seuil, action)
+REGLES_SYSTEME = [
+    ("planning", "PHASE_RETARD", 0, "Mettre à jour le planning ou signaler un frein"),
+    ("workflow_med", "MED_ECHEANCE", 0, "Constater la carence ou escalader")
+]
+
+# (module, clé) -> champs obligatoires de chaque règle et leur type
+SCHEMA_REGLES = {
+    ("workflow_rem", "alertes"): {"type": str, "seuil": (int, float)},
+    ("workflow_avenants", "seuils_validation"): {"type": str, "validateur": str},
+    ("workflow_concessionnaires", "alertes_delais"): {"seuil_jours": (int, float), "action": str},
+    ("workflow_cloture", "indicateurs_performance"): {"nom": str, "seuil_bon": (int, float), "seuil_acceptable": (int, float)}
+}
+
+class RegleWorkflow:
+    """Règle compilée : comparaison vectorisée d'un indicateur d'opération à un seuil"""
+    
+    def __init__(self, module, type_regle, niveau, colonne, seuil, message, action, groupe=None, inclusif=False,
+                 validateur=None):
+        self.module = module
+        self.type = type_regle
+        self.niveau = niveau
+        self.colonne = colonne
+        self.seuil = float(seuil)
+        self.message = message
+        self.action = action
+        self.groupe = groupe
+        self.validateur = validateur
+        self._comparer = np.greater_equal if inclusif else np.greater
+    
+    def evaluer(self, indicateurs):
+        """Masque des opérations déclenchant la règle (indicateur manquant = pas d'alerte)"""
+        valeurs = indicateurs[self.colonne].to_numpy(dtype=float)
+        return self._comparer(np.nan_to_num(valeurs, nan=-np.inf), self.seuil)
+
+def _regles_declarees(workflow):
+    """(module, type, paramètres) pour chaque règle déclarée dans workflow_modules.json"""
+    for (module, cle), schema in SCHEMA_REGLES.items():
+        regles = workflow.get(module, {}).get(cle)
+        if regles is None:
+            continue
+        if isinstance(regles, Mapping):
+            # alertes_delais : {type: paramètres}
+            regles = [{"type": type_regle, **parametres} for type_regle, parametres in regles.items()]
+        for parametres in regles:
+            type_regle = parametres.get("type", parametres.get("nom"))
+            yield module, cle, schema, type_regle, parametres
+
+def compiler_regles_workflow(workflow):
+    """
+    Valide les règles de workflow_modules.json et les compile
+    Retourne (règles, erreurs) : une règle invalide est signalée et ignorée
+    """
+    regles, erreurs = [], []
+    for module, cle, schema, type_regle, parametres in _regles_declarees(workflow):
+        contexte = f"{module}.{cle}[{type_regle}]"
+        invalides = [champ for champ, types in schema.items()
+                     if not isinstance(parametres.get(champ), types) or isinstance(parametres.get(champ), bool)]
+        if invalides:
+            erreurs.append(f"{contexte} : champ(s) manquant(s) ou invalide(s) {', '.join(invalides)}")
+            continue
+        if type_regle not in INDICATEURS_REGLES:
+            erreurs.append(f"{contexte} : type de règle inconnu")
+            continue
+        colonne, niveau, groupe, message = INDICATEURS_REGLES[type_regle]
+        
+        if cle == "seuils_validation":
+            seuil = parametres.get("seuil_montant", parametres.get("seuil_jours"))
+            if not isinstance(seuil, (int, float)):
+                erreurs.append(f"{contexte} : seuil_montant ou seuil_jours requis")
+                continue
+            regles.append(RegleWorkflow(module, type_regle, niveau, colonne, seuil, message,
+                                        f"Validation {parametres['validateur']}", groupe, inclusif=True,
+                                        validateur=parametres['validateur']))
+        elif cle == "indicateurs_performance":
+            if parametres["seuil_acceptable"] < parametres["seuil_bon"]:
+                erreurs.append(f"{contexte} : seuil_acceptable inférieur à seuil_bon")
+                continue
+            regles.append(RegleWorkflow(module, type_regle, niveau, colonne, parametres["seuil_acceptable"], message,
+                                        f"Analyser l'indicateur {type_regle}", groupe))
+        else:
+            seuil = parametres.get("seuil", parametres.get("seuil_jours"))
+            regles.append(RegleWorkflow(module, type_regle, niveau, colonne, seuil, message,
+                                        parametres.get("action", ""), groupe))
+    return regles, erreurs
+
+class MoteurRegles:
+    """Règles de workflow_modules.json compilées, évaluées sur toute la table des opérations"""
+    
+    def __init__(self, workflow):
+        self.regles, self.erreurs = compiler_regles_workflow(workflow)
+        for module, type_regle, seuil, action in REGLES_SYSTEME:
+            colonne, niveau, groupe, message = INDICATEURS_REGLES[type_regle]
+            self.regles.append(RegleWorkflow(module, type_regle, niveau, colonne, seuil, message, action, groupe))
+        # Règles d'un groupe exclusif évaluées par seuil décroissant
+        self.regles.sort(key=lambda regle: (regle.groupe or '', -regle.seuil))
+    
+    def regle(self, type_regle):
+        return next((regle for regle in self.regles if regle.type == type_regle), None)
+    
+    def circuit_validation(self, impact_budget, impact_delai):
+        """
+        Validateurs requis pour un avenant (seuils_validation de workflow_avenants)
+        Montant en valeur absolue ; dans un groupe gradué seul le seuil le plus élevé est retenu
+        """
+        valeurs = {'avenant_budget_en_attente': abs(impact_budget), 'avenant_delai_en_attente': impact_delai}
+        circuit, groupes = [], set()
+        for regle in self.regles:
+            if regle.validateur is None or (regle.groupe and regle.groupe in groupes):
+                continue
+            if regle._comparer(valeurs.get(regle.colonne, 0), regle.seuil):
+                circuit.append((regle.type, regle.validateur))
+                groupes.add(regle.groupe)
+        return circuit
+    
+    def evaluer(self, indicateurs):
+        """Alertes déclenchées (DataFrame), une ligne par (opération, règle)"""
+        colonnes = ['cle', 'operation_id', 'operation', 'aco_responsable', 'commune', 'module', 'type',
+                    'niveau', 'valeur', 'seuil', 'message', 'action_requise']
+        actives = (indicateurs['statut'] != 'CLOTUREE').to_numpy()
+        deja_declenchees = {}
+        alertes = []
+        for regle in self.regles:
+            masque = regle.evaluer(indicateurs) & actives
+            if regle.groupe:
+                deja = deja_declenchees.setdefault(regle.groupe, np.zeros(len(masque), dtype=bool))
+                masque &= ~deja
+                deja |= masque
+            if not masque.any():
+                continue
+            declenchees = indicateurs[masque]
+            valeurs = declenchees[regle.colonne].to_numpy(dtype=float)
+            alertes.append(pd.DataFrame({
+                # Clé de déduplication : une alerte par opération et par règle (ou groupe gradué)
+                'cle': [f"{operation_id}:{regle.groupe or regle.type}" for operation_id in declenchees.index],
+                'operation_id': declenchees.index,
+                'operation': declenchees['nom'].to_numpy(),
+                'aco_responsable': declenchees['aco_responsable'].to_numpy(),
+                'commune': declenchees['commune'].to_numpy(),
+                'module': regle.module,
+                'type': regle.type,
+                'niveau': regle.niveau,
+                'valeur': valeurs,
+                'seuil': regle.seuil,
+                'message': [regle.message.format(valeur=v, seuil=regle.seuil) for v in valeurs],
+                'action_requise': regle.action
+            }))
+        if not alertes:
+            return pd.DataFrame(columns=colonnes)
+        resultat = pd.concat(alertes, ignore_index=True)
+        resultat['rang'] = resultat['niveau'].map({niveau: i for i, niveau in enumerate(NIVEAUX_ALERTE)})
+        return resultat.sort_values(['rang', 'valeur'], ascending=[True, False]).drop(columns='rang').reset_index(drop=True)
+
+@st.cache_resource(max_entries=8)
+def _compiler_moteur_regles(version_workflow):
+    return MoteurRegles(load_workflow_modules())
+
+def get_moteur_regles():
+    """Règles compilées, recompilées quand workflow_modules.json change"""
+    load_workflow_modules()
+    return _compiler_moteur_regles(get_registre_reference().version("workflow_modules"))
+
+def load_indicateurs_operations(aujourd_hui):
+    """
+    Table des indicateurs évalués par les règles, une ligne par opération
+    Quelques requêtes colonnes puis calculs vectorisés (groupby)
+    """
+    requetes = {
+        'operations': select(Operation.id, Operation.nom, Operation.aco_responsable, Operation.commune, Operation.statut,
+                             Operation.budget_total, Operation.nb_logements_total,
+                             Operation.date_debut_prevue, Operation.date_fin_prevue),
+        'rem': select(RemTrimestre.operation_id, RemTrimestre.annee, RemTrimestre.numero_trimestre,
+                      RemTrimestre.rem_projetee, RemTrimestre.rem_realisee,
+                      RemTrimestre.depenses_projetees, RemTrimestre.depenses_facturees),
+        'avenants': select(Avenant.operation_id, Avenant.statut, Avenant.impact_budget, Avenant.impact_delai),
+        'gpa': select(ReclamationGPA.operation_id, func.count(ReclamationGPA.id).label('reclamations'))
+               .group_by(ReclamationGPA.operation_id),
+        'med': select(Med.operation_id, Med.date_envoi, Med.delai_conformite).where(Med.statut.notin_(STATUTS_MED_CLOS))
+    }
+    with get_session() as session:
+        frames = {nom: pd.read_sql(requete, session.connection()) for nom, requete in requetes.items()}
+    
+    aujourd_hui = pd.Timestamp(aujourd_hui)
+    indicateurs = frames['operations'].set_index('id')
+    
+    # REM : trimestres clos uniquement
+    rem = frames['rem']
+    rem['fin_trimestre'] = pd.to_datetime(pd.DataFrame({
+        'year': rem['annee'], 'month': rem['numero_trimestre'] * 3, 'day': 1
+    })) + pd.offsets.MonthEnd(0)
+    clos = rem[rem['fin_trimestre'] <= aujourd_hui]
+    sommes = clos.groupby('operation_id')[['rem_projetee', 'rem_realisee', 'depenses_projetees', 'depenses_facturees']].sum()
+    taux_rem = sommes['rem_realisee'] / sommes['rem_projetee'].replace(0, np.nan)
+    taux_travaux = sommes['depenses_facturees'] / sommes['depenses_projetees'].replace(0, np.nan)
+    indicateurs['ecart_rem_travaux_pct'] = ((taux_rem - taux_travaux).abs() * 100).reindex(indicateurs.index)
+    dernier = clos.sort_values('fin_trimestre').groupby('operation_id').tail(1).set_index('operation_id')
+    non_saisi = (dernier['rem_realisee'].fillna(0) == 0) & (dernier['depenses_facturees'].fillna(0) == 0)
+    retard_saisie = (aujourd_hui - dernier['fin_trimestre']).dt.days.where(non_saisi, 0)
+    indicateurs['retard_saisie_rem_jours'] = retard_saisie.reindex(indicateurs.index)
+    
+    # Avenants : en attente de validation / validés
+    avenants = frames['avenants']
+    en_attente = avenants[~avenants['statut'].isin(['VALIDE', 'REFUSE'])].groupby('operation_id')
+    indicateurs['avenant_budget_en_attente'] = en_attente['impact_budget'].max().reindex(indicateurs.index)
+    indicateurs['avenant_delai_en_attente'] = en_attente['impact_delai'].max().reindex(indicateurs.index)
+    budget_valide = avenants[avenants['statut'] == 'VALIDE'].groupby('operation_id')['impact_budget'].sum()
+    indicateurs['ecart_budget_pct'] = (budget_valide.reindex(indicateurs.index).fillna(0)
+                                       / indicateurs['budget_total'].replace(0, np.nan) * 100)
+    
+    # Concessionnaires : retard des étapes en cours ou programmées (moteur d'étapes)
+    etapes = get_etapes_concessionnaires()
+    retard = calculer_retards_concessionnaires(etapes, aujourd_hui)
+    indicateurs['retard_concessionnaire_jours'] = retard.groupby(etapes['operation_id']).max().reindex(indicateurs.index)
+    
+    # MED : échéance de mise en conformité dépassée
+    med = frames['med']
+    echeance = pd.to_datetime(med['date_envoi']) + pd.to_timedelta(med['delai_conformite'].fillna(15), unit='D')
+    indicateurs['med_depassement_jours'] = (aujourd_hui - echeance).dt.days.groupby(med['operation_id']).max().reindex(indicateurs.index)
+    
+    # Planning : phases non validées dont la fin planifiée est passée
+    phases = get_phases_portefeuille()
+    ouvertes = phases[phases['statut'] != 'VALIDEE']
+    retard_phases = (aujourd_hui - ouvertes['fin']).dt.days
+    indicateurs['phases_retard_jours'] = retard_phases.groupby(ouvertes['operation_id']).max().reindex(indicateurs.index)
+    
+    # Planning : fin CPM vs durée contractuelle
+    fin_planning = phases.groupby('operation_id')['fin'].max().reindex(indicateurs.index)
+    debut_prevu = pd.to_datetime(indicateurs['date_debut_prevue'])
+    duree_prevue = (pd.to_datetime(indicateurs['date_fin_prevue']) - debut_prevu).dt.days
+    duree_planning = (fin_planning - debut_prevu).dt.days
+    indicateurs['ecart_planning_pct'] = (duree_planning - duree_prevue) / duree_prevue.where(duree_prevue > 0) * 100
+    
+    # Qualité : réclamations GPA par logement
+    reclamations = frames['gpa'].set_index('operation_id')['reclamations'].reindex(indicateurs.index).fillna(0)
+    indicateurs['reclamations_par_logement'] = reclamations / indicateurs['nb_logements_total'].replace(0, np.nan)
+    return indicateurs
+
+def get_indicateurs_operations():
+    """Indicateurs du portefeuille, recalculés quand une opération, le jour ou le paramétrage change"""
+    aujourd_hui = date.today()
+    load_workflow_modules()
+    return get_cache_operations().get_global('indicateurs_regles', lambda: load_indicateurs_operations(aujourd_hui),
+                                             version=(aujourd_hui, get_registre_reference().version('workflow_modules')))
+
+def evaluer_alertes_portefeuille():
+    """Alertes de tout le portefeuille issues des règles (calcul complet)"""
+    return get_moteur_regles().evaluer(get_indicateurs_operations())
+
+def synchroniser_alertes(session, alertes, maintenant):
+    """
+    Enregistre les alertes calculées, dédupliquées par clé
+    - Nouvelle clé : création (ou réouverture d'une alerte résolue)
+    - Clé existante : mise à jour du niveau, de la valeur et du message
+    - Clé disparue : alerte résolue
+    """
+    existantes = {alerte.cle: alerte for alerte in session.scalars(select(Alerte))}
+    champs = ['operation_id', 'aco_responsable', 'commune', 'module', 'type', 'niveau',
+              'valeur', 'seuil', 'message', 'action_requise']
+    calculees = set()
+    for enregistrement in alertes.to_dict('records'):
+        calculees.add(enregistrement['cle'])
+        ligne = existantes.get(enregistrement['cle'])
+        if ligne is None:
+            ligne = Alerte(cle=enregistrement['cle'])
+            session.add(ligne)
+        if not ligne.active:
+            ligne.active = True
+            ligne.date_creation = maintenant
+            ligne.date_resolution = None
+        for champ in champs:
+            setattr(ligne, champ, enregistrement[champ])
+        ligne.date_maj = maintenant
+    
+    resolues = [ligne for cle, ligne in existantes.items() if ligne.active and cle not in calculees]
+    for ligne in resolues:
+        ligne.active = False
+        ligne.date_resolution = maintenant
+        enregistrer_alerte_resolue(session, {'aco_responsable': ligne.aco_responsable, 'commune': ligne.commune},
+                                   maintenant.date())
+    return len(calculees), len(resolues)
+
+class PlanificateurAlertes:
+    """
+    Thread unique par processus évaluant les règles d'alerte hors du rendu des pages
+    - Au démarrage puis à intervalle régulier (alertes dépendantes de la date)
+    - Après chaque écriture signalée par le cache (écritures rapprochées regroupées)
+    - Déclenche au passage les relances/escalades MED échues (échéancier)
+    """
+    
+    def __init__(self, intervalle=300, delai_regroupement=1.0, echeancier=None):
+        self.intervalle = intervalle
+        self.echeancier = echeancier
+        self.delai_regroupement = delai_regroupement
+        self.derniere_evaluation = None
+        self.derniere_erreur = None
+        self._evenement = threading.Event()
+        self._thread = threading.Thread(target=self._boucle, name="opcopilot-alertes", daemon=True)
+    
+    def demarrer(self):
+        self._thread.start()
+        return self
+    
+    def signaler(self):
+        """Demande une réévaluation (données modifiées)"""
+        self._evenement.set()
+    
+    def evaluer(self):
+        if self.echeancier is not None:
+            self.echeancier.traiter(date.today())
+        alertes = evaluer_alertes_portefeuille()
+        maintenant = datetime.now()
+        with get_session() as session:
+            synchroniser_alertes(session, alertes, maintenant)
+            session.commit()
+        self.derniere_evaluation = maintenant
+    
+    def _boucle(self):
+        while True:
+            try:
+                self.evaluer()
+                self.derniere_erreur = None
+            except Exception as erreur:
+                # Le thread doit survivre : l'erreur est affichée par les pages
+                self.derniere_erreur = str(erreur)
+            if self._evenement.wait(self.intervalle):
+                time.sleep(self.delai_regroupement)
+            self._evenement.clear()
+
+@st.cache_resource
+def get_planificateur_alertes():
+    """Planificateur démarré une seule fois par processus"""
+    planificateur = PlanificateurAlertes(intervalle=int(os.environ.get("OPCOPILOT_INTERVALLE_ALERTES", 300)),
+                                         echeancier=get_echeancier_med())
+    get_cache_operations().abonner(planificateur.signaler)
+    return planificateur.demarrer()
+
+def load_alertes(aco=None, operation_id=None):
+    """Dernières alertes actives enregistrées, les plus graves en premier"""
+    requete = (select(*Alerte.__table__.columns, Operation.nom.label('operation'))
+               .join(Operation, Operation.id == Alerte.operation_id)
+               .where(Alerte.active.is_(True)))
+    if aco is not None:
+        requete = requete.where(Alerte.aco_responsable == aco)
+    if operation_id is not None:
+        requete = requete.where(Alerte.operation_id == operation_id)
+    with get_session() as session:
+        alertes = pd.read_sql(requete, session.connection())
+    rang = alertes['niveau'].map({niveau: i for i, niveau in enumerate(NIVEAUX_ALERTE)})
+    return alertes.assign(rang=rang).sort_values(['rang', 'valeur'], ascending=[True, False]).drop(columns='rang').reset_index(drop=True)
+
+# --- Avenants : registre et circuit de validation ------------------------------
+
+STATUTS_AVENANT_CLOS = ('VALIDE', 'REFUSE')
+VALIDATEUR_DEFAUT = "ACO"
+
+def construire_postings(lignes, champs):
+    """Index inversé {champ: {valeur: positions triées des lignes}} (factorisation + tri stable)"""
+    postings = {}
+    for champ in champs:
+        codes, valeurs = pd.factorize(lignes[champ], sort=True)
+        positions = np.argsort(codes, kind='stable').astype(np.int32)
+        bornes = np.searchsorted(codes[positions], np.arange(len(valeurs) + 1))
+        postings[champ] = {
+            valeur: positions[bornes[k]:bornes[k + 1]] for k, valeur in enumerate(valeurs)
+        }
+    return postings
+
+def rechercher_postings(lignes, postings, filtres):
+    """Lignes satisfaisant tous les filtres (valeur ou liste de valeurs), par intersection des postings"""
+    listes = []
+    for champ, valeurs in filtres.items():
+        if valeurs is None:
+            continue
+        valeurs = [valeurs] if np.ndim(valeurs) == 0 else valeurs
+        trouves = [postings[champ].get(valeur) for valeur in valeurs]
+        listes.append(np.sort(np.concatenate([p for p in trouves if p is not None] or [np.empty(0, dtype=np.int32)])))
+    if not listes:
+        return lignes
+    listes.sort(key=len)
+    resultat = listes[0]
+    for liste in listes[1:]:
+        resultat = np.intersect1d(resultat, liste, assume_unique=True)
+    return lignes.iloc[resultat]
+
+class RegistreAvenants:
+    """
+    Registre des avenants du portefeuille
+    - Impacts cumulés budget/délai par opération (ordre chronologique)
+    - Index inversé motif / statut : positions triées, combinées par intersection
+    - Agrégats pré-calculés par (commune, motif, statut)
+    """
+    
+    INDEX = ('motif', 'statut')
+    AGREGATS = ['nb_avenants', 'plus_values', 'moins_values', 'impact_delai']
+    
+    def __init__(self, session):
+        requete = (select(Avenant.id, Avenant.operation_id, Avenant.numero, Avenant.date, Avenant.motif,
+                          Avenant.impact_budget, Avenant.impact_delai, Avenant.statut,
+                          Operation.commune, Operation.aco_responsable)
+                   .join(Operation, Operation.id == Avenant.operation_id))
+        self.lignes = calculer_cumuls_avenants(pd.read_sql(requete, session.connection()))
+        for champ in ('motif', 'statut', 'commune', 'aco_responsable'):
+            self.lignes[champ] = self.lignes[champ].fillna('')
+        
+        self.postings = construire_postings(self.lignes, self.INDEX)
+        
+        impacts = self.lignes['impact_budget']
+        self.agregats = self.lignes.assign(
+            nb_avenants=1, plus_values=impacts.clip(lower=0), moins_values=impacts.clip(upper=0)
+        ).groupby(['commune', 'motif', 'statut'])[self.AGREGATS].sum()
+        
+        # Dernière ligne chronologique de chaque opération = cumuls courants
+        self.cumuls = self.lignes.groupby('operation_id')[
+            ['cumul_budget', 'cumul_delai', 'cumul_budget_valide', 'cumul_delai_valide']
+        ].last()
+    
+    def rechercher(self, **filtres):
+        """Avenants satisfaisant tous les filtres motif/statut (valeur ou liste de valeurs)"""
+        return rechercher_postings(self.lignes, self.postings, filtres)
+    
+    def totaux(self, par='commune', statuts=None, exclure_statuts=(), motifs=None):
+        """Agrégats regroupés par 'commune', 'motif' ou 'statut' (sans relire les avenants)"""
+        agregats = self.agregats
+        niveaux = agregats.index
+        masque = ~niveaux.get_level_values('statut').isin(exclure_statuts)
+        if statuts is not None:
+            masque &= niveaux.get_level_values('statut').isin(statuts)
+        if motifs is not None:
+            masque &= niveaux.get_level_values('motif').isin(motifs)
+        return agregats[masque].groupby(level=par).sum().sort_values('plus_values', ascending=False)
+
+def construire_registre_avenants():
+    with get_session() as session:
+        return RegistreAvenants(session)
+
+def get_registre_avenants():
+    """Registre des avenants, reconstruit quand une opération change"""
+    return get_cache_operations().get_global('registre_avenants', construire_registre_avenants)
+
+def synthese_avenants(operation_id):
+    """Impacts cumulés d'une opération rapportés à son budget et à sa durée prévue"""
+    avenants = get_avenants(operation_id)
+    operation = get_operation(operation_id) or {}
+    cumuls = avenants.iloc[-1] if not avenants.empty else {}
+    debut, fin = operation.get('date_debut_prevue'), operation.get('date_fin_prevue')
+    duree_prevue = (date.fromisoformat(fin) - date.fromisoformat(debut)).days if debut and fin else 0
+    budget_total = operation.get('budget_total') or 0
+    
+    synthese = {'nb_avenants': len(avenants), 'budget_total': budget_total, 'duree_prevue': duree_prevue}
+    for nom in ('budget', 'delai', 'budget_valide', 'delai_valide'):
+        synthese[f'impact_{nom}'] = int(cumuls.get(f'cumul_{nom}', 0))
+    for nom, base in (('budget', budget_total), ('delai', duree_prevue)):
+        synthese[f'pourcentage_{nom}'] = synthese[f'impact_{nom}'] / base * 100 if base else None
+    return synthese
+
+def creer_avenant(operation_id, motif, impact_budget, impact_delai, description=""):
+    """Crée un avenant en attente de validation, routé selon seuils_validation"""
+    circuit = get_moteur_regles().circuit_validation(impact_budget, impact_delai)
+    validateurs = [validateur for _, validateur in circuit] or [VALIDATEUR_DEFAUT]
+    with get_session() as session:
+        # Numéro suivant le plus élevé (tri par longueur puis valeur : AVT-1000 suit AVT-999)
+        dernier = session.scalar(select(Avenant.numero).where(Avenant.operation_id == operation_id, Avenant.numero.like('AVT-%'))
+                                 .order_by(func.length(Avenant.numero).desc(), Avenant.numero.desc()).limit(1))
+        numero = int(dernier.rsplit('-', 1)[1]) + 1 if dernier else 1
+        avenant = Avenant(
+            operation_id=operation_id, numero=f"AVT-{numero:03d}", date=date.today(), motif=motif,
+            description=description, impact_budget=int(impact_budget), impact_delai=int(impact_delai),
+            statut='EN_COURS', validateur=", ".join(validateurs)
+        )
+        session.add(avenant)
+        session.commit()
+        resultat = avenant.to_dict()
+    invalidate_operation(operation_id, 'avenants')
+    return resultat
+
+def _phase_en_cours(planning):
+    """Position de la première phase non terminée (au plus tôt) : celle qui porte le délai d'un avenant"""
+    ouvertes = [i for i in range(len(planning.dag))
+                if planning.fin_reel[i] is None and planning.statuts[i] != 'VALIDEE']
+    return min(ouvertes, key=lambda i: (planning.es[i], planning.dag.rang[i]), default=None)
+
+def valider_avenants(avenant_ids, statut='VALIDE', validateur=None):
+    """
+    Valide ou refuse des avenants en attente, en une transaction
+    Le délai d'un avenant validé allonge la phase en cours de l'opération : seuls ses successeurs
+    sont recalculés dans le planning en cache, puis les phases décalées et la date de fin prévue
+    (décalée d'autant que la fin du planning recalculé) sont enregistrées
+    Retourne {operation_id: nouvelle date de fin prévue} des opérations prolongées
+    """
+    with get_session() as session:
+        avenants = session.execute(
+            select(Avenant.id, Avenant.operation_id, Avenant.impact_delai)
+            .where(Avenant.id.in_([int(i) for i in avenant_ids]), Avenant.statut.notin_(STATUTS_AVENANT_CLOS))
+        ).all()
+        if not avenants:
+            return {}
+        session.execute(update(Avenant), [
+            {"id": avenant.id, "statut": statut, **({"validateur": validateur} if validateur else {})}
+            for avenant in avenants
+        ])
+        
+        delais = {}
+        if statut == 'VALIDE':
+            for avenant in avenants:
+                delais[avenant.operation_id] = delais.get(avenant.operation_id, 0) + (avenant.impact_delai or 0)
+        delais = {operation_id: delai for operation_id, delai in delais.items() if delai}
+        
+        plannings = {}
+        try:
+            phases, lignes_operations, periodes = [], [], []
+            for operation_id, delai in delais.items():
+                operation = get_operation(operation_id)
+                planning = plannings[operation_id] = get_planning(operation)
+                i = _phase_en_cours(planning) if planning is not None else None
+                # Sans planning, le délai accordé s'ajoute tel quel ; sinon seul compte le décalage de la fin du CPM
+                decalage_fin = delai if planning is None else 0
+                if i is not None:
+                    fin_avant = planning.date_fin()
+                    ordre = planning.dag.ordres[i]
+                    modifiees = planning.mettre_a_jour_phase(ordre, duree_jours=max(planning.durees[i] + delai, 0))
+                    for j in {i, *(planning.dag.index[o] for o in modifiees)}:
+                        debut = planning.origine + timedelta(days=planning.es[j])
+                        phases.append({"operation_id": operation_id, "ordre": planning.dag.ordres[j],
+                                       "position": j, "allongee": j == i, "date_debut_prevue": debut,
+                                       "date_fin_prevue": debut + timedelta(days=planning.durees[j] + planning.decalages[j])})
+                    decalage_fin = (planning.date_fin() - fin_avant).days
+                
+                fin = _parse_date(operation.get('date_fin_prevue'))
+                if fin is not None and decalage_fin:
+                    fin = fin + timedelta(days=decalage_fin)
+                    lignes_operations.append({"id": operation_id, "date_fin_prevue": fin})
+                    periodes.append((operation, {**operation, 'date_fin_prevue': fin.isoformat()}))
+            
+            if phases:
+                existantes = {
+                    (ligne.operation_id, ligne.ordre): ligne.id
+                    for ligne in session.execute(select(Phase.id, Phase.operation_id, Phase.ordre)
+                                                 .where(Phase.operation_id.in_(list(delais))))
+                }
+                mises_a_jour, nouvelles = [], []
+                for phase in phases:
+                    position, allongee = phase.pop("position"), phase.pop("allongee")
+                    phase_id = existantes.get((phase["operation_id"], phase["ordre"]))
+                    if phase_id is not None:
+                        mises_a_jour.append({"id": phase_id, "date_debut_prevue": phase["date_debut_prevue"],
+                                             "date_fin_prevue": phase["date_fin_prevue"]})
+                    elif allongee:
+                        # La phase allongée doit être enregistrée pour que sa durée survive au rechargement
+                        dag = plannings[phase["operation_id"]].dag
+                        nouvelles.append({**phase, "nom": dag.noms[position], "statut": "NON_DEMARREE",
+                                          "responsable": dag.responsables[position], "est_jalon": dag.jalons[position]})
+                if mises_a_jour:
+                    session.execute(update(Phase), mises_a_jour)
+                if nouvelles:
+                    session.execute(insert(Phase), nouvelles)
+            if lignes_operations:
+                session.execute(update(Operation), lignes_operations)
+                # Mois d'activité : une seule mise à jour groupée pour toutes les opérations prolongées
+                mois = _mois_actifs(pd.DataFrame([avant for avant, _ in periodes]))
+                mois['operations_actives'] *= -1
+                appliquer_deltas_activite(session, pd.concat(
+                    [mois, _mois_actifs(pd.DataFrame([apres for _, apres in periodes]))], ignore_index=True))
+            session.commit()
+        except Exception:
+            for operation_id in plannings:
+                invalidate_operation(operation_id, 'planning')
+            raise
+    
+    for operation_id in {avenant.operation_id for avenant in avenants}:
+        invalidate_operation(operation_id, 'avenants', 'phases', 'operation')
+    return {ligne["id"]: ligne["date_fin_prevue"] for ligne in lignes_operations}
+
+# --- GPA : registre des réclamations et suivi des délais d'intervention -------
+
+STATUTS_GPA_CLOS = ('RESOLU', 'CLOTUREE')
+HEURES_PAR_UNITE_GPA = {'HEURES': 1, 'JOURS': 24}
+
+def normaliser_type_gpa(libelle):
+    """'Électricité' -> 'ELECTRICITE' (clé de workflow_gpa.types_reclamations)"""
+    libelle = unicodedata.normalize('NFKD', str(libelle)).encode('ascii', 'ignore').decode().upper()
+    return re.sub(r'[^A-Z0-9]+', '_', libelle).strip('_')
+
+def delais_intervention_gpa():
+    """
+    Délai contractuel d'intervention en heures par type normalisé (workflow_gpa.types_reclamations)
+    Types non paramétrés : délai de l'étape d'intervention de l'entreprise
+    """
+    workflow = load_workflow_modules().get('workflow_gpa', {})
+    delais = {
+        normaliser_type_gpa(type_gpa['type']): type_gpa['delai_intervention'] * HEURES_PAR_UNITE_GPA[type_gpa.get('unite', 'JOURS')]
+        for type_gpa in workflow.get('types_reclamations', [])
+    }
+    defaut = next((etape['delai_jours'] for etape in workflow.get('etapes', [])
+                   if etape.get('responsable') == 'ENTREPRISE'), 15) * 24
+    return delais, defaut
+
+class RegistreGPA:
+    """
+    Registre des réclamations GPA du portefeuille
+    - Échéance d'intervention par réclamation (délai du type, arrondi au jour supérieur)
+    - Index inversé opération / commune / logement / type / entreprise / statut
+    - Agrégats par entreprise ou type calculés sur la sélection (médiane des durées de résolution)
+    """
+    
+    INDEX = ('operation_id', 'commune', 'logement', 'type_code', 'entreprise', 'statut')
+    
+    def __init__(self, session, aujourd_hui):
+        requete = (select(*ReclamationGPA.__table__.columns, Operation.commune)
+                   .join(Operation, Operation.id == ReclamationGPA.operation_id)
+                   .order_by(ReclamationGPA.date, ReclamationGPA.id))
+        lignes = pd.read_sql(requete, session.connection())
+        for champ in ('commune', 'logement', 'type', 'entreprise', 'statut'):
+            lignes[champ] = lignes[champ].fillna('')
+        for champ in ('date', 'date_resolution'):
+            lignes[champ] = pd.to_datetime(lignes[champ])
+        
+        # Normalisation sur les seuls libellés distincts
+        codes, types = pd.factorize(lignes['type'])
+        lignes['type_code'] = np.array([normaliser_type_gpa(t) for t in types], dtype=object)[codes] if len(types) else ''
+        
+        delais, defaut = delais_intervention_gpa()
+        lignes['delai_sla_heures'] = lignes['type_code'].map(delais).fillna(defaut).astype(int)
+        lignes['echeance'] = lignes['date'] + pd.to_timedelta(-(-lignes['delai_sla_heures'] // 24), unit='D')
+        
+        # Réclamation ouverte : jugée à aujourd'hui ; close : à sa date de résolution
+        lignes['ouverte'] = ~lignes['statut'].isin(STATUTS_GPA_CLOS)
+        fin = lignes['date_resolution'].where(~lignes['ouverte'], pd.Timestamp(aujourd_hui))
+        lignes['retard_jours'] = (fin - lignes['echeance']).dt.days.clip(lower=0)
+        lignes['hors_delai'] = lignes['retard_jours'].fillna(0) > 0
+        lignes['duree_resolution'] = (lignes['date_resolution'] - lignes['date']).dt.days.where(~lignes['ouverte'])
+        
+        self.lignes = lignes
+        self.postings = construire_postings(lignes, self.INDEX)
+    
+    def rechercher(self, **filtres):
+        """Réclamations satisfaisant tous les filtres de l'index (valeur ou liste de valeurs)"""
+        return rechercher_postings(self.lignes, self.postings, filtres)
+    
+    def hors_delai(self, ouvertes=True, **filtres):
+        """Réclamations ayant dépassé leur délai d'intervention, les plus en retard d'abord"""
+        lignes = self.rechercher(**filtres)
+        masque = lignes['hors_delai'] & lignes['ouverte'] if ouvertes else lignes['hors_delai']
+        return lignes[masque].sort_values('retard_jours', ascending=False)
+    
+    def totaux(self, par='entreprise', **filtres):
+        """Nombre de réclamations, ouvertes, hors délai et durée médiane de résolution par entreprise ou type"""
+        lignes = self.rechercher(**filtres)
+        totaux = lignes.groupby(par).agg(
+            nb_reclamations=('id', 'size'), ouvertes=('ouverte', 'sum'), hors_delai=('hors_delai', 'sum'),
+            duree_mediane=('duree_resolution', 'median')
+        )
+        totaux['taux_hors_delai'] = totaux['hors_delai'] / totaux['nb_reclamations'] * 100
+        return totaux.sort_values(['hors_delai', 'nb_reclamations'], ascending=False)
+    
+    def duree_mediane(self, **filtres):
+        """Durée médiane de résolution (jours) des réclamations closes de la sélection"""
+        duree = self.rechercher(**filtres)['duree_resolution'].median()
+        return None if pd.isna(duree) else float(duree)
+
+def construire_registre_gpa(aujourd_hui):
+    with get_session() as session:
+        return RegistreGPA(session, aujourd_hui)
+
+def get_registre_gpa():
+    """Registre GPA, reconstruit quand une opération, le jour ou le paramétrage change"""
+    aujourd_hui = date.today()
+    load_workflow_modules()
+    return get_cache_operations().get_global('registre_gpa', lambda: construire_registre_gpa(aujourd_hui),
+                                             version=(aujourd_hui, get_registre_reference().version('workflow_modules')))
+
+def creer_reclamation_gpa(operation_id, logement, type_reclamation, description, locataire, entreprise=None):
+    """Enregistre une réclamation signalée ce jour (délai d'intervention du type) et la retourne"""
+    delais, defaut = delais_intervention_gpa()
+    heures = delais.get(normaliser_type_gpa(type_reclamation), defaut)
+    with get_session() as session:
+        reclamation = ReclamationGPA(operation_id=operation_id, date=date.today(), logement=logement,
+                                     type=type_reclamation, description=description, locataire=locataire,
+                                     statut='SIGNALE', delai_intervention=-(-heures // 24), entreprise=entreprise or None)
+        session.add(reclamation)
+        session.commit()
+        donnees = reclamation.to_dict()
+    invalidate_operation(operation_id, 'gpa')
+    return donnees
+
+# --- Clôture : checklist obligatoire et indicateurs de performance (workflow_cloture) ---
+
+DUREE_GPA_JOURS = 365
+
+# Condition de checklist_obligatoire -> fait calculé (toute autre condition : validation manuelle)
+CONDITIONS_CLOTURE = {
+    "COUNT(phases WHERE statut != 'VALIDEE') = 0": 'phases_validees',
+    "solde_operation = 0": 'soldes_apures',
+    "retenue_garantie_levee = TRUE": 'retenue_levee'
+}
+
+# Indicateur de performance -> calcul vectorisé sur les faits (formules de workflow_cloture)
+CALCULS_INDICATEURS_CLOTURE = {
+    "Respect Budget": lambda faits: (faits['budget_final'] - faits['budget_initial'])
+                                    / faits['budget_initial'].replace(0, np.nan) * 100,
+    "Respect Planning": lambda faits: (faits['duree_reelle'] - faits['duree_prevue'])
+                                      / faits['duree_prevue'].where(faits['duree_prevue'] > 0) * 100,
+    "Qualité Livraison": lambda faits: faits['reclamations_gpa'] / faits['nb_logements'].replace(0, np.nan)
+}
+
+def _phases_planning(operation_ids=None):
+    """Phases CPM (operation_id, statut, fin) : portefeuille en cache ou plannings des opérations demandées"""
+    if operation_ids is None:
+        return get_phases_portefeuille()[['operation_id', 'statut', 'fin']]
+    lignes = []
+    for operation_id in operation_ids:
+        operation = get_operation(operation_id)
+        planning = get_planning(operation) if operation else None
+        if planning is not None:
+            lignes += [(operation_id, phase['statut'], phase['date_fin_prevue']) for phase in planning.phases()]
+    phases = pd.DataFrame(lignes, columns=['operation_id', 'statut', 'fin'])
+    phases['fin'] = pd.to_datetime(phases['fin'])
+    return phases
+
+def _faits_cloture(aujourd_hui, operation_ids=None):
+    """
+    Faits de clôture par opération (sélection ou tout le portefeuille) : quelques requêtes groupées
+    - Phases : toutes validées, fin du planning (réelle une fois réceptionnée)
+    - Soldes : tous les lots DGD au décompte généré et aucun avenant en attente
+    - Retenue de garantie : année de GPA écoulée depuis la réception, sans réclamation ouverte
+    """
+    def selection(requete, colonne):
+        return requete if operation_ids is None else requete.where(colonne.in_(list(operation_ids)))
+    
+    requetes = {
+        'operations': selection(select(Operation.id, Operation.nom, Operation.aco_responsable, Operation.commune,
+                                       Operation.statut, Operation.budget_total, Operation.nb_logements_total,
+                                       Operation.date_debut_prevue, Operation.date_fin_prevue), Operation.id),
+        'avenants': selection(select(Avenant.operation_id,
+                                     func.sum(case((Avenant.statut == 'VALIDE', Avenant.impact_budget), else_=0)).label('avenants_valides'),
+                                     func.sum(case((Avenant.statut.in_(STATUTS_AVENANT_CLOS), 0), else_=1)).label('avenants_en_attente'))
+                              .group_by(Avenant.operation_id), Avenant.operation_id),
+        'dgd': selection(select(LotDGD.operation_id, LotDGD.statut), LotDGD.operation_id),
+        'gpa': selection(select(ReclamationGPA.operation_id, func.count(ReclamationGPA.id).label('reclamations_gpa'),
+                                func.sum(case((ReclamationGPA.statut.in_(STATUTS_GPA_CLOS), 0), else_=1)).label('gpa_ouvertes'))
+                         .group_by(ReclamationGPA.operation_id), ReclamationGPA.operation_id)
+    }
+    with get_session() as session:
+        frames = {nom: pd.read_sql(requete, session.connection()) for nom, requete in requetes.items()}
+    
+    faits = frames['operations'].set_index('id')
+    for nom in ('avenants', 'gpa'):
+        faits = faits.join(frames[nom].set_index('operation_id'))
+    
+    # Phases du planning CPM (phases du template comprises)
+    phases = _phases_planning(operation_ids)
+    groupes = phases.groupby('operation_id')
+    faits['nb_phases'] = groupes.size()
+    faits['phases_ouvertes'] = (phases['statut'] != 'VALIDEE').groupby(phases['operation_id']).sum()
+    faits['fin_planning'] = groupes['fin'].max()
+    for colonne in ('nb_phases', 'phases_ouvertes', 'avenants_valides', 'avenants_en_attente', 'reclamations_gpa', 'gpa_ouvertes'):
+        faits[colonne] = faits[colonne].fillna(0).astype(int)
+    
+    dgd = frames['dgd']
+    faits['etape_dgd'] = dgd['statut'].map(ETAPE_STATUT_LOT_DGD).fillna(1).groupby(dgd['operation_id']).min()
+    
+    faits['budget_initial'] = faits['budget_total'].fillna(0)
+    faits['budget_final'] = faits['budget_initial'] + faits['avenants_valides']
+    faits['nb_logements'] = faits['nb_logements_total'].fillna(0)
+    debut = pd.to_datetime(faits['date_debut_prevue'])
+    faits['phases_validees'] = (faits['nb_phases'] > 0) & (faits['phases_ouvertes'] == 0)
+    reception = faits['fin_planning'].where(faits['phases_validees'])
+    faits['duree_prevue'] = (pd.to_datetime(faits['date_fin_prevue']) - debut).dt.days
+    faits['duree_reelle'] = (faits['fin_planning'] - debut).dt.days
+    faits['soldes_apures'] = (faits['etape_dgd'] == ETAPE_STATUT_LOT_DGD['DECOMPTE_GENERE']) & (faits['avenants_en_attente'] == 0)
+    faits['fin_gpa'] = reception + pd.Timedelta(days=DUREE_GPA_JOURS)
+    faits['retenue_levee'] = (faits['fin_gpa'] <= pd.Timestamp(aujourd_hui)) & (faits['gpa_ouvertes'] == 0)
+    return faits
+
+def evaluer_cloture(aujourd_hui, operation_ids=None):
+    """
+    Checklist obligatoire, indicateurs de performance et préparation à la clôture
+    Retourne {'faits', 'checklist', 'indicateurs', 'preparation'} (DataFrames, une évaluation groupée)
+    """
+    workflow = load_workflow_modules().get('workflow_cloture', {})
+    faits = _faits_cloture(aujourd_hui, operation_ids)
+    
+    requete = select(ElementCloture.operation_id, ElementCloture.item, ElementCloture.valide,
+                     ElementCloture.auteur, ElementCloture.date_validation)
+    if operation_ids is not None:
+        requete = requete.where(ElementCloture.operation_id.in_(list(operation_ids)))
+    with get_session() as session:
+        manuels = pd.read_sql(requete, session.connection()).set_index(['operation_id', 'item'])
+    
+    # Checklist : une ligne par (opération, élément)
+    lignes = []
+    for ordre, element in enumerate(workflow.get('checklist_obligatoire', []), start=1):
+        colonne = CONDITIONS_CLOTURE.get(element.get('condition'))
+        bloc = pd.DataFrame({'operation_id': faits.index, 'ordre': ordre, 'item': element['item'],
+                             'description': element.get('description', ''), 'responsable': element.get('responsable', ''),
+                             'manuel': colonne is None})
+        if colonne is None:
+            saisie = manuels.reindex(pd.MultiIndex.from_arrays([faits.index, bloc['item']]))
+            bloc['valide'] = saisie['valide'].fillna(False).astype(bool).to_numpy()
+            bloc['auteur'] = saisie['auteur'].to_numpy()
+            bloc['date_validation'] = saisie['date_validation'].to_numpy()
+        else:
+            bloc['valide'] = faits[colonne].to_numpy()
+        lignes.append(bloc)
+    checklist = pd.concat(lignes, ignore_index=True) if lignes else pd.DataFrame(
+        columns=['operation_id', 'ordre', 'item', 'description', 'responsable', 'manuel', 'valide'])
+    
+    # Indicateurs : niveau BON / ACCEPTABLE / HORS_SEUIL (valeur manquante : non évalué)
+    indicateurs = []
+    for indicateur in workflow.get('indicateurs_performance', []):
+        calcul = CALCULS_INDICATEURS_CLOTURE.get(indicateur['nom'])
+        if calcul is None:
+            continue
+        valeur = calcul(faits)
+        niveau = np.select([valeur <= indicateur['seuil_bon'], valeur <= indicateur['seuil_acceptable']],
+                           ['BON', 'ACCEPTABLE'], 'HORS_SEUIL').astype(object)
+        niveau[valeur.isna().to_numpy()] = None
+        indicateurs.append(pd.DataFrame({'operation_id': faits.index, 'nom': indicateur['nom'], 'valeur': valeur.to_numpy(),
+                                         'seuil_bon': indicateur['seuil_bon'],
+                                         'seuil_acceptable': indicateur['seuil_acceptable'], 'niveau': niveau}))
+    indicateurs = pd.concat(indicateurs, ignore_index=True) if indicateurs else pd.DataFrame(
+        columns=['operation_id', 'nom', 'valeur', 'seuil_bon', 'seuil_acceptable', 'niveau'])
+    
+    # Préparation : éléments validés et points bloquants par opération
+    groupes = checklist.groupby('operation_id')
+    preparation = faits[['nom', 'aco_responsable', 'commune', 'statut']].assign(
+        items_valides=groupes['valide'].sum().reindex(faits.index).fillna(0).astype(int),
+        items_total=groupes['valide'].size().reindex(faits.index).fillna(0).astype(int),
+        bloquants=checklist[~checklist['valide'].astype(bool)].groupby('operation_id')['item']
+                  .agg(", ".join).reindex(faits.index).fillna("")
+    )
+    preparation['pret'] = (preparation['items_valides'] == preparation['items_total']) & (preparation['items_total'] > 0)
+    preparation = preparation.sort_values(['items_valides', 'nom'], ascending=[False, True])
+    return {'faits': faits, 'checklist': checklist, 'indicateurs': indicateurs, 'preparation': preparation}
+
+class MoteurCloture:
+    """Évaluations de clôture par opération, mémorisées par (version des données, jour, paramétrage)"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resultats = {}
+    
+    def operation(self, operation_id):
+        aujourd_hui = date.today()
+        load_workflow_modules()
+        cle = (get_cache_operations().version(operation_id), aujourd_hui,
+               get_registre_reference().version('workflow_modules'))
+        with self._lock:
+            entree = self._resultats.get(operation_id)
+            if entree is not None and entree[0] == cle:
+                return entree[1]
+        
+        resultat = evaluer_cloture(aujourd_hui, [operation_id])
+        
+        with self._lock:
+            self._resultats[operation_id] = (cle, resultat)
+        return resultat
+
+@st.cache_resource
+def get_moteur_cloture():
+    """Moteur de clôture partagé (mémoire des évaluations par opération)"""
+    return MoteurCloture()
+
+def get_cloture(operation_id):
+    """Checklist, indicateurs et faits de clôture d'une opération (ne pas modifier)"""
+    return get_moteur_cloture().operation(operation_id)
+
+def get_preparation_cloture():
+    """Préparation à la clôture de tout le portefeuille, recalculée quand une opération, le jour ou le paramétrage change"""
+    aujourd_hui = date.today()
+    load_workflow_modules()
+    return get_cache_operations().get_global('cloture_portefeuille', lambda: evaluer_cloture(aujourd_hui),
+                                             version=(aujourd_hui, get_registre_reference().version('workflow_modules')))['preparation']
+
+def valider_element_cloture(operation_id, item, valide=True, auteur=None):
+    """Enregistre la validation (ou l'annulation) d'un élément manuel de la checklist"""
+    with get_session() as session:
+        element = session.scalar(select(ElementCloture).where(ElementCloture.operation_id == operation_id,
+                                                              ElementCloture.item == item))
+        if element is None:
+            element = ElementCloture(operation_id=operation_id, item=item)
+            session.add(element)
+        element.valide = bool(valide)
+        element.auteur = auteur
+        element.date_validation = date.today() if valide else None
+        session.commit()
+    invalidate_operation(operation_id, 'cloture')
+
+def cloturer_operation(operation_id):
+    """Passe l'opération au statut CLOTUREE si toute la checklist est validée ; retourne True si clôturée"""
+    checklist = get_cloture(operation_id)['checklist']
+    if checklist.empty or not checklist['valide'].all():
+        return False
+    with get_session() as session:
+        session.execute(update(Operation).where(Operation.id == operation_id).values(statut='CLOTUREE'))
+        session.commit()
+    invalidate_operation(operation_id)
+    return True
+
+DOSSIER_TEMPLATES_MED = os.environ.get("OPCOPILOT_TEMPLATES_MED", "data/templates")
+MIME_DOCX = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+CHAMP_DOCUMENT = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+def _document_med_defaut():
+    """Modèle Word standard utilisé quand le template déclaré dans workflow_med est absent"""
+    document = docx.Document()
+    document.add_heading("{{titre}}", level=0)
+    for texte in (
+        "Référence : {{reference}}",
+        "{{commune}}, le {{date_document}}",
+        "À l'attention de : {{destinataire}}",
+        "Opération : {{operation}} - {{adresse}} ({{commune}})",
+        "Objet : {{type_med}} - {{motif}}",
+        "Nous constatons les manquements suivants : {{motif}}. {{details}}",
+        "Par la présente, nous vous mettons en demeure d'y remédier dans un délai de {{delai_conformite}} jours "
+        "à compter du {{date_envoi}}, soit au plus tard le {{date_limite}}.",
+        "À défaut, le maître d'ouvrage se réserve le droit d'appliquer les pénalités et mesures prévues au marché.",
+        "{{aco_responsable}} - Agent de Conduite d'Opérations, SPIC Guadeloupe"
+    ):
+        document.add_paragraph(texte)
+    flux = io.BytesIO()
+    document.save(flux)
+    return flux.getvalue()
+
+@st.cache_resource(max_entries=16)
+def _lire_template_med(chemin, signature):
+    """Modèle Word parsé une fois par version du fichier (partagé : copié avant remplissage)"""
+    if chemin is None:
+        return docx.Document(io.BytesIO(_document_med_defaut()))
+    with open(chemin, 'rb') as f:
+        return docx.Document(io.BytesIO(f.read()))
+
+def get_template_med(type_med):
+    """Modèle Word parsé d'un type de MED (relu seulement si le fichier change)"""
+    templates = {t['type']: t['template'] for t in load_workflow_modules().get('workflow_med', {}).get('templates_med', [])}
+    chemin = os.path.join(DOSSIER_TEMPLATES_MED, templates[type_med]) if type_med in templates else None
+    if chemin is None or not os.path.exists(chemin):
+        return _lire_template_med(None, None)
+    stat = os.stat(chemin)
+    return _lire_template_med(chemin, (stat.st_mtime_ns, stat.st_size))
+
+def _remplir_document(modele, champs):
+    """Remplit les champs {{...}} d'une copie du modèle Word ; exécuté dans le thread du pool"""
+    document = copy.deepcopy(modele)
+    
+    paragraphes = list(document.paragraphs)
+    paragraphes += [p for table in document.tables for ligne in table.rows for cellule in ligne.cells for p in cellule.paragraphs]
+    for section in document.sections:
+        paragraphes += section.header.paragraphs + section.footer.paragraphs
+    for paragraphe in paragraphes:
+        if '{{' not in paragraphe.text or not paragraphe.runs:
+            continue
+        # Word découpe le texte en runs : le paragraphe est réécrit dans le premier
+        texte = CHAMP_DOCUMENT.sub(lambda m: str(champs.get(m.group(1), '')), paragraphe.text)
+        paragraphe.runs[0].text = texte
+        for run in paragraphe.runs[1:]:
+            run.text = ''
+    
+    flux = io.BytesIO()
+    document.save(flux)
+    return flux.getvalue()
+
+@st.cache_resource
+def get_pool_documents():
+    """
+    Thread unique de génération des documents, partagé par les sessions
+    Le remplissage et la sérialisation XML de python-docx sont liés au CPU (GIL) : ce thread
+    ne parallélise pas, il évite seulement de bloquer l'interface pendant un lot.
+    Pas de pool de processus : un fork du serveur Streamlit (threads, connexions SQLAlchemy) peut se bloquer
+    """
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="documents_med")
+
+def champs_med(operation, med, relance=False):
+    """Valeurs des champs du modèle Word pour une MED"""
+    date_envoi = _parse_date(med.get('date_envoi')) or date.today()
+    delai = int(med.get('delai_conformite') or 15)
+    return {
+        "titre": "RELANCE - MISE EN DEMEURE" if relance else "MISE EN DEMEURE",
+        "reference": med.get('reference', ''),
+        "type_med": med.get('type', ''),
+        "destinataire": med.get('destinataire', ''),
+        "motif": med.get('motif', ''),
+        "details": med.get('details', ''),
+        "delai_conformite": delai,
+        "date_envoi": date_envoi.strftime('%d/%m/%Y'),
+        "date_limite": (date_envoi + timedelta(days=delai)).strftime('%d/%m/%Y'),
+        "date_document": date.today().strftime('%d/%m/%Y'),
+        "operation": operation.get('nom', ''),
+        "adresse": operation.get('adresse') or '',
+        "commune": operation.get('commune', ''),
+        "aco_responsable": operation.get('aco_responsable', '')
+    }
+
+def nom_document_med(med, relance=False):
+    return f"{med['reference']}{'_relance' if relance else ''}.docx"
+
+def generer_document_med(operation, med, relance=False):
+    """Génère un document MED dans le processus courant (cas unitaire)"""
+    return _remplir_document(get_template_med(med.get('type')), champs_med(operation, med, relance))
+
+def soumettre_documents_med(operation, meds, relance=False):
+    """Soumet un lot de MED au pool ; retourne [(nom_fichier, future)] sans attendre"""
+    pool = get_pool_documents()
+    return [
+        (nom_document_med(med, relance),
+         pool.submit(_remplir_document, get_template_med(med.get('type')), champs_med(operation, med, relance)))
+        for med in meds
+    ]
+
+def archiver_documents(documents):
+    """Archive zip en mémoire de [(nom_fichier, octets)]"""
+    flux = io.BytesIO()
+    with zipfile.ZipFile(flux, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for nom, contenu in documents:
+            archive.writestr(nom, contenu)
+    return flux.getvalue()
+
+def creer_med(operation_id, type_med, destinataire, motif, delai_conformite, details=""):
+    """Enregistre une nouvelle MED (référence MED-AAAA-NNN) et la retourne"""
+    aujourd_hui = date.today()
+    prefixe = f"MED-{aujourd_hui.year}-"
+    with get_session() as session:
+        # Tri par longueur puis valeur : MED-AAAA-1000 suit MED-AAAA-999
+        derniere = session.scalar(select(Med.reference).where(Med.reference.like(prefixe + '%'))
+                                  .order_by(func.length(Med.reference).desc(), Med.reference.desc()).limit(1))
+        numero = int(derniere.rsplit('-', 1)[1]) + 1 if derniere else 1
+        med = Med(operation_id=operation_id, reference=f"{prefixe}{numero:03d}", type=type_med,
+                  destinataire=destinataire, motif=motif, date_envoi=aujourd_hui,
+                  delai_conformite=delai_conformite, statut='EN_ATTENTE_REPONSE', relance_effectuee=False)
+        session.add(med)
+        session.commit()
+        donnees = med.to_dict()
+    invalidate_operation(operation_id, 'med')
+    return {**donnees, 'details': details}
+
+def relancer_meds(operation_id):
+    """Marque relancées les MED non closes (ni résolues ni escaladées) d'une opération (une transaction) et les retourne"""
+    aujourd_hui = date.today()
+    with get_session() as session:
+        meds = list(session.scalars(select(Med).where(Med.operation_id == operation_id, Med.statut.notin_(STATUTS_MED_CLOS))))
+        for med in meds:
+            med.relance_effectuee = True
+            med.date_relance = aujourd_hui
+        if meds:
+            session.execute(insert(EvenementMed), [
+                {"med_id": med.id, "operation_id": operation_id, "type": "RELANCE", "date": aujourd_hui,
+                 "echeance": aujourd_hui, "automatique": False}
+                for med in meds
+            ])
+        session.commit()
+        relancees = [med.to_dict() for med in meds]
+    if relancees:
+        invalidate_operation(operation_id, 'med')
+    return relancees
+
+# --- MED : échéancier des relances et escalades (workflow_med, étapes 8-9) -------
+
+DELAI_ESCALADE_MED = int(os.environ.get("OPCOPILOT_DELAI_ESCALADE_MED", 8))
+STATUTS_MED_CLOS = ('RESOLU', 'ESCALADEE')
+LIBELLES_ACTIONS_MED = {'RELANCE': "Relance", 'ESCALADE': "Escalade"}
+
+def prochaine_action_med(med):
+    """
+    (date, action) suivante d'une MED, None si plus rien à déclencher
+    Relance à l'échéance de mise en conformité, escalade DELAI_ESCALADE_MED jours après la relance
+    """
+    date_envoi = _parse_date(med['date_envoi'])
+    if med['statut'] in STATUTS_MED_CLOS or date_envoi is None:
+        return None
+    echeance = date_envoi + timedelta(days=med['delai_conformite'] or 15)
+    if not med['relance_effectuee']:
+        return echeance, 'RELANCE'
+    return (_parse_date(med['date_relance']) or echeance) + timedelta(days=DELAI_ESCALADE_MED), 'ESCALADE'
+
+class EcheancierMed:
+    """
+    Échéances des MED ouvertes dans un tas binaire (date, med_id, action)
+    - Chargé une fois, puis seules les opérations modifiées sont relues (versions du cache)
+    - Entrées périmées ignorées au dépilement (suppression paresseuse)
+    - Échéances atteintes dépilées en O(log n) puis relances/escalades enregistrées en une transaction
+    """
+    
+    COLONNES = (Med.id, Med.operation_id, Med.statut, Med.date_envoi, Med.delai_conformite,
+                Med.relance_effectuee, Med.date_relance)
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tas = []
+        self._actions = {}
+        self._par_operation = {}
+        self._versions = None
+    
+    def _planifier(self, med):
+        self._par_operation.setdefault(med['operation_id'], set()).add(med['id'])
+        action = prochaine_action_med(med)
+        if action is None:
+            self._actions.pop(med['id'], None)
+            return
+        self._actions[med['id']] = action
+        heapq.heappush(self._tas, (action[0], med['id'], action[1]))
+    
+    def _charger(self, session, operation_ids=None):
+        requete = select(*self.COLONNES).where(Med.statut.notin_(STATUTS_MED_CLOS))
+        if operation_ids is not None:
+            requete = requete.where(Med.operation_id.in_(operation_ids))
+            for operation_id in operation_ids:
+                for med_id in self._par_operation.pop(operation_id, ()):
+                    self._actions.pop(med_id, None)
+        for med in session.execute(requete).mappings():
+            self._planifier(med)
+        # Compactage quand les entrées périmées dominent
+        if len(self._tas) > 2 * len(self._actions) + 64:
+            self._tas = [(echeance, med_id, action) for med_id, (echeance, action) in self._actions.items()]
+            heapq.heapify(self._tas)
+    
+    def _synchroniser(self):
+        versions = get_cache_operations().versions()
+        with get_session() as session:
+            if self._versions is None:
+                self._charger(session)
+            else:
+                modifiees = [op_id for op_id, version in versions.items() if self._versions.get(op_id) != version]
+                if modifiees:
+                    self._charger(session, modifiees)
+        self._versions = versions
+    
+    def prochaine(self, med_id):
+        """(date, action) planifiée pour une MED, sans accès base"""
+        return self._actions.get(med_id)
+    
+    def traiter(self, aujourd_hui):
+        """Déclenche les relances/escalades échues ; retourne les événements enregistrés"""
+        with self._lock:
+            self._synchroniser()
+            echues = {}
+            while self._tas and self._tas[0][0] <= aujourd_hui:
+                echeance, med_id, action = heapq.heappop(self._tas)
+                if self._actions.get(med_id) == (echeance, action):
+                    echues[med_id] = (echeance, action)
+            if not echues:
+                return []
+            
+            evenements = []
+            with get_session() as session:
+                for med in session.scalars(select(Med).where(Med.id.in_(list(echues)))):
+                    echeance, action = echues[med.id]
+                    # État relu en base : une action manuelle a pu la rendre caduque
+                    if prochaine_action_med(med.to_dict()) != (echeance, action):
+                        continue
+                    if action == 'RELANCE':
+                        med.relance_effectuee = True
+                        med.date_relance = aujourd_hui
+                    else:
+                        med.statut = 'ESCALADEE'
+                    evenements.append({"med_id": med.id, "operation_id": med.operation_id, "type": action,
+                                       "date": aujourd_hui, "echeance": echeance, "automatique": True})
+                if evenements:
+                    session.execute(insert(EvenementMed), evenements)
+                session.commit()
+                for med in session.execute(select(*self.COLONNES).where(Med.id.in_(list(echues)))).mappings():
+                    self._planifier(med)
+        
+        for operation_id in {evenement['operation_id'] for evenement in evenements}:
+            invalidate_operation(operation_id, 'med')
+        return evenements
+
+@st.cache_resource
+def get_echeancier_med():
+    """Échéancier partagé, alimenté par le planificateur d'alertes"""
+    return EcheancierMed()
+
+def load_evenements_med(operation_id):
+    """Historique des relances et escalades des MED d'une opération"""
+    return load_operation_records(EvenementMed, operation_id, EvenementMed.date, EvenementMed.id)
+
+MIME_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+TAILLE_LOT_EXPORT = 5000
+
+# Feuille -> (modèle, [(colonne, libellé, format)], tri au sein d'une opération)
+FEUILLES_EXPORT = {
+    "Phases": (Phase, [
+        ("ordre", "Ordre", None), ("nom", "Phase", None), ("statut", "Statut", None),
+        ("date_debut_prevue", "Début prévu", None), ("date_fin_prevue", "Fin prévue", None),
+        ("date_debut_reelle", "Début réel", None), ("date_fin_reelle", "Fin réelle", None),
+        ("responsable", "Responsable", None), ("est_jalon", "Jalon", None), ("est_critique", "Critique", None)
+    ], ("ordre",)),
+    "REM": (RemTrimestre, [
+        ("trimestre", "Trimestre", None), ("rem_projetee", "REM projetée", "euros"), ("rem_realisee", "REM réalisée", "euros"),
+        ("depenses_projetees", "Dépenses projetées", "euros"), ("depenses_facturees", "Dépenses facturées", "euros"),
+        ("ecart_rem", "Écart REM", "euros"), ("ecart_depenses", "Écart dépenses", "euros"),
+        ("avancement_rem", "% REM", None), ("avancement_travaux", "% Travaux", None)
+    ], ("annee", "numero_trimestre")),
+    "Avenants": (Avenant, [
+        ("numero", "Numéro", None), ("date", "Date", None), ("motif", "Motif", None), ("description", "Description", None),
+        ("impact_budget", "Impact budget", "euros"), ("impact_delai", "Impact délai (j)", None),
+        ("statut", "Statut", None), ("validateur", "Validateur", None)
+    ], ("date", "numero")),
+    "Lots DGD": (LotDGD, [
+        ("nom", "Lot", None), ("marche_initial", "Marché initial", "euros"), ("quantites_reelles", "Quantités réelles (%)", None),
+        ("plus_moins_value", "Plus/moins-value", "euros"), ("penalites", "Pénalités", "euros"),
+        ("montant_final", "Montant final", "euros"), ("statut", "Statut", None)
+    ], ("id",)),
+    "GPA": (ReclamationGPA, [
+        ("date", "Date", None), ("logement", "Logement", None), ("type", "Type", None), ("description", "Description", None),
+        ("locataire", "Locataire", None), ("statut", "Statut", None), ("delai_intervention", "Délai intervention", None),
+        ("entreprise", "Entreprise", None), ("date_resolution", "Résolution", None)
+    ], ("date",))
+}
+
+# Colonnes recalculées par un moteur Python, par lot d'opérations exportées : {id de ligne : valeur}
+COLONNES_MOTEUR = {
+    LotDGD: {"montant_final": montants_finals_dgd}
+}
+
+def exporter_xlsx(operation_ids=None, feuilles=None):
+    """
+    Écrit l'export Excel dans un fichier temporaire et retourne son chemin
+    - xlsxwriter en mode constant_memory : chaque ligne part sur disque dès son écriture
+    - lignes lues en flux depuis la base (yield_per) : mémoire bornée quel que soit le volume
+    """
+    fichier = tempfile.NamedTemporaryFile(prefix="opcopilot_export_", suffix=".xlsx", delete=False)
+    fichier.close()
+    classeur = xlsxwriter.Workbook(fichier.name, {'constant_memory': True, 'default_date_format': 'dd/mm/yyyy'})
+    formats = {None: None, 'euros': classeur.add_format({'num_format': '#,##0 €'})}
+    format_entete = classeur.add_format({'bold': True, 'font_color': 'white', 'bg_color': '#0066cc'})
+    lots_ids = [None] if operation_ids is None else [
+        ids[i:i + 900] for ids in [sorted(int(i) for i in operation_ids)] for i in range(0, len(ids), 900)
+    ]
+    
+    try:
+        with get_session() as session:
+            for nom_feuille in feuilles or FEUILLES_EXPORT:
+                model, colonnes, tri = FEUILLES_EXPORT[nom_feuille]
+                feuille = classeur.add_worksheet(nom_feuille)
+                feuille.set_column(0, 0, 30)
+                for j, (_, libelle, format_colonne) in enumerate(colonnes, start=1):
+                    feuille.set_column(j, j, max(12, len(libelle) + 2), formats[format_colonne])
+                feuille.write_row(0, 0, ["Opération"] + [libelle for _, libelle, _ in colonnes], format_entete)
+                feuille.freeze_panes(1, 1)
+                
+                calculees = COLONNES_CALCULEES.get(model, {})
+                moteur = COLONNES_MOTEUR.get(model, {})
+                positions_moteur = [(j, colonne) for j, (colonne, _, _) in enumerate(colonnes, start=1) if colonne in moteur]
+                requete = (select(Operation.nom, *(calculees[colonne] if colonne in calculees else getattr(model, colonne)
+                                                   for colonne, _, _ in colonnes), model.id)
+                           .join(Operation, Operation.id == model.operation_id)
+                           .order_by(model.operation_id, *(getattr(model, colonne) for colonne in tri))
+                           .execution_options(yield_per=TAILLE_LOT_EXPORT))
+                ligne = 1
+                for lot in lots_ids:
+                    requete_lot = requete if lot is None else requete.where(model.operation_id.in_(lot))
+                    valeurs_moteur = {colonne: fonction(session, lot) for colonne, fonction in moteur.items()}
+                    for enregistrement in session.execute(requete_lot):
+                        *enregistrement, ligne_id = enregistrement
+                        for j, colonne in positions_moteur:
+                            enregistrement[j] = valeurs_moteur[colonne].get(ligne_id)
+                        feuille.write_row(ligne, 0, enregistrement)
+                        ligne += 1
+                if ligne > 1:
+                    feuille.autofilter(0, 0, ligne - 1, len(colonnes))
+    finally:
+        classeur.close()
+    return fichier.name
+
+def conserver_export(cle, chemin):
+    """Mémorise le dernier export d'une session (le précédent fichier temporaire est supprimé)"""
+    precedent = st.session_state.get(cle)
+    if precedent and os.path.exists(precedent):
+        os.remove(precedent)
+    st.session_state[cle] = chemin
+
+def bouton_telechargement_export(cle, nom_fichier, libelle="⬇️ Télécharger l'export Excel"):
+    """Bouton de téléchargement du dernier export de la session, lu depuis le fichier"""
+    chemin = st.session_state.get(cle)
+    if chemin and os.path.exists(chemin):
+        with open(chemin, 'rb') as f:
+            st.download_button(libelle, f, file_name=nom_fichier, mime=MIME_XLSX, key=f"telechargement_{cle}")
+
+COLONNES_IMPORT_REM = ['operation_id', 'trimestre', 'rem_projetee', 'rem_realisee', 'depenses_projetees', 'depenses_facturees']
+MONTANT_MAX_REM = 10 ** 9
+TAILLE_LOT_IMPORT = 5000
+TRIMESTRE_SAISI = r'^\s*T\s*([1-4])\s*[-/ ]?\s*(\d{4})\s*$'
+
+def _normaliser_colonne(nom):
+    """'REM Projetée (€)' -> 'rem_projetee'"""
+    nom = unicodedata.normalize('NFKD', str(nom)).encode('ascii', 'ignore').decode().lower()
+    return re.sub(r'[^a-z0-9]+', '_', nom).strip('_')
+
+def _lire_par_lots(fichier, nom_fichier, taille_lot=TAILLE_LOT_IMPORT):
+    """DataFrames successifs lus depuis un CSV (séparateur , ou ;) ou la première feuille d'un XLSX"""
+    if nom_fichier.lower().endswith(('.xlsx', '.xlsm')):
+        classeur = openpyxl.load_workbook(fichier, read_only=True, data_only=True)
+        try:
+            lignes = classeur.worksheets[0].iter_rows(values_only=True)
+            entete = ['' if cellule is None else str(cellule) for cellule in next(lignes, ())]
+            lot = []
+            for ligne in lignes:
+                lot.append(ligne[:len(entete)])
+                if len(lot) == taille_lot:
+                    yield pd.DataFrame(lot, columns=entete)
+                    lot = []
+            if lot:
+                yield pd.DataFrame(lot, columns=entete)
+        finally:
+            classeur.close()
+    else:
+        debut = fichier.read(4096)
+        fichier.seek(0)
+        if isinstance(debut, bytes):
+            debut = debut.decode('utf-8-sig', errors='ignore')
+        separateur = ';' if debut.count(';') > debut.count(',') else ','
+        yield from pd.read_csv(fichier, sep=separateur, dtype=str, chunksize=taille_lot, encoding='utf-8-sig')
+
+def _cellules_vides(valeurs):
+    """Cellules non saisies (None, NaN, chaîne vide)"""
+    return valeurs.isna() | valeurs.astype(str).str.strip().isin(['', 'None', 'nan'])
+
+def _montants(valeurs):
+    """Montants saisis ('24 500', '24500,50 €', 24500) -> float (NaN si vide ou illisible)"""
+    if not pd.api.types.is_numeric_dtype(valeurs):
+        # Motif non brut : \u202f doit être un caractère littéral pour le moteur regex de pyarrow
+        valeurs = (valeurs.astype(str).str.replace('[\\s\u202f€]', '', regex=True)
+                   .str.replace(',', '.', regex=False).replace({'': None, 'None': None, 'nan': None}))
+    return pd.to_numeric(valeurs, errors='coerce')
+
+def valider_lot_rem(lot, premiere_ligne, operations_connues):
+    """
+    Contrôles vectorisés d'un lot de lignes importées
+    Retourne (lignes valides normalisées, erreurs [ligne, erreur])
+    """
+    lot = lot.rename(columns=_normaliser_colonne)
+    manquantes = [colonne for colonne in COLONNES_IMPORT_REM if colonne not in lot]
+    if manquantes:
+        raise ValueError(f"Colonnes manquantes : {', '.join(manquantes)}")
+    lot = lot[COLONNES_IMPORT_REM].reset_index(drop=True)
+    lignes = pd.Series(np.arange(premiere_ligne, premiere_ligne + len(lot)))
+    vides = lot.apply(_cellules_vides).all(axis=1)
+    
+    controles = []
+    operation_id = pd.to_numeric(lot['operation_id'], errors='coerce')
+    controles.append((operation_id.isna() | (operation_id % 1 != 0), "operation_id non numérique"))
+    controles.append((operation_id.notna() & ~operation_id.isin(operations_connues), "opération inconnue"))
+    
+    trimestre = lot['trimestre'].astype(str).str.extract(TRIMESTRE_SAISI)
+    controles.append((trimestre[0].isna(), "trimestre invalide (attendu 'T1 2024')"))
+    
+    montants = pd.DataFrame({colonne: _montants(lot[colonne]) for colonne in COLONNES_IMPORT_REM[2:]})
+    # Réalisé non encore saisi (cellule vide) : 0 ; une valeur illisible reste une erreur
+    for colonne in ('rem_realisee', 'depenses_facturees'):
+        montants[colonne] = montants[colonne].mask(_cellules_vides(lot[colonne]), 0)
+    for colonne in montants:
+        controles.append((montants[colonne].isna(), f"{colonne} manquant ou non numérique"))
+        controles.append(((montants[colonne] < 0) | (montants[colonne] > MONTANT_MAX_REM), f"{colonne} hors bornes"))
+    
+    invalide = pd.Series(False, index=lot.index)
+    erreurs = []
+    for masque, message in controles:
+        masque = masque & ~vides
+        invalide |= masque
+        if masque.any():
+            erreurs.append(pd.DataFrame({'ligne': lignes[masque], 'erreur': message}))
+    
+    valides = ~invalide & ~vides
+    rem = montants[valides].round().astype(int)
+    rem.insert(0, 'operation_id', operation_id[valides].astype(int))
+    rem['numero_trimestre'] = trimestre.loc[valides, 0].astype(int)
+    rem['annee'] = trimestre.loc[valides, 1].astype(int)
+    rem['trimestre'] = 'T' + rem['numero_trimestre'].astype(str) + ' ' + rem['annee'].astype(str)
+    rem['ligne'] = lignes[valides]
+    return rem, erreurs
 
-def get_couleur_statut(statut):
-    """Retourne la couleur selon le statut de phase"""
-    couleurs = {
-        "VALIDEE": "#4CAF50",         # Vert
-        "EN_COURS": "#2196F3",        # Bleu
-        "EN_ATTENTE": "#FFC107",      # Jaune
-        "RETARD": "#F44336",          # Rouge
-        "CRITIQUE": "#E91E63",        # Rose
-        "NON_DEMARREE": "#9E9E9E",    # Gris
-        "VALIDATION_REQUISE": "#FF9800",  # Orange
-        "EN_REVISION": "#673AB7"      # Violet
+def importer_rem(fichier, nom_fichier):
+    """
+    Import en masse des saisies REM trimestrielles (XLSX ou CSV)
+    Lecture par lots, contrôles vectorisés, upsert (opération, trimestre)
+    en une seule transaction (seules les valeurs saisies sont stockées)
+    Retourne {'inseres', 'mis_a_jour', 'erreurs': DataFrame [ligne, erreur]}
+    """
+    with get_session() as session:
+        operations = pd.read_sql(select(Operation.id, Operation.aco_responsable, Operation.commune),
+                                 session.connection()).set_index('id')
+        valides, erreurs = [], []
+        premiere_ligne = 2  # ligne 1 : entête
+        for lot in _lire_par_lots(fichier, nom_fichier):
+            rem, erreurs_lot = valider_lot_rem(lot, premiere_ligne, operations.index)
+            valides.append(rem)
+            erreurs.extend(erreurs_lot)
+            premiere_ligne += len(lot)
+        
+        rem = pd.concat(valides, ignore_index=True) if valides else pd.DataFrame(columns=COLONNES_IMPORT_REM + ['ligne'])
+        doublons = rem.duplicated(['operation_id', 'trimestre'], keep='last')
+        if doublons.any():
+            erreurs.append(pd.DataFrame({'ligne': rem.loc[doublons, 'ligne'],
+                                         'erreur': "doublon opération/trimestre (dernière ligne retenue)"}))
+        rem = rem[~doublons]
+        
+        ids = sorted(int(i) for i in rem['operation_id'].unique())
+        existants = pd.DataFrame(_select_par_lots(session, lambda lot: select(
+            RemTrimestre.id, RemTrimestre.operation_id, RemTrimestre.trimestre, RemTrimestre.rem_realisee
+        ).where(RemTrimestre.operation_id.in_(lot)), ids), columns=['id', 'operation_id', 'trimestre', 'rem_realisee_avant'])
+        rem = rem.merge(existants, on=['operation_id', 'trimestre'], how='left')
+        
+        colonnes = ['operation_id'] + COLONNES_REM_SAISIES
+        nouveaux = rem[rem['id'].isna()]
+        mis_a_jour = rem[rem['id'].notna()].astype({'id': int})
+        if not nouveaux.empty:
+            session.execute(insert(RemTrimestre), nouveaux[colonnes].to_dict('records'))
+        if not mis_a_jour.empty:
+            session.execute(update(RemTrimestre), mis_a_jour[['id'] + colonnes].to_dict('records'))
+        
+        # Agrégats mensuels : variation de REM réalisée, rattachée au dernier mois du trimestre
+        deltas = rem.join(operations, on='operation_id')
+        deltas['rem_realisee'] = deltas['rem_realisee'] - deltas['rem_realisee_avant'].fillna(0)
+        deltas = deltas[deltas['rem_realisee'] != 0]
+        deltas['mois'] = [date(int(a), int(t) * 3, 1) for a, t in zip(deltas['annee'], deltas['numero_trimestre'])]
+        appliquer_deltas_activite(session, deltas[['mois', 'aco_responsable', 'commune', 'rem_realisee']])
+        session.commit()
+    
+    for operation_id in ids:
+        invalidate_operation(operation_id, 'rem')
+    rapport = pd.concat(erreurs, ignore_index=True) if erreurs else pd.DataFrame(columns=['ligne', 'erreur'])
+    rapport = rapport.groupby('ligne', as_index=False)['erreur'].agg(' ; '.join)
+    return {'inseres': len(nouveaux), 'mis_a_jour': len(mis_a_jour), 'erreurs': rapport}
+
+def _score_robuste(valeurs):
+    """Écart à la médiane du portefeuille en MAD normalisés (0 si dispersion nulle)"""
+    mediane = np.nanmedian(valeurs) if np.isfinite(valeurs).any() else np.nan
+    mad = np.nanmedian(np.abs(valeurs - mediane)) * 1.4826 if np.isfinite(mediane) else np.nan
+    if not mad > 0:
+        return np.where(np.isfinite(valeurs), 0.0, np.nan)
+    return (valeurs - mediane) / mad
+
+def _derniere_valeur(matrice):
+    """Dernière valeur renseignée (non NaN) de chaque ligne"""
+    saisie = ~np.isnan(matrice)
+    if matrice.shape[1] == 0:
+        return np.full(len(matrice), np.nan)
+    position = matrice.shape[1] - 1 - np.argmax(saisie[:, ::-1], axis=1)
+    return np.where(saisie.any(axis=1), matrice[np.arange(len(matrice)), position], np.nan)
+
+def load_analyse_rem(aujourd_hui):
+    """
+    Analyse REM/Travaux de tout le portefeuille sur une matrice (opération × trimestre)
+    - corrélation entre REM réalisée et dépenses facturées trimestrielles
+    - écart cumulé REM/Travaux (définition de la règle ECART_CRITIQUE) et sa dérive d'un trimestre à l'autre
+    - score d'anomalie robuste (médiane/MAD) sur l'écart et la dérive
+    Trimestres clos uniquement ; classement par score décroissant
+    """
+    requetes = {
+        'operations': select(Operation.id, Operation.nom, Operation.aco_responsable, Operation.commune, Operation.statut),
+        'rem': select(RemTrimestre.operation_id, RemTrimestre.annee, RemTrimestre.numero_trimestre,
+                      RemTrimestre.rem_projetee, RemTrimestre.rem_realisee,
+                      RemTrimestre.depenses_projetees, RemTrimestre.depenses_facturees)
     }
-    return couleurs.get(statut, "#0066cc")
+    with get_session() as session:
+        frames = {nom: pd.read_sql(requete, session.connection()) for nom, requete in requetes.items()}
+    
+    colonnes = ['rang', 'operation_id', 'operation', 'aco_responsable', 'commune', 'statut', 'nb_trimestres',
+                'correlation', 'ecart_pct', 'ecart_max_pct', 'derive_pct', 'derive_moyenne_pct', 'score']
+    rem = frames['rem']
+    rem['trimestre'] = rem['annee'] * 4 + rem['numero_trimestre'] - 1
+    rem = rem[rem['trimestre'] < aujourd_hui.year * 4 + (aujourd_hui.month - 1) // 3]
+    if rem.empty:
+        return pd.DataFrame(columns=colonnes)
+    
+    # Matrices (opération × trimestre), NaN pour les trimestres non saisis
+    lignes, operation_ids = pd.factorize(rem['operation_id'], sort=True)
+    premier = rem['trimestre'].min()
+    trimestres = (rem['trimestre'] - premier).to_numpy()
+    forme = (len(operation_ids), int(trimestres.max()) + 1)
+    matrices = {}
+    for colonne in ('rem_projetee', 'rem_realisee', 'depenses_projetees', 'depenses_facturees'):
+        matrice = np.full(forme, np.nan)
+        matrice[lignes, trimestres] = rem[colonne].to_numpy(dtype=float)
+        matrices[colonne] = matrice
+    saisi = ~np.isnan(np.stack(list(matrices.values()))).any(axis=0)
+    
+    # Corrélation de Pearson par ligne sur les trimestres saisis (au moins 3)
+    x, y = matrices['rem_realisee'], matrices['depenses_facturees']
+    nb = saisi.sum(axis=1)
+    dx = np.where(saisi, x - np.nansum(x, axis=1, keepdims=True) / nb[:, None], 0)
+    dy = np.where(saisi, y - np.nansum(y, axis=1, keepdims=True) / nb[:, None], 0)
+    denominateur = np.sqrt((dx ** 2).sum(axis=1) * (dy ** 2).sum(axis=1))
+    correlation = np.divide((dx * dy).sum(axis=1), denominateur, out=np.full(len(nb), np.nan),
+                            where=(denominateur > 0) & (nb >= 3))
+    
+    # Écart des taux d'avancement cumulés, puis dérive entre trimestres consécutifs
+    cumuls = {colonne: np.nancumsum(matrice, axis=1) for colonne, matrice in matrices.items()}
+    taux = {}
+    for nom, realise, projete in (('rem', 'rem_realisee', 'rem_projetee'),
+                                  ('travaux', 'depenses_facturees', 'depenses_projetees')):
+        taux[nom] = np.divide(cumuls[realise], cumuls[projete], out=np.full(forme, np.nan),
+                              where=saisi & (cumuls[projete] > 0))
+    ecart = np.abs(taux['rem'] - taux['travaux']) * 100
+    derive = np.diff(ecart, axis=1)
+    
+    derive_saisie = ~np.isnan(derive)
+    ecart_dernier = _derniere_valeur(ecart)
+    derive_derniere = _derniere_valeur(derive)
+    ecart_max = np.fmax.reduce(ecart, axis=1)
+    derive_moyenne = np.divide(np.nansum(np.abs(derive), axis=1), derive_saisie.sum(axis=1),
+                               out=np.full(forme[0], np.nan), where=derive_saisie.any(axis=1))
+    
+    # Anomalie : écart courant ou dérive récente hors norme du portefeuille
+    score = np.fmax(_score_robuste(ecart_dernier), _score_robuste(derive_derniere))
+    
+    analyse = pd.DataFrame({
+        'operation_id': operation_ids,
+        'nb_trimestres': nb,
+        'correlation': correlation,
+        'ecart_pct': ecart_dernier,
+        'ecart_max_pct': ecart_max,
+        'derive_pct': derive_derniere,
+        'derive_moyenne_pct': derive_moyenne,
+        'score': score
+    }).merge(frames['operations'].rename(columns={'id': 'operation_id', 'nom': 'operation'}), on='operation_id')
+    analyse = analyse.sort_values(['score', 'ecart_pct'], ascending=False, na_position='last').reset_index(drop=True)
+    analyse['rang'] = np.arange(1, len(analyse) + 1)
+    return analyse[colonnes]
+
+def get_analyse_rem():
+    """Analyse REM/Travaux du portefeuille, recalculée quand une opération ou le jour change"""
+    aujourd_hui = date.today()
+    return get_cache_operations().get_global('analyse_rem', lambda: load_analyse_rem(aujourd_hui), version=aujourd_hui)
+
+def classement_rem(n=10, operation_ids=None, actives=True):
+    """Les n opérations les plus atypiques (REM/Travaux), éventuellement parmi une sélection"""
+    analyse = get_analyse_rem()
+    if operation_ids is not None:
+        analyse = analyse[analyse['operation_id'].isin(operation_ids)]
+    if actives:
+        analyse = analyse[analyse['statut'] != 'CLOTUREE']
+    return analyse.head(n)
 
 # ==============================================================================
-# 2. TIMELINE HORIZONTALE OBLIGATOIRE
+# 5. TIMELINE HORIZONTALE OBLIGATOIRE
 # ==============================================================================
 
+def get_phases_timeline(operation):
+    """Phases affichées sur la timeline : planning CPM complet de l'opération"""
+    planning = get_planning(operation)
+    return planning.phases() if planning else []
+
+def _preparer_phases_timeline(phases_data):
+    """Colonnes vectorisées (DataFrame) nécessaires au tracé de la timeline"""
+    maintenant = pd.Timestamp(datetime.now())
+    df = pd.DataFrame({
+        'nom': [phase['nom'] for phase in phases_data],
+        'statut': [phase.get('statut') or 'NON_DEMARREE' for phase in phases_data],
+        'debut': pd.to_datetime([phase.get('date_debut_prevue') for phase in phases_data]),
+        'fin': pd.to_datetime([phase.get('date_fin_prevue') for phase in phases_data]),
+        'responsable': [phase.get('responsable') or 'Non assigné' for phase in phases_data],
+        'est_critique': [bool(phase.get('est_critique', False)) for phase in phases_data]
+    })
+    df['debut'] = df['debut'].fillna(maintenant)
+    df['fin'] = df['fin'].fillna(maintenant + pd.Timedelta(days=30))
+    df['y'] = np.arange(len(df))
+    df['couleur'] = df['statut'].map(get_couleur_statut)
+    df['debut_txt'] = df['debut'].dt.strftime('%d/%m/%Y')
+    df['fin_txt'] = df['fin'].dt.strftime('%d/%m/%Y')
+    df['hover'] = ("<b>" + df['nom'] + "</b><br>" +
+                   "Statut: " + df['statut'] + "<br>" +
+                   "Début: " + df['debut_txt'] + "<br>" +
+                   "Fin: " + df['fin_txt'] + "<br>" +
+                   "Responsable: " + df['responsable'])
+    return df
+
+def _polygones_phases(df):
+    """Rectangles des phases concaténés et séparés par None (une seule trace)"""
+    n = len(df)
+    debut = df['debut'].to_numpy(dtype=object)
+    fin = df['fin'].to_numpy(dtype=object)
+    y = df['y'].to_numpy(dtype=float)
+    
+    x = np.empty((n, 6), dtype=object)
+    x[:, 0], x[:, 1], x[:, 2], x[:, 3], x[:, 4], x[:, 5] = debut, fin, fin, debut, debut, None
+    
+    ys = np.empty((n, 6), dtype=object)
+    ys[:, 0], ys[:, 1], ys[:, 2], ys[:, 3], ys[:, 4], ys[:, 5] = y - 0.4, y - 0.4, y + 0.4, y + 0.4, y - 0.4, None
+    
+    textes = np.repeat(df['hover'].to_numpy(dtype=object), 6)
+    textes[5::6] = None
+    
+    return x.ravel().tolist(), ys.ravel().tolist(), textes.tolist()
+
 def create_timeline_horizontal(operation_data, phases_data):
     """
     Timeline Plotly Gantt HORIZONTALE style infographie
@@ -151,6 +3615,7 @@ def create_timeline_horizontal(operation_data, phases_data):
     - Jalons critiques visibles
     - Interactif : zoom, hover, clic
     - Freins intégrés visuellement
+    Nombre de traces constant : une barre par statut + débuts, fins et freins
     """
     
     if not phases_data:
@@ -158,80 +3623,75 @@ def create_timeline_horizontal(operation_data, phases_data):
         return None
     
     # Préparation des données pour timeline horizontale
+    df = _preparer_phases_timeline(phases_data)
     fig = go.Figure()
     
-    # Ajout des barres horizontales pour chaque phase
-    for i, phase in enumerate(phases_data):
-        debut = pd.to_datetime(phase.get('date_debut_prevue', datetime.now()))
-        fin = pd.to_datetime(phase.get('date_fin_prevue', datetime.now() + timedelta(days=30)))
-        
-        # Couleur selon statut
-        couleur = get_couleur_statut(phase.get('statut', 'NON_DEMARREE'))
-        
-        # Barre principale de la phase
+    # Barres des phases : un polygone multiple par statut
+    for statut, df_statut in df.groupby('statut', sort=False):
+        couleur = get_couleur_statut(statut)
+        x, y, textes = _polygones_phases(df_statut)
         fig.add_trace(go.Scatter(
-            x=[debut, fin, fin, debut, debut],
-            y=[i-0.4, i-0.4, i+0.4, i+0.4, i-0.4],
+            x=x,
+            y=y,
             fill="toself",
             fillcolor=couleur,
             line=dict(color=couleur, width=2),
             mode="lines",
-            name=phase['nom'],
-            text=f"<b>{phase['nom']}</b><br>" +
-                 f"Statut: {phase.get('statut', 'NON_DEMARREE')}<br>" +
-                 f"Début: {debut.strftime('%d/%m/%Y')}<br>" +
-                 f"Fin: {fin.strftime('%d/%m/%Y')}<br>" +
-                 f"Responsable: {phase.get('responsable', 'Non assigné')}",
+            name=statut,
+            text=textes,
+            hoveron='points',
             hovertemplate='%{text}<extra></extra>',
             showlegend=False
         ))
-        
-        # Jalon de début (cercle)
-        fig.add_trace(go.Scatter(
-            x=[debut],
-            y=[i],
-            mode='markers',
-            marker=dict(
-                size=12,
-                color=couleur,
-                symbol='circle',
-                line=dict(width=2, color='white')
-            ),
-            name=f"Début {phase['nom']}",
-            showlegend=False,
-            hovertemplate=f"<b>Début:</b> {debut.strftime('%d/%m/%Y')}<extra></extra>"
-        ))
-        
-        # Jalon de fin (carré si critique, cercle sinon)
-        symbol = 'square' if phase.get('est_critique', False) else 'circle'
+    
+    # Jalons de début (cercles)
+    fig.add_trace(go.Scatter(
+        x=df['debut'],
+        y=df['y'],
+        mode='markers',
+        marker=dict(
+            size=12,
+            color=df['couleur'],
+            symbol='circle',
+            line=dict(width=2, color='white')
+        ),
+        name="Débuts",
+        text=df['debut_txt'],
+        showlegend=False,
+        hovertemplate="<b>Début:</b> %{text}<extra></extra>"
+    ))
+    
+    # Jalons de fin (carré si critique, cercle sinon)
+    fig.add_trace(go.Scatter(
+        x=df['fin'],
+        y=df['y'],
+        mode='markers',
+        marker=dict(
+            size=np.where(df['est_critique'], 14, 10),
+            color=df['couleur'],
+            symbol=np.where(df['est_critique'], 'square', 'circle'),
+            line=dict(width=2, color='white')
+        ),
+        name="Fins",
+        text=df['fin_txt'],
+        showlegend=False,
+        hovertemplate="<b>Fin:</b> %{text}<extra></extra>"
+    ))
+    
+    # Indicateurs freins sur les phases en retard
+    df_freins = df[df['statut'] == 'RETARD']
+    if not df_freins.empty:
         fig.add_trace(go.Scatter(
-            x=[fin],
-            y=[i],
-            mode='markers',
-            marker=dict(
-                size=14 if phase.get('est_critique', False) else 10,
-                color=couleur,
-                symbol=symbol,
-                line=dict(width=2, color='white')
-            ),
-            name=f"Fin {phase['nom']}",
+            x=df_freins['fin'] + pd.Timedelta(days=1),
+            y=df_freins['y'],
+            mode='markers+text',
+            marker=dict(size=16, color='red', symbol='x'),
+            text=['⚠️'] * len(df_freins),
+            textposition='middle right',
+            name="Freins",
             showlegend=False,
-            hovertemplate=f"<b>Fin:</b> {fin.strftime('%d/%m/%Y')}<extra></extra>"
+            hovertemplate="<b>FREIN DÉTECTÉ</b><extra></extra>"
         ))
-        
-        # Indicateur frein si présent
-        if phase.get('statut') == 'RETARD':
-            fig.add_trace(go.Scatter(
-                x=[fin + timedelta(days=1)],
-                y=[i],
-                mode='markers+text',
-                marker=dict(size=16, color='red', symbol='x'),
-                text=['⚠️'],
-                textposition='middle right',
-                name=f"Frein {phase['nom']}",
-                showlegend=False,
-                hovertemplate="<b>FREIN DÉTECTÉ</b><extra></extra>"
-            ))
     
     # Configuration du layout pour timeline horizontale
     fig.update_layout(
@@ -277,19 +3737,183 @@ def create_timeline_horizontal(operation_data, phases_data):
     
     return fig, config
 
+
+# Niveau de détail : au-delà de ce nombre de phases visibles, agrégation par opération
+SEUIL_PHASES_DETAIL = 5000
+# Priorité d'affichage du statut agrégé d'une opération
+PRIORITE_STATUTS = ["RETARD", "CRITIQUE", "VALIDATION_REQUISE", "EN_REVISION", "EN_COURS", "EN_ATTENTE", "NON_DEMARREE", "VALIDEE"]
+
+def _select_par_lots(session, query_factory, ids, taille_lot=900):
+    """Exécute une requête IN par lots (limite de variables SQLite)"""
+    lignes = []
+    for i in range(0, len(ids), taille_lot):
+        lignes.extend(session.execute(query_factory(ids[i:i + taille_lot])).all())
+    return lignes
+
+def load_phases_portefeuille():
+    """
+    Phases planifiées de toutes les opérations, au format colonnes
+    Même planning CPM que la timeline détaillée : les plannings en cache par opération
+    sont réutilisés, seuls les absents (opérations modifiées ou évincées) sont recalculés
+    à partir d'une requête groupée
+    """
+    operations = load_operations()
+    cache = get_cache_operations()
+    
+    absents = cache.absents('planning', [op['id'] for op in operations])
+    phases_par_operation = {operation_id: [] for operation_id in absents}
+    if absents:
+        with get_session() as session:
+            requete = lambda ids: select(Phase).where(Phase.operation_id.in_(ids)).order_by(Phase.operation_id, Phase.ordre)
+            for phase, in _select_par_lots(session, requete, absents):
+                phases_par_operation[phase.operation_id].append(phase.to_dict())
+    
+    lignes = []
+    for op in operations:
+        # Planning évincé entre-temps : rechargé avec les phases de l'opération
+        planning = cache.get('planning', op['id'], lambda op_id: construire_planning(
+            op, phases_par_operation[op_id] if op_id in phases_par_operation else get_phases(op_id)))
+        if planning is None:
+            continue
+        for phase in planning.phases():
+            lignes.append((op['id'], phase['ordre'], phase['nom'], phase['statut'],
+                           phase['date_debut_prevue'], phase['date_fin_prevue']))
+    
+    df = pd.DataFrame(lignes, columns=['operation_id', 'ordre', 'nom', 'statut', 'date_debut_prevue', 'date_fin_prevue'])
+    df['debut'] = pd.to_datetime(df['date_debut_prevue'])
+    df['fin'] = pd.to_datetime(df['date_fin_prevue'])
+    return df.drop(columns=['date_debut_prevue', 'date_fin_prevue'])
+
+def get_phases_portefeuille():
+    """Phases du portefeuille, mises en cache par version des données"""
+    load_templates_phases()
+    return get_cache_operations().get_global('phases_portefeuille', load_phases_portefeuille)
+
+def _segments(debut, fin, y, textes):
+    """Segments [début, fin] séparés par un trou (NaT/NaN) pour une trace WebGL unique"""
+    n = len(debut)
+    x = np.empty((n, 3), dtype='datetime64[ns]')
+    x[:, 0], x[:, 1], x[:, 2] = debut, fin, np.datetime64('NaT')
+    ys = np.empty((n, 3), dtype=float)
+    ys[:, 0], ys[:, 1], ys[:, 2] = y, y, np.nan
+    t = np.repeat(textes, 3)
+    return x.ravel(), ys.ravel(), t
+
+def create_timeline_portefeuille(operations, df_phases, periode=None, niveau_detail="Auto"):
+    """
+    Timeline Gantt multi-opérations (rendu WebGL)
+    - Une ligne par opération, phases colorées par statut
+    - Niveau de détail : phases, ou une barre agrégée par opération
+    - Nombre de traces constant quel que soit le portefeuille
+    """
+    
+    if not operations or df_phases.empty:
+        return None
+    
+    noms = {op['id']: op['nom'] for op in operations}
+    rang = {op_id: i for i, op_id in enumerate(noms)}
+    
+    df = df_phases[df_phases['operation_id'].isin(rang.keys())]
+    if periode is not None:
+        debut_periode, fin_periode = pd.Timestamp(periode[0]), pd.Timestamp(periode[1])
+        df = df[(df['fin'] >= debut_periode) & (df['debut'] <= fin_periode)]
+    
+    agrege = niveau_detail == "Opérations" or (niveau_detail == "Auto" and len(df) > SEUIL_PHASES_DETAIL)
+    df = df.assign(y=df['operation_id'].map(rang), nom_operation=df['operation_id'].map(noms))
+    
+    if agrege:
+        # Une barre par opération : statut le plus prioritaire de ses phases
+        priorite = {statut: i for i, statut in enumerate(PRIORITE_STATUTS)}
+        df = df.assign(priorite=df['statut'].map(priorite).fillna(len(priorite)))
+        df = df.groupby(['operation_id', 'y', 'nom_operation'], as_index=False).agg(
+            debut=('debut', 'min'), fin=('fin', 'max'), priorite=('priorite', 'min'), nb_phases=('ordre', 'size')
+        )
+        df['statut'] = [PRIORITE_STATUTS[int(p)] if p < len(PRIORITE_STATUTS) else 'NON_DEMARREE' for p in df['priorite']]
+        df['hover'] = ("<b>" + df['nom_operation'] + "</b><br>" +
+                       df['nb_phases'].astype(str) + " phases<br>" +
+                       "Début: " + df['debut'].dt.strftime('%d/%m/%Y') + "<br>" +
+                       "Fin: " + df['fin'].dt.strftime('%d/%m/%Y'))
+        epaisseur = 10
+    else:
+        df = df.assign(hover="<b>" + df['nom_operation'] + "</b><br>" +
+                             df['ordre'].astype(str) + ". " + df['nom'] + "<br>" +
+                             "Statut: " + df['statut'] + "<br>" +
+                             "Début: " + df['debut'].dt.strftime('%d/%m/%Y') + "<br>" +
+                             "Fin: " + df['fin'].dt.strftime('%d/%m/%Y'))
+        epaisseur = 8
+    
+    fig = go.Figure()
+    for statut, df_statut in df.groupby('statut', sort=False):
+        x, y, textes = _segments(
+            df_statut['debut'].to_numpy(dtype='datetime64[ns]'),
+            df_statut['fin'].to_numpy(dtype='datetime64[ns]'),
+            df_statut['y'].to_numpy(dtype=float),
+            df_statut['hover'].to_numpy(dtype=object)
+        )
+        fig.add_trace(go.Scattergl(
+            x=x,
+            y=y,
+            mode='lines',
+            line=dict(color=get_couleur_statut(statut), width=epaisseur),
+            name=statut,
+            text=textes,
+            hovertemplate='%{text}<extra></extra>',
+            connectgaps=False
+        ))
+    
+    fig.update_layout(
+        title={
+            'text': f"📅 Timeline Portefeuille - {len(operations)} opérations" +
+                    (" (vue agrégée)" if agrege else ""),
+            'x': 0.5,
+            'xanchor': 'center',
+            'font': {'size': 20, 'color': '#0066cc', 'family': 'Arial Black'}
+        },
+        xaxis=dict(
+            title="📆 Chronologie",
+            type='date',
+            showgrid=True,
+            gridcolor='rgba(128,128,128,0.2)',
+            tickformat='%d/%m/%Y'
+        ),
+        yaxis=dict(
+            title="🏗️ Opérations",
+            tickmode='array',
+            tickvals=list(rang.values()),
+            ticktext=[f"{nom[:25]}{'...' if len(nom) > 25 else ''}" for nom in noms.values()],
+            showgrid=True,
+            gridcolor='rgba(128,128,128,0.2)',
+            autorange='reversed'
+        ),
+        height=min(max(500, len(operations) * 22), 12000),
+        showlegend=True,
+        plot_bgcolor='white',
+        paper_bgcolor='white',
+        margin=dict(l=250, r=100, t=100, b=80),
+        hovermode='closest',
+        dragmode='zoom'
+    )
+    
+    config = {
+        'displayModeBar': True,
+        'modeBarButtonsToAdd': ['pan2d', 'zoomin2d', 'zoomout2d', 'resetScale2d'],
+        'modeBarButtonsToRemove': ['lasso2d', 'select2d']
+    }
+    
+    return fig, config
+
 # ==============================================================================
-# 3. MODULES INTÉGRÉS PAR OPÉRATION
+# 6. MODULES INTÉGRÉS PAR OPÉRATION
 # ==============================================================================
 
 def module_rem(operation_id):
     """Module REM intégré dans l'opération"""
     st.markdown("### 💰 Module REM - Suivi Trimestriel")
     
-    # Chargement données REM
-    demo_data = load_demo_data()
-    rem_data = demo_data.get('rem_demo', {}).get(f'operation_{operation_id}', [])
+    # Chargement données REM (écarts et avancements déjà calculés, sans copie)
+    rem = get_rem(operation_id)
     
-    if not rem_data:
+    if rem.empty:
         st.warning("Aucune donnée REM disponible pour cette opération")
         return
     
@@ -299,23 +3923,25 @@ def module_rem(operation_id):
         st.markdown("#### 📊 Suivi REM")
         
         # Tableau REM
-        df_rem = pd.DataFrame(rem_data)
-        df_rem_display = df_rem[['trimestre', 'rem_projetee', 'rem_realisee', 'ecart_rem', 'avancement_rem']].copy()
-        df_rem_display.columns = ['Trimestre', 'REM Projetée (€)', 'REM Réalisée (€)', 'Écart (€)', '% Avancement']
-        
-        st.dataframe(df_rem_display, use_container_width=True)
+        st.dataframe(
+            rem, use_container_width=True, hide_index=True,
+            column_order=['trimestre', 'rem_projetee', 'rem_realisee', 'ecart_rem', 'avancement_rem'],
+            column_config={'trimestre': 'Trimestre', 'rem_projetee': 'REM Projetée (€)',
+                           'rem_realisee': 'REM Réalisée (€)', 'ecart_rem': 'Écart (€)',
+                           'avancement_rem': '% Avancement'}
+        )
         
         # Graphique REM
         fig_rem = go.Figure()
         fig_rem.add_trace(go.Bar(
-            x=df_rem['trimestre'],
-            y=df_rem['rem_projetee'],
+            x=rem['trimestre'],
+            y=rem['rem_projetee'],
             name='REM Projetée',
             marker_color='#0066cc'
         ))
         fig_rem.add_trace(go.Bar(
-            x=df_rem['trimestre'],
-            y=df_rem['rem_realisee'],
+            x=rem['trimestre'],
+            y=rem['rem_realisee'],
             name='REM Réalisée',
             marker_color='#ff6b35'
         ))
@@ -330,22 +3956,25 @@ def module_rem(operation_id):
         st.markdown("#### 🏗️ Suivi Dépenses Travaux")
         
         # Tableau Travaux
-        df_travaux_display = df_rem[['trimestre', 'depenses_projetees', 'depenses_facturees', 'ecart_depenses', 'avancement_travaux']].copy()
-        df_travaux_display.columns = ['Trimestre', 'Dépenses Projetées (€)', 'Dépenses Facturées (€)', 'Écart (€)', '% Avancement']
-        
-        st.dataframe(df_travaux_display, use_container_width=True)
+        st.dataframe(
+            rem, use_container_width=True, hide_index=True,
+            column_order=['trimestre', 'depenses_projetees', 'depenses_facturees', 'ecart_depenses', 'avancement_travaux'],
+            column_config={'trimestre': 'Trimestre', 'depenses_projetees': 'Dépenses Projetées (€)',
+                           'depenses_facturees': 'Dépenses Facturées (€)', 'ecart_depenses': 'Écart (€)',
+                           'avancement_travaux': '% Avancement'}
+        )
         
         # Graphique Travaux
         fig_travaux = go.Figure()
         fig_travaux.add_trace(go.Bar(
-            x=df_rem['trimestre'],
-            y=df_rem['depenses_projetees'],
+            x=rem['trimestre'],
+            y=rem['depenses_projetees'],
             name='Dépenses Projetées',
             marker_color='#4CAF50'
         ))
         fig_travaux.add_trace(go.Bar(
-            x=df_rem['trimestre'],
-            y=df_rem['depenses_facturees'],
+            x=rem['trimestre'],
+            y=rem['depenses_facturees'],
             name='Dépenses Facturées',
             marker_color='#FFC107'
         ))
@@ -361,44 +3990,47 @@ def module_rem(operation_id):
     
     col_alert1, col_alert2, col_alert3 = st.columns(3)
     
-    # Calcul des alertes
-    ecarts_rem = [abs(x['ecart_rem']) for x in rem_data if x['ecart_rem'] != 0]
-    ecart_moyen = sum(ecarts_rem) / len(ecarts_rem) if ecarts_rem else 0
+    # Alertes calculées par le planificateur (seuils de workflow_rem.alertes)
+    alertes_operation = load_alertes(operation_id=operation_id).set_index('type')
+    moteur_regles = get_moteur_regles()
     
     with col_alert1:
-        if ecart_moyen < 2000:
+        regle_ecart = moteur_regles.regle("ECART_CRITIQUE")
+        if "ECART_CRITIQUE" in alertes_operation.index:
+            alerte = alertes_operation.loc["ECART_CRITIQUE"]
             st.markdown("""
-            <div class="alert-info">
-            ✅ <strong>Corrélation REM/Travaux</strong><br>
-            Cohérence globale respectée<br>
-            Écart moyen: {:.0f}€
+            <div class="alert-critical">
+            🚨 <strong>Écart critique REM/Travaux</strong><br>
+            {}<br>
+            {}
             </div>
-            """.format(ecart_moyen), unsafe_allow_html=True)
+            """.format(alerte['message'], alerte['action_requise']), unsafe_allow_html=True)
         else:
             st.markdown("""
-            <div class="alert-warning">
-            ⚠️ <strong>Écart détecté</strong><br>
-            Surveillance requise<br>
-            Écart moyen: {:.0f}€
+            <div class="alert-info">
+            ✅ <strong>Corrélation REM/Travaux</strong><br>
+            Cohérence globale respectée<br>
+            Écart sous le seuil de {:g}%
             </div>
-            """.format(ecart_moyen), unsafe_allow_html=True)
+            """.format(regle_ecart.seuil if regle_ecart else 0), unsafe_allow_html=True)
     
     with col_alert2:
-        derniere_donnee = rem_data[-2] if len(rem_data) > 1 else rem_data[0]
-        if derniere_donnee['avancement_rem'] < 95:
+        if "RETARD_SAISIE" in alertes_operation.index:
+            alerte = alertes_operation.loc["RETARD_SAISIE"]
             st.markdown("""
             <div class="alert-warning">
-            ⚠️ <strong>Retard REM</strong><br>
-            {}% réalisé seulement
+            ⚠️ <strong>Retard saisie REM</strong><br>
+            {}<br>
+            {}
             </div>
-            """.format(derniere_donnee['avancement_rem']), unsafe_allow_html=True)
+            """.format(alerte['message'], alerte['action_requise']), unsafe_allow_html=True)
         else:
             st.markdown("""
             <div class="alert-info">
-            ✅ <strong>REM dans les temps</strong><br>
-            {}% réalisé
+            ✅ <strong>Saisie REM à jour</strong><br>
+            Derniers trimestres clos renseignés
             </div>
-            """.format(derniere_donnee['avancement_rem']), unsafe_allow_html=True)
+            """, unsafe_allow_html=True)
     
     with col_alert3:
         st.markdown("""
@@ -413,43 +4045,83 @@ def module_avenants(operation_id):
     """Module Avenants intégré dans l'opération"""
     st.markdown("### 📝 Module Avenants")
     
-    # Chargement données avenants
-    demo_data = load_demo_data()
-    avenants_data = demo_data.get('avenants_demo', {}).get(f'operation_{operation_id}', [])
+    # Chargement données avenants (impacts cumulés calculés au chargement)
+    avenants = get_avenants(operation_id)
     
     col1, col2 = st.columns([2, 1])
     
     with col1:
         st.markdown("#### Liste des Avenants")
         
-        if avenants_data:
-            df_avenants = pd.DataFrame(avenants_data)
-            df_avenants_display = df_avenants[['numero', 'date', 'motif', 'impact_budget', 'impact_delai', 'statut']].copy()
-            df_avenants_display.columns = ['N°', 'Date', 'Motif', 'Impact Budget (€)', 'Impact Délai (j)', 'Statut']
-            
-            st.dataframe(df_avenants_display, use_container_width=True)
+        if not avenants.empty:
+            st.dataframe(
+                avenants, use_container_width=True, hide_index=True,
+                column_order=['numero', 'date', 'motif', 'impact_budget', 'cumul_budget', 'impact_delai', 'cumul_delai',
+                              'statut', 'validateur'],
+                column_config={
+                    'numero': "N°", 'date': st.column_config.DateColumn("Date", format="DD/MM/YYYY"), 'motif': "Motif",
+                    'impact_budget': "Impact Budget (€)", 'cumul_budget': "Cumul Budget (€)",
+                    'impact_delai': "Impact Délai (j)", 'cumul_delai': "Cumul Délai (j)",
+                    'statut': "Statut", 'validateur': "Validateur"
+                }
+            )
             
-            # Synthèse impacts
-            impact_budget_total = sum([x['impact_budget'] for x in avenants_data])
-            impact_delai_total = sum([x['impact_delai'] for x in avenants_data])
+            # Synthèse impacts : cumuls rapportés au budget et à la durée prévue de l'opération
+            synthese = synthese_avenants(operation_id)
             
             col_synth1, col_synth2, col_synth3 = st.columns(3)
             
             with col_synth1:
+                impact_budget_total = synthese['impact_budget']
                 delta_budget = f"+{impact_budget_total:,}€" if impact_budget_total > 0 else f"{impact_budget_total:,}€"
-                st.metric("Impact Budget Total", delta_budget, delta=f"{impact_budget_total/25000*100:.1f}%")
+                pourcentage = synthese['pourcentage_budget']
+                st.metric("Impact Budget Total", delta_budget,
+                          delta=f"{pourcentage:+.1f}% du budget" if pourcentage is not None else None)
             
             with col_synth2:
+                impact_delai_total = synthese['impact_delai']
                 delta_delai = f"+{impact_delai_total} jours" if impact_delai_total > 0 else f"{impact_delai_total} jours"
-                st.metric("Impact Délai Total", delta_delai, delta=f"{impact_delai_total/550*100:.1f}%")
+                pourcentage = synthese['pourcentage_delai']
+                st.metric("Impact Délai Total", delta_delai,
+                          delta=f"{pourcentage:+.1f}% de la durée" if pourcentage is not None else None,
+                          delta_color="inverse")
             
             with col_synth3:
-                st.metric("Nombre Avenants", len(avenants_data), delta="+1")
+                en_attente = int((~avenants['statut'].isin(STATUTS_AVENANT_CLOS)).sum())
+                st.metric("Nombre Avenants", synthese['nb_avenants'],
+                          delta=f"{en_attente} en attente" if en_attente else None, delta_color="off")
+            
+            st.caption(f"Dont validé : {synthese['impact_budget_valide']:+,} € • {synthese['impact_delai_valide']:+} jours")
+            
+            # Décision sur les avenants en attente (le délai validé décale le planning)
+            attente = avenants[~avenants['statut'].isin(STATUTS_AVENANT_CLOS)]
+            if not attente.empty:
+                col_dec1, col_dec2, col_dec3 = st.columns([2, 1, 1])
+                with col_dec1:
+                    avenant_id = st.selectbox(
+                        "Avenant en attente", attente['id'].tolist(), key=f"avenant_decision_{operation_id}",
+                        format_func=lambda i: "{numero} • {motif} • {impact_budget:+,} € • {impact_delai:+} j".format(
+                            **attente.set_index('id').loc[i, ['numero', 'motif', 'impact_budget', 'impact_delai']])
+                    )
+                with col_dec2:
+                    if st.button("✅ Valider", key=f"valider_avenant_{operation_id}"):
+                        fins = valider_avenants([avenant_id])
+                        if operation_id in fins:
+                            st.toast(f"📅 Fin prévue reportée au {fins[operation_id]:%d/%m/%Y}")
+                        st.rerun()
+                with col_dec3:
+                    if st.button("❌ Refuser", key=f"refuser_avenant_{operation_id}"):
+                        valider_avenants([avenant_id], statut='REFUSE')
+                        st.rerun()
         else:
             st.info("Aucun avenant pour cette opération")
     
     with col2:
         st.markdown("#### Nouvel Avenant")
+        seuils = [f"{regle.type} ≥ {regle.seuil:,.0f} → {regle.validateur}"
+                  for regle in get_moteur_regles().regles if regle.validateur]
+        if seuils:
+            st.caption("Circuit de validation : " + " • ".join(seuils))
         
         with st.form("nouvel_avenant"):
             motif = st.selectbox("Motif", [
@@ -468,16 +4140,16 @@ def module_avenants(operation_id):
             
             submitted = st.form_submit_button("📝 Créer Avenant")
             if submitted:
-                st.success("✅ Avenant créé en brouillon")
-                st.info("📧 Notification envoyée pour validation hiérarchique")
+                avenant = creer_avenant(operation_id, motif, impact_budget, impact_delai, description)
+                st.success(f"✅ Avenant {avenant['numero']} créé, en attente de validation")
+                st.info(f"📧 Circuit de validation : {avenant['validateur']}")
 
 def module_med(operation_id):
     """Module MED Automatisé intégré dans l'opération"""
     st.markdown("### ⚖️ Module MED Automatisé")
     
     # Chargement données MED
-    demo_data = load_demo_data()
-    med_data = demo_data.get('med_demo', {}).get(f'operation_{operation_id}', [])
+    med_data = get_med(operation_id)
     
     col1, col2 = st.columns([1, 1])
     
@@ -512,19 +4184,43 @@ def module_med(operation_id):
             
             submitted = st.form_submit_button("📄 Générer MED Automatique")
             if submitted and motifs and destinataire:
-                st.success("✅ MED généré automatiquement")
-                st.info("📧 Document Word créé et envoyé par email")
-                st.info("📅 Relances programmées automatiquement")
+                med = creer_med(operation_id, type_med.split()[0], destinataire, ", ".join(motifs),
+                                delai_conformite, details)
+                st.session_state[f"med_document_{operation_id}"] = (
+                    nom_document_med(med), generer_document_med(get_operation(operation_id) or {}, med)
+                )
+                st.success(f"✅ MED {med['reference']} générée automatiquement")
+                st.info("📅 Échéance de mise en conformité suivie par les alertes")
+        
+        if f"med_document_{operation_id}" in st.session_state:
+            nom_fichier, contenu = st.session_state[f"med_document_{operation_id}"]
+            st.download_button(f"⬇️ Télécharger {nom_fichier}", contenu, file_name=nom_fichier, mime=MIME_DOCX)
     
     with col2:
         st.markdown("#### Suivi MED Actives")
         
         if med_data:
-            df_med = pd.DataFrame(med_data)
-            df_med_display = df_med[['reference', 'destinataire', 'date_envoi', 'delai_conformite', 'statut']].copy()
-            df_med_display.columns = ['Référence', 'Destinataire', 'Date Envoi', 'Délai (j)', 'Statut']
+            # Prochaine relance/escalade lue dans l'échéancier (aucun calcul d'échéance ici)
+            echeancier = get_echeancier_med()
+            suivi = []
+            for med in med_data:
+                prochaine = echeancier.prochaine(med['id'])
+                suivi.append({
+                    'Référence': med['reference'], 'Destinataire': med['destinataire'],
+                    'Date Envoi': med['date_envoi'], 'Délai (j)': med['delai_conformite'], 'Statut': med['statut'],
+                    'Relancée le': med['date_relance'],
+                    'Prochaine action': f"{LIBELLES_ACTIONS_MED[prochaine[1]]} le {prochaine[0]:%d/%m/%Y}" if prochaine else ""
+                })
+            st.dataframe(pd.DataFrame(suivi), use_container_width=True, hide_index=True)
             
-            st.dataframe(df_med_display, use_container_width=True)
+            evenements = load_evenements_med(operation_id)
+            if evenements:
+                references = {med['id']: med['reference'] for med in med_data}
+                with st.expander(f"🕓 Historique relances/escalades ({len(evenements)})"):
+                    for evenement in reversed(evenements):
+                        mode = "automatique" if evenement['automatique'] else "manuelle"
+                        st.caption(f"{evenement['date']} • {references.get(evenement['med_id'], '')} • "
+                                   f"{LIBELLES_ACTIONS_MED.get(evenement['type'], evenement['type'])} {mode}")
             
             # Actions rapides
             st.markdown("#### Actions Rapides")
@@ -533,11 +4229,32 @@ def module_med(operation_id):
             
             with col_action1:
                 if st.button("🔄 Relancer MED en attente"):
-                    st.success("📧 Relance automatique envoyée")
+                    meds = relancer_meds(operation_id)
+                    if meds:
+                        st.session_state[f"med_lot_{operation_id}"] = soumettre_documents_med(
+                            get_operation(operation_id) or {}, meds, relance=True)
+                    else:
+                        st.info("Aucune MED en attente de réponse")
             
             with col_action2:
                 if st.button("📊 Rapport MED mensuel"):
                     st.info("📋 Génération rapport en cours...")
+            
+            # Lot de relances généré en arrière-plan par le thread de documents
+            lot = st.session_state.get(f"med_lot_{operation_id}")
+            if lot:
+                termines = sum(future.done() for _, future in lot)
+                if termines < len(lot):
+                    st.progress(termines / len(lot), text=f"Génération des relances : {termines}/{len(lot)}")
+                    st.button("🔄 Actualiser", key=f"med_lot_actualiser_{operation_id}")
+                else:
+                    documents = [(nom, future.result()) for nom, future in lot if future.exception() is None]
+                    echecs = [nom for nom, future in lot if future.exception() is not None]
+                    if echecs:
+                        st.error(f"❌ Génération en échec : {', '.join(echecs)}")
+                    if documents:
+                        st.download_button(f"📦 Télécharger {len(documents)} relance(s) (zip)", archiver_documents(documents),
+                                           file_name=f"relances_med_{date.today():%Y%m%d}.zip", mime="application/zip")
         else:
             st.info("Aucune MED active pour cette opération")
             
@@ -549,127 +4266,69 @@ def module_med(operation_id):
             - Surveillez le respect des délais
             """)
 
+ICONES_CONCESSIONNAIRES = {"EDF": "⚡", "EAU": "💧", "FIBRE": "🌐"}
+AFFICHAGE_STATUTS_ETAPE = {
+    'VALIDEE': ('success', "✅ Validé"),
+    'EN_COURS': ('info', "🔄 En cours"),
+    'PLANIFIE': ('warning', "📅 Planifié")
+}
+
 def module_concessionnaires(operation_id):
-    """Module Concessionnaires intégré dans l'opération"""
+    """Module Concessionnaires intégré dans l'opération (un onglet par concessionnaire déclaré)"""
     st.markdown("### 🔌 Module Concessionnaires")
     
-    # Chargement données concessionnaires
-    demo_data = load_demo_data()
-    concess_data = demo_data.get('concessionnaires_demo', {}).get(f'operation_{operation_id}', {})
+    # Chargement données concessionnaires (dates déjà interprétées)
+    etapes = get_concessionnaires(operation_id)
     
-    if not concess_data:
+    if etapes.empty:
         st.warning("Aucune donnée concessionnaire pour cette opération")
         return
     
-    # Onglets par concessionnaire
-    tab_edf, tab_eau, tab_fibre = st.tabs(["⚡ EDF", "💧 EAU", "🌐 FIBRE"])
-    
-    with tab_edf:
-        st.markdown("#### Processus EDF - Raccordement Électrique")
-        
-        edf_data = concess_data.get('EDF', {})
-        edf_etapes = edf_data.get('etapes', [])
-        
-        for etape in edf_etapes:
-            col_etape, col_statut, col_date = st.columns([3, 1, 1])
-            
-            with col_etape:
-                st.write(f"🔸 {etape['nom']}")
-            
-            with col_statut:
-                if etape['statut'] == 'VALIDEE':
-                    st.success("✅ Validé")
-                elif etape['statut'] == 'EN_COURS':
-                    st.info("🔄 En cours")
-                elif etape['statut'] == 'PLANIFIE':
-                    st.warning("📅 Planifié")
-                else:
-                    st.info("⏳ En attente")
-            
-            with col_date:
-                st.write(etape.get('date', 'À programmer'))
-        
-        col_btn1, col_btn2 = st.columns(2)
-        with col_btn1:
-            if st.button("📞 Relancer EDF", key="relance_edf"):
-                st.success("📧 Relance EDF programmée")
-        with col_btn2:
-            if st.button("📋 Rapport EDF", key="rapport_edf"):
-                st.info("📊 Génération rapport EDF...")
-    
-    with tab_eau:
-        st.markdown("#### Processus EAU - Branchement")
-        
-        eau_data = concess_data.get('EAU', {})
-        eau_etapes = eau_data.get('etapes', [])
-        
-        for etape in eau_etapes:
-            col_etape, col_statut, col_date = st.columns([3, 1, 1])
-            
-            with col_etape:
-                st.write(f"🔸 {etape['nom']}")
-            
-            with col_statut:
-                if etape['statut'] == 'VALIDEE':
-                    st.success("✅ Validé")
-                elif etape['statut'] == 'EN_COURS':
-                    st.info("🔄 En cours")
-                elif etape['statut'] == 'PLANIFIE':
-                    st.warning("📅 Planifié")
-                else:
-                    st.info("⏳ En attente")
-            
-            with col_date:
-                st.write(etape.get('date', 'À programmer'))
-        
-        col_btn1, col_btn2 = st.columns(2)
-        with col_btn1:
-            if st.button("📞 Relancer Compagnie Eau", key="relance_eau"):
-                st.success("📧 Relance programmée")
-        with col_btn2:
-            if st.button("📋 Rapport Eau", key="rapport_eau"):
-                st.info("📊 Génération rapport...")
+    definitions = load_workflow_modules().get('workflow_concessionnaires', {}).get('concessionnaires', {})
+    presents = set(etapes['concessionnaire'])
+    codes = [code for code in definitions if code in presents] + sorted(presents - set(definitions))
+    retards = calculer_retards_concessionnaires(etapes, date.today())
+    niveaux = niveaux_retard_concessionnaires(retards)
     
-    with tab_fibre:
-        st.markdown("#### Processus FIBRE - Installation")
-        
-        fibre_data = concess_data.get('FIBRE', {})
-        fibre_etapes = fibre_data.get('etapes', [])
-        
-        for etape in fibre_etapes:
-            col_etape, col_statut, col_date = st.columns([3, 1, 1])
+    for code, onglet in zip(codes, st.tabs([f"{ICONES_CONCESSIONNAIRES.get(code, '🔌')} {code}" for code in codes])):
+        with onglet:
+            st.markdown(f"#### {definitions.get(code, {}).get('nom', code)}")
             
-            with col_etape:
-                st.write(f"🔸 {etape['nom']}")
-            
-            with col_statut:
-                if etape['statut'] == 'VALIDEE':
-                    st.success("✅ Validé")
-                elif etape['statut'] == 'EN_COURS':
-                    st.info("🔄 En cours")
-                elif etape['statut'] == 'PLANIFIE':
-                    st.warning("📅 Planifié")
-                else:
-                    st.info("⏳ En attente")
+            for position in etapes.index[etapes['concessionnaire'] == code]:
+                etape = etapes.loc[position]
+                col_etape, col_statut, col_date = st.columns([3, 1, 1])
+                
+                with col_etape:
+                    st.write(f"🔸 {etape['nom']}")
+                    if niveaux[position]:
+                        st.caption(f"⚠️ {retards[position]:.0f} jour(s) de retard • {niveaux[position]}")
+                
+                with col_statut:
+                    affichage, libelle = AFFICHAGE_STATUTS_ETAPE.get(etape['statut'], ('info', "⏳ En attente"))
+                    getattr(st, affichage)(libelle)
+                
+                with col_date:
+                    libelle = etape['libelle_date'] if isinstance(etape['libelle_date'], str) else None
+                    if pd.notna(etape['date_effective']):
+                        st.write(f"{libelle} ({etape['date_effective']:%d/%m/%Y})" if libelle
+                                 else f"{etape['date_effective']:%d/%m/%Y}")
+                    else:
+                        st.write(libelle or "À programmer")
             
-            with col_date:
-                st.write(etape.get('date', 'À programmer'))
-        
-        col_btn1, col_btn2 = st.columns(2)
-        with col_btn1:
-            if st.button("📞 Relancer Opérateur", key="relance_fibre"):
-                st.success("📧 Relance programmée")
-        with col_btn2:
-            if st.button("📋 Rapport Fibre", key="rapport_fibre"):
-                st.info("📊 Génération rapport...")
+            col_btn1, col_btn2 = st.columns(2)
+            with col_btn1:
+                if st.button(f"📞 Relancer {code}", key=f"relance_{code}"):
+                    st.success(f"📧 Relance {code} programmée")
+            with col_btn2:
+                if st.button(f"📋 Rapport {code}", key=f"rapport_{code}"):
+                    st.info(f"📊 Génération rapport {code}...")
 
 def module_dgd(operation_id):
     """Module DGD intégré dans l'opération"""
     st.markdown("### 📊 Module DGD - Décompte Général Définitif")
     
     # Chargement données DGD
-    demo_data = load_demo_data()
-    dgd_data = demo_data.get('dgd_demo', {}).get(f'operation_{operation_id}', {})
+    dgd_data = get_dgd(operation_id)
     
     if not dgd_data:
         st.info("Module DGD non applicable pour cette opération (phase travaux non atteinte)")
@@ -680,89 +4339,110 @@ def module_dgd(operation_id):
     with col1:
         st.markdown("#### Décompte par Lot")
         
-        lots_data = dgd_data.get('lots', [])
-        if lots_data:
-            df_dgd = pd.DataFrame(lots_data)
-            df_dgd_display = df_dgd[['nom', 'marche_initial', 'quantites_reelles', 'plus_moins_value', 'penalites', 'montant_final']].copy()
-            df_dgd_display.columns = ['Lot', 'Marché Initial (€)', 'Qtés Réelles (%)', 'Plus/Moins-Value (€)', 'Pénalités (€)', 'Montant Final (€)']
-            
-            st.dataframe(df_dgd_display, use_container_width=True)
+        # Montants recalculés en centimes exacts, convertis pour l'affichage seulement
+        lots = dgd_data['lots']
+        affichage = lots[['nom', 'quantites_reelles']].assign(**{
+            colonne: lots[f"{colonne}_centimes"] / 100
+            for colonne in ('marche', 'pmv', 'penalites', 'final')
+        })
+        st.dataframe(
+            affichage, use_container_width=True, hide_index=True,
+            column_order=['nom', 'marche', 'quantites_reelles', 'pmv', 'penalites', 'final'],
+            column_config={
+                'nom': "Lot",
+                'marche': st.column_config.NumberColumn("Marché Initial", format="euro"),
+                'quantites_reelles': st.column_config.NumberColumn("Qtés Réelles (%)", format="%.2f"),
+                'pmv': st.column_config.NumberColumn("Plus/Moins-Value", format="euro"),
+                'penalites': st.column_config.NumberColumn("Pénalités", format="euro"),
+                'final': st.column_config.NumberColumn("Montant Final", format="euro")
+            }
+        )
+        
+        ecarts = lots[lots['ecart_controle_centimes'] != 0]
+        for _, lot in ecarts.iterrows():
+            st.warning(f"⚠️ {lot['nom']} : plus/moins-value saisie différente du calcul sur quantités "
+                       f"({euros(lot['ecart_controle_centimes']):+,.2f} €)")
     
     with col2:
         st.markdown("#### Workflow Validation")
         
-        workflow_steps = [
-            {"nom": "Saisie quantités", "responsable": "ACO", "statut": "✅"},
-            {"nom": "Validation entreprise", "responsable": "Entreprise", "statut": "✅"},
-            {"nom": "Vérification MOE", "responsable": "MOE", "statut": "🔄"},
-            {"nom": "Validation SPIC", "responsable": "SPIC", "statut": "⏳"},
-            {"nom": "Génération décompte", "responsable": "Système", "statut": "⏳"}
-        ]
-        
-        for step in workflow_steps:
-            st.write(f"{step['statut']} **{step['nom']}** - {step['responsable']}")
+        # Étapes de workflow_dgd, avancement = étape la moins avancée des lots
+        etape_courante = dgd_data['synthese']['etape']
+        for etape in load_workflow_modules().get('workflow_dgd', {}).get('etapes', []):
+            statut = "✅" if etape['ordre'] < etape_courante else "🔄" if etape['ordre'] == etape_courante else "⏳"
+            st.write(f"{statut} **{etape['nom']}** - {etape.get('responsable', '')}")
     
     # Synthèse financière
     st.markdown("#### 💰 Synthèse Financière")
     
-    synthese = dgd_data.get('synthese', {})
-    if synthese:
-        col_synth1, col_synth2, col_synth3, col_synth4 = st.columns(4)
-        
-        with col_synth1:
-            st.metric("Montant Initial", f"{synthese['montant_initial']:,} €")
-        
-        with col_synth2:
-            delta_pv = synthese['plus_moins_values']
-            st.metric("Plus/Moins-Values", f"{delta_pv:,} €", delta=f"{delta_pv/synthese['montant_initial']*100:.1f}%")
-        
-        with col_synth3:
-            st.metric("Pénalités", f"{synthese['penalites']:,} €")
-        
-        with col_synth4:
-            montant_final = synthese['montant_final']
-            ecart_pct = synthese['ecart_pourcentage']
-            st.metric("Montant Final", f"{montant_final:,} €", delta=f"{ecart_pct:.1f}%")
+    synthese = dgd_data['synthese']
+    col_synth1, col_synth2, col_synth3, col_synth4 = st.columns(4)
+    
+    with col_synth1:
+        st.metric("Montant Initial", f"{synthese['montant_initial']:,.2f} €")
+    
+    with col_synth2:
+        delta_pv = synthese['plus_moins_values']
+        part_pv = delta_pv / synthese['montant_initial'] * 100 if synthese['montant_initial'] else Decimal(0)
+        st.metric("Plus/Moins-Values", f"{delta_pv:,.2f} €", delta=f"{part_pv:.1f}%")
+    
+    with col_synth3:
+        st.metric("Pénalités", f"{synthese['penalites']:,.2f} €")
+    
+    with col_synth4:
+        st.metric("Montant Final", f"{synthese['montant_final']:,.2f} €", delta=f"{synthese['ecart_pourcentage']:.1f}%")
 
 def module_gpa(operation_id):
     """Module GPA intégré dans l'opération"""
     st.markdown("### 🛡️ Module GPA - Garantie Parfait Achèvement")
     
-    # Chargement données GPA
-    demo_data = load_demo_data()
-    gpa_data = demo_data.get('gpa_demo', {}).get(f'operation_{operation_id}', [])
+    # Réclamations de l'opération, avec échéances d'intervention (registre du portefeuille)
+    registre = get_registre_gpa()
+    reclamations = registre.rechercher(operation_id=operation_id)
     
     col1, col2 = st.columns(2)
     
     with col1:
         st.markdown("#### Réclamations Locataires")
         
-        if gpa_data:
-            df_gpa = pd.DataFrame(gpa_data)
-            df_gpa_display = df_gpa[['date', 'logement', 'type', 'description', 'statut', 'delai_intervention']].copy()
-            df_gpa_display.columns = ['Date', 'Logement', 'Type', 'Description', 'Statut', 'Délai (j)']
+        if not reclamations.empty:
+            st.dataframe(
+                reclamations, use_container_width=True, hide_index=True,
+                column_order=['date', 'logement', 'type', 'description', 'entreprise', 'statut',
+                              'echeance', 'retard_jours'],
+                column_config={
+                    'date': st.column_config.DateColumn("Date", format="DD/MM/YYYY"),
+                    'logement': "Logement", 'type': "Type", 'description': "Description",
+                    'entreprise': "Entreprise", 'statut': "Statut",
+                    'echeance': st.column_config.DateColumn("Échéance", format="DD/MM/YYYY"),
+                    'retard_jours': st.column_config.NumberColumn("Retard (j)", format="%d")
+                }
+            )
             
-            st.dataframe(df_gpa_display, use_container_width=True)
+            hors_delai = registre.hors_delai(operation_id=operation_id)
+            for _, reclamation in hors_delai.iterrows():
+                st.error(f"⏰ {reclamation['logement']} - {reclamation['type']} : délai d'intervention "
+                         f"dépassé de {reclamation['retard_jours']:.0f} jour(s) ({reclamation['entreprise'] or 'entreprise à désigner'})")
         else:
             st.info("Aucune réclamation GPA pour cette opération")
     
     with col2:
         st.markdown("#### Statistiques")
         
-        if gpa_data:
+        if not reclamations.empty:
             # Répartition par type
-            types_count = {}
-            for reclamation in gpa_data:
-                type_pb = reclamation['type']
-                types_count[type_pb] = types_count.get(type_pb, 0) + 1
+            types_count = reclamations['type'].value_counts()
+            fig_gpa = px.pie(
+                values=types_count.to_numpy(),
+                names=types_count.index,
+                title="Répartition Réclamations par Type"
+            )
+            st.plotly_chart(fig_gpa, use_container_width=True)
             
-            if types_count:
-                fig_gpa = px.pie(
-                    values=list(types_count.values()), 
-                    names=list(types_count.keys()),
-                    title="Répartition Réclamations par Type"
-                )
-                st.plotly_chart(fig_gpa, use_container_width=True)
+            duree = registre.duree_mediane(operation_id=operation_id)
+            col_stat1, col_stat2 = st.columns(2)
+            col_stat1.metric("Hors délai", int(reclamations['hors_delai'].sum()))
+            col_stat2.metric("Résolution médiane", f"{duree:.0f} j" if duree is not None else "-")
         else:
             st.success("🎉 Aucune réclamation GPA - Excellente qualité!")
     
@@ -786,71 +4466,91 @@ def module_gpa(operation_id):
         
         with col_rec2:
             locataire = st.text_input("Locataire", placeholder="Nom du locataire")
-            urgence = st.selectbox("Niveau Urgence", [
-                "Normale", 
-                "Prioritaire", 
-                "Urgente"
-            ])
+            entreprise = st.text_input("Entreprise", placeholder="Entreprise du lot concerné")
         
         with col_rec3:
             description = st.text_area("Description Problème", placeholder="Décrivez le problème...")
         
         submitted = st.form_submit_button("📨 Enregistrer Réclamation")
-        if submitted and logement and locataire and description:
-            st.success("✅ Réclamation enregistrée")
-            st.info("📧 Transmission automatique à l'ACO")
-            st.info("🔄 Entreprise notifiée selon le type de problème")
+        if submitted:
+            if logement and locataire and description:
+                reclamation = creer_reclamation_gpa(operation_id, logement, type_pb, description, locataire, entreprise)
+                st.toast(f"✅ Réclamation {reclamation['logement']} enregistrée - intervention sous "
+                         f"{reclamation['delai_intervention']} jour(s)")
+                st.rerun()
+            else:
+                st.error("❌ Veuillez renseigner le logement, le locataire et la description")
 
 def module_cloture(operation_id):
     """Module Clôture intégré dans l'opération"""
     st.markdown("### ✅ Module Clôture - Finalisation Opération")
     
+    # Checklist et indicateurs évalués sur les données de l'opération
+    cloture = get_cloture(operation_id)
+    checklist = cloture['checklist']
+    if cloture['faits'].empty:
+        st.info("Opération introuvable")
+        return
+    faits = cloture['faits'].iloc[0]
+    
     # Checklist de clôture
     st.markdown("#### 📋 Checklist de Clôture")
     
-    checklist_items = [
-        {"item": "Toutes phases validées", "statut": True, "responsable": "ACO"},
-        {"item": "Documents archivés", "statut": True, "responsable": "ACO"},
-        {"item": "Soldes financiers validés", "statut": False, "responsable": "Financier"},
-        {"item": "Retenue de garantie levée", "statut": False, "responsable": "Financier"},
-        {"item": "Bilan opération rédigé", "statut": False, "responsable": "ACO"},
-        {"item": "Lessons learned documentées", "statut": False, "responsable": "ACO"}
-    ]
-    
     col1, col2 = st.columns(2)
+    moitie = (len(checklist) + 1) // 2
     
-    with col1:
-        for item in checklist_items[:3]:
-            status_icon = "✅" if item["statut"] else "⏳"
-            st.write(f"{status_icon} **{item['item']}** - {item['responsable']}")
-    
-    with col2:
-        for item in checklist_items[3:]:
-            status_icon = "✅" if item["statut"] else "⏳"
-            st.write(f"{status_icon} **{item['item']}** - {item['responsable']}")
+    for colonne, elements in ((col1, checklist.iloc[:moitie]), (col2, checklist.iloc[moitie:])):
+        with colonne:
+            for _, element in elements.iterrows():
+                if element['manuel']:
+                    # Élément manuel : validé par son responsable
+                    coche = st.checkbox(f"**{element['item']}** - {element['responsable']}", value=bool(element['valide']),
+                                        key=f"cloture_{operation_id}_{element['ordre']}", help=element['description'])
+                    if coche != bool(element['valide']):
+                        valider_element_cloture(operation_id, element['item'], coche, faits['aco_responsable'])
+                        st.rerun()
+                else:
+                    status_icon = "✅" if element['valide'] else "⏳"
+                    st.write(f"{status_icon} **{element['item']}** - {element['responsable']}")
     
     # Bilan opération
     st.markdown("#### 📊 Bilan Opération")
     
+    indicateurs = cloture['indicateurs'].set_index('nom')
+    icones_niveau = {'BON': "🟢", 'ACCEPTABLE': "🟠", 'HORS_SEUIL': "🔴"}
+    
+    def indicateur(nom, format_valeur):
+        if nom not in indicateurs.index or pd.isna(indicateurs.at[nom, 'valeur']):
+            return "-"
+        return f"{icones_niveau[indicateurs.at[nom, 'niveau']]} {format_valeur.format(indicateurs.at[nom, 'valeur'])}"
+    
+    def mois(jours):
+        return "-" if pd.isna(jours) else f"{jours / 30.4375:.0f} mois"
+    
     col_bilan1, col_bilan2, col_bilan3 = st.columns(3)
     
     with col_bilan1:
         st.markdown("##### 💰 Bilan Financier")
-        st.metric("Budget Initial", "2 450 000 €")
-        st.metric("Budget Final", "2 398 000 €", delta="-52 000 €")
-        st.metric("Écart Budget", "-2.1%", delta_color="inverse")
+        ecart_budget = faits['budget_final'] - faits['budget_initial']
+        st.metric("Budget Initial", f"{faits['budget_initial']:,.0f} €")
+        st.metric("Budget Final", f"{faits['budget_final']:,.0f} €",
+                  delta=f"{ecart_budget:+,.0f} €", delta_color="inverse")
+        st.metric("Écart Budget", indicateur("Respect Budget", "{:+.1f}%"))
     
     with col_bilan2:
         st.markdown("##### ⏱️ Bilan Planning")
-        st.metric("Durée Prévue", "24 mois")
-        st.metric("Durée Réelle", "26 mois", delta="+2 mois")
-        st.metric("Écart Planning", "+8.3%", delta_color="inverse")
+        ecart_duree = faits['duree_reelle'] - faits['duree_prevue']
+        st.metric("Durée Prévue", mois(faits['duree_prevue']))
+        st.metric("Durée Réelle", mois(faits['duree_reelle']),
+                  delta=None if pd.isna(ecart_duree) else f"{ecart_duree:+.0f} j", delta_color="inverse")
+        st.metric("Écart Planning", indicateur("Respect Planning", "{:+.1f}%"))
     
     with col_bilan3:
         st.markdown("##### 🎯 Bilan Qualité")
-        st.metric("Phases en Retard", "3")
-        st.metric("Avenants Total", "3")
-        st.metric("Réclamations GPA", "12")
+        st.metric("Phases Ouvertes", f"{faits['phases_ouvertes']} / {faits['nb_phases']}")
+        st.metric("Réclamations GPA", f"{faits['reclamations_gpa']}", delta=f"{faits['gpa_ouvertes']} ouverte(s)",
+                  delta_color="off")
+        st.metric("Réclamations / Logement", indicateur("Qualité Livraison", "{:.2f}"))
     
     # Actions finales
     st.markdown("#### 🔚 Actions de Clôture")
@@ -867,17 +4567,19 @@ def module_cloture(operation_id):
     
     with col_action3:
         # Vérification que tous les items sont validés
-        tous_valides = all(item["statut"] for item in checklist_items)
-        if tous_valides:
+        if faits['statut'] == 'CLOTUREE':
+            st.success("🔒 Opération clôturée")
+        elif not checklist.empty and checklist['valide'].all():
             if st.button("✅ CLÔTURER OPÉRATION", key="cloturer", type="primary"):
-                st.success("🎉 Opération clôturée avec succès!")
-                st.balloons()
+                if cloturer_operation(operation_id):
+                    st.success("🎉 Opération clôturée avec succès!")
+                    st.balloons()
         else:
             st.button("⏳ Clôture en attente", key="cloturer_attente", disabled=True)
             st.info("Complétez tous les éléments de la checklist")
 
 # ==============================================================================
-# 4. NAVIGATION ACO-CENTRIQUE
+# 7. NAVIGATION ACO-CENTRIQUE
 # ==============================================================================
 
 def page_dashboard():
@@ -889,41 +4591,47 @@ def page_dashboard():
     </div>
     """, unsafe_allow_html=True)
     
-    # Chargement données
-    demo_data = load_demo_data()
-    kpis_data = demo_data.get('kpis_aco_demo', {})
-    activite_data = demo_data.get('activite_mensuelle_demo', {})
-    alertes_data = demo_data.get('alertes_demo', [])
+    # Périmètre : un ACO ou tout le portefeuille (vue direction)
+    moteur_kpis = get_moteur_kpis()
+    acos = sorted(aco for aco in get_index_operations().options('aco_responsable'))
+    aco_defaut = "Marie-Claire ADMIN"
+    choix_perimetre = ["Tous les ACO"] + acos
+    perimetre = st.selectbox("Périmètre", choix_perimetre,
+                             index=choix_perimetre.index(aco_defaut) if aco_defaut in choix_perimetre else 0)
+    aco = None if perimetre == "Tous les ACO" else perimetre
+    kpis_data = moteur_kpis.kpis(aco)
+    planificateur = get_planificateur_alertes()
+    alertes_data = load_alertes(aco=aco)
     
     # KPIs personnels ACO
-    st.markdown("### 📊 Mes KPIs ACO - Marie-Claire ADMIN")
+    st.markdown(f"### 📊 {'Mes KPIs ACO - ' + aco if aco else 'KPIs Portefeuille - Tous les ACO'}")
     
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
         st.markdown(f"""
         <div class="kpi-card">
-            <h2>{kpis_data.get('operations_actives', 23)}</h2>
+            <h2>{kpis_data['operations_actives']}</h2>
             <p>Opérations Actives</p>
-            <small>{kpis_data.get('operations_cloturees', 5)} clôturées</small>
+            <small>{kpis_data['operations_cloturees']} clôturées</small>
         </div>
         """, unsafe_allow_html=True)
     
     with col2:
-        rem_realise = kpis_data.get('rem_realisee_2024', 485000)
-        rem_prevu = kpis_data.get('rem_prevue_2024', 620000)
-        taux_real = kpis_data.get('taux_realisation_rem', 78)
+        rem_realise = kpis_data['rem_realisee']
+        rem_prevu = kpis_data['rem_prevue']
+        taux_real = kpis_data['taux_realisation_rem']
         st.markdown(f"""
         <div class="kpi-card">
             <h2>{rem_realise/1000:.0f}k€</h2>
-            <p>REM Réalisée 2024</p>
+            <p>REM Réalisée {kpis_data['annee_rem']}</p>
             <small>{taux_real}% / {rem_prevu/1000:.0f}k€ prévue</small>
         </div>
         """, unsafe_allow_html=True)
     
     with col3:
-        freins_actifs = kpis_data.get('freins_actifs', 3)
-        freins_critiques = kpis_data.get('freins_critiques', 2)
+        freins_actifs = kpis_data['freins_actifs']
+        freins_critiques = kpis_data['freins_critiques']
         st.markdown(f"""
         <div class="kpi-card">
             <h2>{freins_actifs}</h2>
@@ -933,8 +4641,8 @@ def page_dashboard():
         """, unsafe_allow_html=True)
     
     with col4:
-        echeances = kpis_data.get('echeances_semaine', 5)
-        validations = kpis_data.get('validations_requises', 12)
+        echeances = kpis_data['echeances_semaine']
+        validations = kpis_data['validations_requises']
         st.markdown(f"""
         <div class="kpi-card">
             <h2>{echeances}</h2>
@@ -943,6 +4651,10 @@ def page_dashboard():
         </div>
         """, unsafe_allow_html=True)
     
+    if aco is None:
+        with st.expander("📋 Détail par ACO"):
+            st.dataframe(moteur_kpis.kpis_par_aco(), use_container_width=True)
+    
     # Alertes et actions
     st.markdown("### 🚨 Alertes et Actions Prioritaires")
     
@@ -951,11 +4663,19 @@ def page_dashboard():
     with col_alert1:
         st.markdown("#### Alertes Critiques")
         
-        for alerte in alertes_data:
-            alert_class = f"alert-{alerte['type'].lower()}"
-            if alerte['type'] == 'CRITIQUE':
+        if planificateur.derniere_erreur:
+            st.error(f"❌ Évaluation des alertes en échec : {planificateur.derniere_erreur}")
+        if planificateur.derniere_evaluation is None:
+            st.info("🔄 Évaluation des alertes en cours...")
+        elif alertes_data.empty:
+            st.success("✅ Aucune alerte sur le périmètre")
+        else:
+            st.caption(f"Évaluées le {planificateur.derniere_evaluation:%d/%m/%Y à %H:%M}")
+        
+        for alerte in alertes_data.head(8).to_dict('records'):
+            if alerte['niveau'] == 'CRITIQUE':
                 alert_class = "alert-critical"
-            elif alerte['type'] == 'WARNING':
+            elif alerte['niveau'] == 'WARNING':
                 alert_class = "alert-warning"
             else:
                 alert_class = "alert-info"
@@ -967,6 +4687,9 @@ def page_dashboard():
                 <em>Action: {alerte['action_requise']}</em>
             </div>
             """, unsafe_allow_html=True)
+        
+        if len(alertes_data) > 8:
+            st.caption(f"+ {len(alertes_data) - 8} autre(s) alerte(s)")
     
     with col_alert2:
         st.markdown("#### Actions Réalisées Aujourd'hui")
@@ -985,13 +4708,29 @@ def page_dashboard():
     # Graphique d'activité
     st.markdown("### 📈 Activité Mensuelle")
     
-    if activite_data:
+    col_act1, col_act2 = st.columns([2, 1])
+    
+    with col_act1:
+        annee_courante = date.today().year
+        annees = st.slider("Années", min_value=annee_courante - 10, max_value=annee_courante + 5,
+                           value=(annee_courante - 2, annee_courante))
+    
+    with col_act2:
+        communes = ["Toutes"] + list(get_index_operations().options('commune'))
+        commune = st.selectbox("Commune", communes, key="activite_commune")
+    
+    activite_data = load_activite_mensuelle(
+        date(annees[0], 1, 1), date(annees[1], 12, 31),
+        aco=aco, commune=None if commune == "Toutes" else commune
+    )
+    
+    if not activite_data.empty:
         fig_dashboard = go.Figure()
         
         # REM mensuelle
         fig_dashboard.add_trace(go.Scatter(
             x=activite_data['mois'],
-            y=activite_data['rem_mensuelle'],
+            y=activite_data['rem_realisee'],
             mode='lines+markers',
             name='REM Mensuelle (€)',
             yaxis='y',
@@ -1010,9 +4749,22 @@ def page_dashboard():
             marker=dict(size=8)
         ))
         
+        # Phases validées et alertes résolues (masquées par défaut)
+        for colonne, nom, couleur in (('phases_validees', 'Phases Validées', '#4CAF50'),
+                                      ('alertes_resolues', 'Alertes Résolues', '#9E9E9E')):
+            fig_dashboard.add_trace(go.Scatter(
+                x=activite_data['mois'],
+                y=activite_data[colonne],
+                mode='lines+markers',
+                name=nom,
+                yaxis='y2',
+                line=dict(color=couleur, width=2, dash='dot'),
+                visible='legendonly'
+            ))
+        
         fig_dashboard.update_layout(
-            title="Évolution Activité ACO 2024",
-            xaxis=dict(title="Mois"),
+            title=f"Évolution Activité ACO {annees[0]}" + (f"-{annees[1]}" if annees[1] != annees[0] else ""),
+            xaxis=dict(title="Mois", tickformat='%b %Y'),
             yaxis=dict(title="REM (€)", side="left"),
             yaxis2=dict(title="Nb Opérations", side="right", overlaying="y"),
             height=450,
@@ -1020,45 +4772,216 @@ def page_dashboard():
         )
         
         st.plotly_chart(fig_dashboard, use_container_width=True)
+    else:
+        st.info("Aucune activité enregistrée sur la période")
 
 def page_portefeuille_aco():
     """Portefeuille ACO avec liste des opérations"""
     st.markdown("### 📂 Mon Portefeuille - Marie-Claire ADMIN")
     
-    # Chargement données
-    demo_data = load_demo_data()
-    operations_data = demo_data.get('operations_demo', [])
-    
-    # Filtres
-    col_filter1, col_filter2, col_filter3, col_filter4 = st.columns(4)
-    
-    with col_filter1:
-        filtre_type = st.selectbox("Type Opération", ["Tous", "OPP", "VEFA", "MANDAT_ETUDES", "MANDAT_REALISATION", "AMO"])
+    # Filtres : options et effectifs issus de l'index inversé
+    index = get_index_operations()
+    libelles_filtres = {
+        'type_operation': "Type Opération",
+        'statut': "Statut",
+        'commune': "Commune",
+        'aco_responsable': "ACO"
+    }
+    selection_courante = {
+        champ: st.session_state.get(f"filtre_{champ}") if st.session_state.get(f"filtre_{champ}") != "Tous" else None
+        for champ in libelles_filtres
+    }
     
-    with col_filter2:
-        filtre_statut = st.selectbox("Statut", ["Tous", "EN_MONTAGE", "EN_COURS", "EN_RECEPTION", "CLOTUREE"])
+    filtres = {}
+    colonnes_filtres = st.columns(len(libelles_filtres) + 1)
     
-    with col_filter3:
-        filtre_commune = st.selectbox("Commune", ["Toutes", "Les Abymes", "Pointe-à-Pitre", "Basse-Terre", "Sainte-Anne"])
+    for col_filter, (champ, libelle) in zip(colonnes_filtres, libelles_filtres.items()):
+        with col_filter:
+            effectifs = index.options(champ, **selection_courante)
+            valeur = st.selectbox(
+                libelle,
+                ["Tous"] + list(effectifs.keys()),
+                format_func=lambda v, effectifs=effectifs: v if v == "Tous" else f"{v} ({effectifs[v]})",
+                key=f"filtre_{champ}"
+            )
+            filtres[champ] = valeur if valeur != "Tous" else None
     
-    with col_filter4:
+    with colonnes_filtres[-1]:
         if st.button("➕ Nouvelle Opération", type="primary"):
             st.session_state.page = "creation_operation"
             st.rerun()
+        
+        if st.button("📥 Export Excel"):
+            ids = index.ids_filtres(**filtres) if any(filtres.values()) else None
+            conserver_export("export_portefeuille", exporter_xlsx(ids))
+        bouton_telechargement_export("export_portefeuille", f"portefeuille_{date.today():%Y%m%d}.xlsx", "⬇️ Télécharger")
+    
+    # Saisie trimestrielle REM en masse (workflow_rem, étape 3)
+    with st.expander("📤 Import REM trimestriel (XLSX/CSV)"):
+        st.caption(f"Colonnes attendues : {', '.join(COLONNES_IMPORT_REM)} • trimestre au format 'T1 2024'")
+        fichier_rem = st.file_uploader("Fichier REM", type=["xlsx", "csv"], key="import_rem")
+        if fichier_rem is not None and st.button("📤 Importer"):
+            try:
+                resultat = importer_rem(fichier_rem, fichier_rem.name)
+            except (ValueError, zipfile.BadZipFile) as erreur:
+                st.error(f"❌ Import impossible : {erreur}")
+            else:
+                st.success(f"✅ {resultat['inseres']} trimestre(s) créé(s), {resultat['mis_a_jour']} mis à jour")
+                if not resultat['erreurs'].empty:
+                    st.warning(f"⚠️ {len(resultat['erreurs'])} ligne(s) rejetée(s)")
+                    st.dataframe(resultat['erreurs'], use_container_width=True, hide_index=True)
+                    st.download_button("⬇️ Rapport d'erreurs (CSV)",
+                                       resultat['erreurs'].to_csv(index=False, sep=';').encode('utf-8-sig'),
+                                       file_name="erreurs_import_rem.csv", mime="text/csv")
+    
+    # Opérations les plus atypiques REM/Travaux (calcul portefeuille mis en cache)
+    with st.expander("📈 Analyse REM/Travaux du portefeuille"):
+        col_an1, col_an2 = st.columns([1, 3])
+        with col_an1:
+            nb_classement = st.number_input("Nombre d'opérations", min_value=5, max_value=100, value=10, step=5)
+        regle_ecart = get_moteur_regles().regle("ECART_CRITIQUE")
+        with col_an2:
+            st.caption("Écart cumulé entre avancement REM et avancement travaux (trimestres clos), "
+                       "dérive du dernier trimestre et score d'anomalie (écarts à la médiane du portefeuille)"
+                       + (f" • seuil d'alerte {regle_ecart.seuil:g}%" if regle_ecart else ""))
+        ids = index.ids_filtres(**filtres) if any(filtres.values()) else None
+        classement = classement_rem(nb_classement, ids)
+        if classement.empty:
+            st.info("Aucun trimestre REM clos pour la sélection")
+        else:
+            st.dataframe(
+                classement, use_container_width=True, hide_index=True,
+                column_order=['rang', 'operation', 'aco_responsable', 'commune', 'nb_trimestres', 'ecart_pct',
+                              'ecart_max_pct', 'derive_pct', 'correlation', 'score'],
+                column_config={
+                    'rang': "Rang", 'operation': "Opération", 'aco_responsable': "ACO", 'commune': "Commune",
+                    'nb_trimestres': "Trimestres",
+                    'ecart_pct': st.column_config.NumberColumn("Écart (%)", format="%.1f"),
+                    'ecart_max_pct': st.column_config.NumberColumn("Écart max (%)", format="%.1f"),
+                    'derive_pct': st.column_config.NumberColumn("Dérive (pts)", format="%+.1f"),
+                    'correlation': st.column_config.NumberColumn("Corrélation", format="%.2f"),
+                    'score': st.column_config.NumberColumn("Score", format="%.1f")
+                }
+            )
+    
+    # Avenants non validés par commune (agrégats du registre)
+    with st.expander("📝 Avenants en attente par commune"):
+        totaux = get_registre_avenants().totaux('commune', exclure_statuts=STATUTS_AVENANT_CLOS)
+        if filtres['commune'] is not None:
+            totaux = totaux[totaux.index == filtres['commune']]
+        if totaux.empty:
+            st.info("Aucun avenant en attente de validation")
+        else:
+            st.dataframe(
+                totaux.reset_index(), use_container_width=True, hide_index=True,
+                column_config={
+                    'commune': "Commune", 'nb_avenants': "Avenants",
+                    'plus_values': st.column_config.NumberColumn("Plus-values (€)", format="%d"),
+                    'moins_values': st.column_config.NumberColumn("Moins-values (€)", format="%d"),
+                    'impact_delai': "Délai (j)"
+                }
+            )
+    
+    # Réclamations GPA par entreprise (registre et délais d'intervention)
+    with st.expander("🛡️ GPA : délais d'intervention par entreprise"):
+        registre_gpa = get_registre_gpa()
+        totaux = registre_gpa.totaux('entreprise', commune=filtres['commune'])
+        if totaux.empty:
+            st.info("Aucune réclamation GPA")
+        else:
+            duree = registre_gpa.duree_mediane(commune=filtres['commune'])
+            col_gpa1, col_gpa2, col_gpa3 = st.columns(3)
+            col_gpa1.metric("Réclamations ouvertes", int(totaux['ouvertes'].sum()))
+            col_gpa2.metric("Hors délai", int(totaux['hors_delai'].sum()))
+            col_gpa3.metric("Résolution médiane", f"{duree:.0f} j" if duree is not None else "-")
+            st.dataframe(
+                totaux.reset_index(), use_container_width=True, hide_index=True,
+                column_config={
+                    'entreprise': "Entreprise", 'nb_reclamations': "Réclamations", 'ouvertes': "Ouvertes",
+                    'hors_delai': "Hors délai",
+                    'duree_mediane': st.column_config.NumberColumn("Résolution médiane (j)", format="%.0f"),
+                    'taux_hors_delai': st.column_config.NumberColumn("Hors délai (%)", format="%.1f")
+                }
+            )
+    
+    # Préparation à la clôture (checklist évaluée sur tout le portefeuille)
+    with st.expander("✅ Préparation à la clôture"):
+        preparation = get_preparation_cloture()
+        preparation = preparation[preparation['statut'] != 'CLOTUREE']
+        if filtres['commune'] is not None:
+            preparation = preparation[preparation['commune'] == filtres['commune']]
+        st.metric("Opérations prêtes à clôturer", int(preparation['pret'].sum()))
+        st.dataframe(
+            preparation.head(50).reset_index(), use_container_width=True, hide_index=True,
+            column_order=['nom', 'aco_responsable', 'commune', 'items_valides', 'items_total', 'pret', 'bloquants'],
+            column_config={
+                'nom': "Opération", 'aco_responsable': "ACO", 'commune': "Commune",
+                'items_valides': "Éléments validés", 'items_total': "Éléments",
+                'pret': st.column_config.CheckboxColumn("Prête"), 'bloquants': "Points bloquants"
+            }
+        )
     
-    # Application des filtres
-    operations_filtrees = operations_data
-    if filtre_type != "Tous":
-        operations_filtrees = [op for op in operations_filtrees if op['type_operation'] == filtre_type]
-    if filtre_statut != "Tous":
-        operations_filtrees = [op for op in operations_filtrees if op['statut'] == filtre_statut]
-    if filtre_commune != "Toutes":
-        operations_filtrees = [op for op in operations_filtrees if op['commune'] == filtre_commune]
+    # Timeline multi-opérations (calculée uniquement si demandée)
+    if st.toggle("📅 Timeline Portefeuille", key="timeline_portefeuille"):
+        operations_filtrees = load_operations_par_ids(index.ids_filtres(**filtres))
+        df_phases = get_phases_portefeuille()
+        
+        col_tl1, col_tl2 = st.columns([3, 1])
+        
+        with col_tl1:
+            if not df_phases.empty:
+                periode_min = df_phases['debut'].min().date()
+                periode_max = df_phases['fin'].max().date()
+                periode = st.slider("Période", min_value=periode_min, max_value=periode_max,
+                                    value=(periode_min, periode_max), format="DD/MM/YYYY")
+            else:
+                periode = None
+        
+        with col_tl2:
+            niveau_detail = st.selectbox("Niveau de détail", ["Auto", "Opérations", "Phases"])
+        
+        resultat = create_timeline_portefeuille(operations_filtrees, df_phases, periode, niveau_detail)
+        if resultat:
+            timeline_fig, config = resultat
+            st.plotly_chart(timeline_fig, use_container_width=True, config=config)
+        else:
+            st.info("Aucune phase à afficher pour la sélection")
+    
+    # Tri et pagination côté base
+    col_tri1, col_tri2, col_tri3, col_tri4 = st.columns(4)
+    
+    with col_tri1:
+        libelles_tri = {"Avancement": "avancement", "Fin prévue": "date_fin_prevue", "Freins actifs": "freins_actifs"}
+        tri = libelles_tri[st.selectbox("Trier par", list(libelles_tri.keys()))]
+    
+    with col_tri2:
+        decroissant = st.selectbox("Ordre", ["Croissant", "Décroissant"]) == "Décroissant"
+    
+    with col_tri3:
+        taille_page = st.selectbox("Opérations par page", [10, 20, 50, 100], index=1)
+    
+    # Retour en page 1 quand la sélection change
+    selection = (tuple(filtres.values()), tri, decroissant, taille_page)
+    if st.session_state.get('portefeuille_selection') != selection:
+        st.session_state.portefeuille_selection = selection
+        st.session_state.portefeuille_page = 1
+    
+    page = st.session_state.get('portefeuille_page', 1)
+    params_page = dict(taille_page=taille_page, tri=tri, decroissant=decroissant, **filtres)
+    operations_page, total = get_operations_page(page=page, **params_page)
+    nb_pages = max(1, -(-total // taille_page))
+    if page > nb_pages:
+        st.session_state.portefeuille_page = page = nb_pages
+        operations_page, total = get_operations_page(page=page, **params_page)
+    
+    with col_tri4:
+        st.number_input("Page", min_value=1, max_value=nb_pages, key="portefeuille_page")
     
     # Liste des opérations
-    st.markdown(f"#### 📋 Mes Opérations ({len(operations_filtrees)} affichées)")
+    debut_page = (page - 1) * taille_page
+    st.markdown(f"#### 📋 Mes Opérations ({debut_page + 1 if total else 0}-{debut_page + len(operations_page)} sur {total} • page {page}/{nb_pages})")
     
-    for op in operations_filtrees:
+    for op in operations_page:
         with st.container():
             st.markdown(f"""
             <div class="operation-card">
@@ -1101,14 +5024,16 @@ def page_operation_details(operation_id=None):
     if operation_id is None and 'selected_operation_id' in st.session_state:
         operation_id = st.session_state.selected_operation_id
     
-    if 'selected_operation' in st.session_state:
-        operation = st.session_state.selected_operation
-    else:
-        # Fallback avec données de démo
-        demo_data = load_demo_data()
-        operations_data = demo_data.get('operations_demo', [])
-        operation = operations_data[0] if operations_data else {}
-        operation_id = operation.get('id', 1)
+    operation = get_operation(operation_id) if operation_id is not None else None
+    if operation is None:
+        if st.session_state.get('selected_operation'):
+            # Opération non encore enregistrée en base
+            operation = st.session_state.selected_operation
+        else:
+            # Fallback sur la première opération du portefeuille
+            operations_data = load_operations(limit=1)
+            operation = operations_data[0] if operations_data else {}
+            operation_id = operation.get('id', 1)
     
     # En-tête opération
     st.markdown(f"""
@@ -1140,34 +5065,7 @@ def page_operation_details(operation_id=None):
         st.markdown("### 📅 Timeline Horizontale - Gestion des Phases")
         
         # Chargement des phases
-        demo_data = load_demo_data()
-        phases_data = demo_data.get('phases_demo', {}).get(f'operation_{operation_id}', [])
-        
-        # Si pas de phases spécifiques, on charge un template selon le type
-        if not phases_data:
-            templates = load_templates_phases()
-            type_op = operation.get('type_operation', 'OPP')
-            template_phases = templates.get(type_op, {}).get('phases', [])
-            
-            # Conversion template en phases avec dates
-            phases_data = []
-            date_courante = datetime.now()
-            
-            for i, phase_template in enumerate(template_phases[:8]):  # Limite pour démo
-                debut = date_courante + timedelta(days=i*20)
-                fin = debut + timedelta(days=phase_template.get('duree_jours', 30))
-                
-                statuts_demo = ["VALIDEE", "EN_COURS", "EN_ATTENTE", "NON_DEMARREE"]
-                statut = statuts_demo[i % len(statuts_demo)]
-                
-                phases_data.append({
-                    "nom": phase_template['nom'],
-                    "date_debut_prevue": debut.isoformat(),
-                    "date_fin_prevue": fin.isoformat(),
-                    "statut": statut,
-                    "responsable": phase_template.get('responsable_type', 'ACO'),
-                    "est_critique": phase_template.get('est_critique', False)
-                })
+        phases_data = get_phases_timeline(operation)
         
         # Affichage timeline horizontale
         if phases_data:
@@ -1186,7 +5084,7 @@ def page_operation_details(operation_id=None):
                 
                 with col_phase2:
                     if st.button("✏️ Modifier Phase"):
-                        st.info("🔄 Mode modification activé")
+                        st.session_state.edition_phase = not st.session_state.get('edition_phase', False)
                 
                 with col_phase3:
                     if st.button("⚠️ Signaler Frein"):
@@ -1194,7 +5092,31 @@ def page_operation_details(operation_id=None):
                 
                 with col_phase4:
                     if st.button("📊 Exporter Planning"):
-                        st.info("📁 Export Excel en cours...")
+                        conserver_export(f"export_operation_{operation_id}", exporter_xlsx([operation_id]))
+                
+                bouton_telechargement_export(f"export_operation_{operation_id}",
+                                             f"planning_{operation_id}_{date.today():%Y%m%d}.xlsx")
+                
+                if st.session_state.get('edition_phase'):
+                    with st.form("form_edition_phase"):
+                        libelles = {phase['ordre']: f"{phase['ordre']}. {phase['nom']}" for phase in phases_data}
+                        ordre = st.selectbox("Phase", list(libelles), format_func=libelles.get)
+                        col_form1, col_form2, col_form3 = st.columns(3)
+                        with col_form1:
+                            statut = st.selectbox("Statut", ["NON_DEMARREE", "EN_COURS", "VALIDEE", "RETARD"])
+                        with col_form2:
+                            debut_reel = st.date_input("Début réel", value=None)
+                        with col_form3:
+                            fin_reelle = st.date_input("Fin réelle", value=None)
+                        if st.form_submit_button("💾 Enregistrer"):
+                            valeurs = {'statut': statut}
+                            if debut_reel:
+                                valeurs['date_debut_reelle'] = debut_reel
+                            if fin_reelle:
+                                valeurs['date_fin_reelle'] = fin_reelle
+                            enregistrer_phase(operation_id, ordre, **valeurs)
+                            st.session_state.edition_phase = False
+                            st.rerun()
         else:
             st.warning("⚠️ Aucune phase définie pour cette opération")
     
@@ -1250,6 +5172,7 @@ def page_creation_operation():
         st.markdown(f"#### 🏠 Spécifique {type_operation}")
         st.info(f"📋 {template_info.get('description', '')} - {template_info.get('nb_phases', 0)} phases")
         
+        champs_specifiques = {}
         if type_operation == "OPP":
             col_opp1, col_opp2 = st.columns(2)
             
@@ -1264,6 +5187,17 @@ def page_creation_operation():
                 budget_total = st.number_input("Budget Total (€)", min_value=0, value=2000000)
                 rem_totale = st.number_input("REM Totale Prévue (€)", min_value=0, value=120000)
                 financement = st.multiselect("Financement", ["CDC", "Région", "DEAL", "Fonds Propres"])
+            
+            champs_specifiques = {
+                "nb_logements_total": nb_logements_total,
+                "nb_lls": nb_lls,
+                "nb_lts": nb_lts,
+                "nb_pls": nb_pls,
+                "type_logement": type_logement,
+                "budget_total": budget_total,
+                "rem_totale_prevue": rem_totale,
+                "financement": financement
+            }
         
         elif type_operation == "VEFA":
             col_vefa1, col_vefa2 = st.columns(2)
@@ -1277,6 +5211,15 @@ def page_creation_operation():
                 nb_logements_reserves = st.number_input("Logements Réservés *", min_value=1, value=20)
                 prix_total_reservation = st.number_input("Prix Total Réservation (€)", min_value=0, value=1500000)
                 garantie_financiere = st.number_input("Garantie Financière (€)", min_value=0, value=150000)
+            
+            champs_specifiques = {
+                "promoteur_nom": promoteur_nom,
+                "contact_promoteur": contact_promoteur,
+                "nom_programme": nom_programme,
+                "nb_logements_reserves": nb_logements_reserves,
+                "prix_total_reservation": prix_total_reservation,
+                "garantie_financiere": garantie_financiere
+            }
         
         # Dates prévisionnelles
         st.markdown("#### 📅 Planning Prévisionnel")
@@ -1294,43 +5237,43 @@ def page_creation_operation():
         
         if submitted:
             if nom_operation and type_operation and commune:
-                # Génération automatique des phases selon le type
-                phases_template = template_info.get('phases', [])
-                
-                st.success(f"✅ Opération '{nom_operation}' créée avec succès!")
-                st.info(f"📋 {len(phases_template)} phases générées automatiquement selon le référentiel {type_operation}")
-                
-                # Simulation de sauvegarde
+                # Création en base + phases datées selon le référentiel du type
                 nouvelle_operation = {
-                    "id": 999,  # ID temporaire pour la démo
                     "nom": nom_operation,
                     "type_operation": type_operation,
                     "commune": commune,
                     "aco_responsable": aco_responsable,
-                    "budget_total": locals().get('budget_total', 0),
+                    "adresse": adresse,
+                    "parcelle_cadastrale": parcelle,
                     "avancement": 0,
+                    "freins_actifs": 0,
                     "statut": "EN_MONTAGE",
                     "date_creation": datetime.now().strftime("%Y-%m-%d"),
                     "date_debut_prevue": date_debut.strftime("%Y-%m-%d"),
-                    "date_fin_prevue": date_fin.strftime("%Y-%m-%d")
+                    "date_fin_prevue": date_fin.strftime("%Y-%m-%d"),
+                    **champs_specifiques
                 }
+                operation_id, = creer_operations([nouvelle_operation])
                 
-                st.session_state.selected_operation = nouvelle_operation
-                st.session_state.selected_operation_id = 999
-                st.session_state.page = "operation_details"
+                st.toast(f"✅ Opération '{nom_operation}' créée - {template_info.get('nb_phases', 0)} phases générées selon le référentiel {type_operation}")
                 
-                if st.button("📂 Ouvrir l'opération créée"):
-                    st.rerun()
+                st.session_state.selected_operation = None
+                st.session_state.selected_operation_id = operation_id
+                st.session_state.page = "operation_details"
+                st.rerun()
             else:
                 st.error("❌ Veuillez remplir tous les champs obligatoires (*)")
 
 # ==============================================================================
-# 5. APPLICATION PRINCIPALE
+# 8. APPLICATION PRINCIPALE
 # ==============================================================================
 
 def main():
     """Point d'entrée avec navigation st.session_state"""
     
+    # Évaluation des alertes en arrière-plan (démarrée une fois par processus)
+    get_planificateur_alertes()
+    
     # Initialisation session state
     if 'page' not in st.session_state:
         st.session_state.page = "dashboard"
@@ -1363,10 +5306,9 @@ def main():
         # Opérations courantes (raccourcis)
         st.markdown("#### 📋 Accès Rapide")
         
-        demo_data = load_demo_data()
-        operations_demo = demo_data.get('operations_demo', [])
+        operations_recentes = load_operations(limit=4)  # Limite à 4 pour la sidebar
         
-        for op in operations_demo[:4]:  # Limite à 4 pour la sidebar
+        for op in operations_recentes:
             progress_color = "🟢" if op['avancement'] > 80 else "🟡" if op['avancement'] > 50 else "🔴"
             button_text = f"{progress_color} {op['nom']} ({op['avancement']}%)"
             
@@ -1384,10 +5326,18 @@ def main():
         st.markdown("*Architecture ACO-centrique*")
         
         # Statut données
-        if demo_data:
+        if operations_recentes:
             st.success("✅ Données chargées")
         else:
             st.error("❌ Erreur données")
+        
+        # Validation du paramétrage des workflows
+        erreurs_regles = get_moteur_regles().erreurs
+        if erreurs_regles:
+            st.warning(f"⚠️ {len(erreurs_regles)} règle(s) ignorée(s) dans workflow_modules.json")
+            with st.expander("Détail"):
+                for erreur in erreurs_regles:
+                    st.caption(erreur)
     
     # Routage des pages
     if st.session_state.page == "dashboard":
@@ -0,0 +1,30 @@
+import os
+import runpy
+import shutil
+from pathlib import Path
+
+import pytest
+import streamlit as st
+
+RACINE = Path(__file__).resolve().parents[1]
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    """Globals de l'application sur une base SQLite neuve (données de démonstration)"""
+    travail = tmp_path_factory.mktemp("opcopilot")
+    # Référentiels attendus sous data/<nom>.json (livrés en data/<nom>_json.json)
+    (travail / "data").mkdir()
+    for source in (RACINE / "data").glob("*_json.json"):
+        shutil.copy(source, travail / "data" / source.name.replace("_json.json", ".json"))
+
+    repertoire = os.getcwd()
+    os.environ["OPCOPILOT_DATABASE_URL"] = f"sqlite:///{travail / 'opcopilot.db'}"
+    os.chdir(travail)
+    st.cache_resource.clear()
+    try:
+        yield runpy.run_path(str(RACINE / "opcopilot_v4_app.py"), run_name="opcopilot_app")
+    finally:
+        st.cache_resource.clear()
+        os.chdir(repertoire)
+        del os.environ["OPCOPILOT_DATABASE_URL"]
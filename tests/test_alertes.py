@@ -0,0 +1,41 @@
+import time
+
+
+def _attendre(condition, delai=20):
+    limite = time.monotonic() + delai
+    while not condition():
+        assert time.monotonic() < limite, "évaluation des alertes non effectuée"
+        time.sleep(0.05)
+
+
+def test_evaluation_enregistre_puis_resout_les_alertes(app):
+    planificateur = app["PlanificateurAlertes"](intervalle=3600)
+    planificateur.evaluer()
+
+    alertes = app["load_alertes"](operation_id=1)
+    assert "MED_ECHEANCE" in set(alertes["type"])  # MED-2024-001 sans réponse, délai dépassé
+
+    with app["get_session"]() as session:
+        Med = app["Med"]
+        session.scalar(app["select"](Med).where(Med.reference == "MED-2024-001")).statut = "RESOLU"
+        session.commit()
+    app["invalidate_operation"](1, "med")
+    planificateur.evaluer()
+
+    assert "MED_ECHEANCE" not in set(app["load_alertes"](operation_id=1)["type"])
+    with app["get_session"]() as session:
+        Alerte = app["Alerte"]
+        resolue = session.scalar(app["select"](Alerte).where(Alerte.operation_id == 1, Alerte.type == "MED_ECHEANCE"))
+        assert not resolue.active and resolue.date_resolution is not None
+
+
+def test_thread_reevalue_sur_signalement(app):
+    planificateur = app["PlanificateurAlertes"](intervalle=3600, delai_regroupement=0).demarrer()
+    _attendre(lambda: planificateur.derniere_evaluation is not None)
+    premiere = planificateur.derniere_evaluation
+
+    planificateur.signaler()
+
+    _attendre(lambda: planificateur.derniere_evaluation != premiere)
+    assert planificateur.derniere_erreur is None
+    assert not app["load_alertes"]().empty
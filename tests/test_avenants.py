@@ -0,0 +1,58 @@
+from datetime import date
+
+
+def _fins(app, operation_id):
+    operation = app["get_operation"](operation_id)
+    return date.fromisoformat(operation["date_fin_prevue"]), app["get_planning"](operation).date_fin()
+
+
+def test_validation_delai_suit_la_fin_du_planning(app):
+    for operation_id in (1, 2):
+        fin_avant, fin_planning_avant = _fins(app, operation_id)
+        avenant = app["creer_avenant"](operation_id, "Aléas techniques", 0, 30)
+        app["valider_avenants"]([avenant["id"]])
+        fin_apres, fin_planning_apres = _fins(app, operation_id)
+        # La date de fin prévue bouge exactement comme la fin du planning recalculé
+        assert fin_apres - fin_avant == fin_planning_apres - fin_planning_avant
+
+
+def test_numero_avenant_suit_le_plus_eleve(app):
+    Avenant = app["Avenant"]
+    with app["get_session"]() as session:
+        # Trou dans la séquence : AVT-002 supprimé
+        session.delete(session.scalar(app["select"](Avenant).where(Avenant.operation_id == 1, Avenant.numero == "AVT-002")))
+        session.commit()
+        numeros = session.scalars(app["select"](Avenant.numero).where(Avenant.operation_id == 1)).all()
+
+    avenant = app["creer_avenant"](1, "Plus-value travaux", 5000, 0)
+
+    assert avenant["numero"] == f"AVT-{max(int(n[4:]) for n in numeros) + 1:03d}"
+    assert avenant["numero"] not in numeros
+
+
+def test_circuit_validation_suit_les_seuils(app):
+    def validateurs(impact_budget, impact_delai):
+        return set(app["creer_avenant"](3, "Plus-value travaux", impact_budget, impact_delai)["validateur"].split(", "))
+
+    assert validateurs(5000, 10) == {"ACO"}
+    assert validateurs(10000, 0) == {"RESPONSABLE_FINANCIER"}
+    assert validateurs(-12000, 0) == {"RESPONSABLE_FINANCIER"}  # moins-value : montant en valeur absolue
+    assert validateurs(60000, 0) == {"DIRECTION"}  # seul le seuil le plus élevé du groupe budget
+    assert validateurs(0, 30) == {"RESPONSABLE_TECHNIQUE"}
+    assert validateurs(60000, 45) == {"DIRECTION", "RESPONSABLE_TECHNIQUE"}
+
+
+def test_registre_cumuls_et_totaux_par_commune(app):
+    app["creer_avenant"](4, "Plus-value travaux", 20000, 10)
+    app["creer_avenant"](4, "Moins-value travaux", -5000, 5)
+    registre = app["get_registre_avenants"]()
+    commune = app["get_operation"](4)["commune"]
+
+    cumuls = registre.cumuls.loc[4]
+    assert (cumuls["cumul_budget"], cumuls["cumul_delai"]) == (15000, 15)
+    assert (cumuls["cumul_budget_valide"], cumuls["cumul_delai_valide"]) == (0, 0)
+    # Plus-values non validées par commune, servies par les agrégats pré-calculés
+    totaux = registre.totaux(par="commune", exclure_statuts=app["STATUTS_AVENANT_CLOS"])
+    lignes = registre.lignes
+    attendu = lignes.loc[(lignes["commune"] == commune) & ~lignes["statut"].isin(["VALIDE", "REFUSE"]), "impact_budget"]
+    assert totaux.loc[commune, "plus_values"] == attendu.clip(lower=0).sum() >= 20000
@@ -0,0 +1,32 @@
+def test_cache_operations_lru_et_invalidation(app):
+    cache = app["CacheOperations"](capacite=2)
+    chargements = []
+
+    def loader(operation_id):
+        chargements.append(operation_id)
+        return {"id": operation_id}
+
+    for operation_id in (1, 2, 1, 3):
+        cache.get("operation", operation_id, loader)
+    assert chargements == [1, 2, 3]  # 1 relue depuis le cache, 2 évincée (moins récemment lue)
+    cache.get("operation", 2, loader)
+    assert chargements == [1, 2, 3, 2]
+
+    cache.get("phases", 2, loader)
+    cache.invalidate(2, {"phases"})
+    assert cache.version(2) == 1 and cache.version(3) == 0
+    cache.get("operation", 2, loader)
+    assert len(chargements) == 5  # operation conservée
+    cache.get("phases", 2, loader)
+    assert len(chargements) == 6  # phases rechargées
+
+
+def test_cache_global_une_entree_par_domaine(app):
+    cache = app["CacheOperations"]()
+    valeurs = iter(range(10))
+    assert cache.get_global("analyse", lambda: next(valeurs), version="2026-01-01") == 0
+    assert cache.get_global("analyse", lambda: next(valeurs), version="2026-01-01") == 0
+    assert cache.get_global("analyse", lambda: next(valeurs), version="2026-01-02") == 1
+    cache.invalidate(1)
+    assert cache.get_global("analyse", lambda: next(valeurs), version="2026-01-02") == 2
+    assert list(cache._globales) == ["analyse"]
@@ -0,0 +1,44 @@
+from datetime import date
+
+
+def _element(app, operation_id, item):
+    checklist = app["get_cloture"](operation_id)["checklist"]
+    return checklist[checklist["item"] == item].iloc[0]
+
+
+def test_phases_validees_cochent_la_checklist(app):
+    operation_id = 2
+    assert not _element(app, operation_id, "Toutes phases validées")["valide"]
+
+    planning = app["get_planning"](app["get_operation"](operation_id))
+    for phase in planning.phases():
+        if phase["statut"] != "VALIDEE":
+            app["enregistrer_phase"](operation_id, phase["ordre"], statut="VALIDEE", date_fin_reelle=date(2025, 6, 30))
+
+    element = _element(app, operation_id, "Toutes phases validées")
+    assert element["valide"] and not element["manuel"]
+    assert app["get_cloture"](operation_id)["faits"].loc[operation_id, "phases_ouvertes"] == 0
+
+
+def test_element_manuel_et_cloture(app):
+    operation_id = 1
+    assert not _element(app, operation_id, "Documents archivés")["valide"]
+
+    app["valider_element_cloture"](operation_id, "Documents archivés", True, "ACO TEST")
+
+    element = _element(app, operation_id, "Documents archivés")
+    assert element["valide"] and element["auteur"] == "ACO TEST"
+    assert not app["cloturer_operation"](operation_id)  # checklist incomplète
+    assert app["get_operation"](operation_id)["statut"] != "CLOTUREE"
+
+
+def test_preparation_portefeuille_en_un_lot(app):
+    app["valider_element_cloture"](3, "Bilan opération rédigé", True, "ACO TEST")
+    preparation = app["get_preparation_cloture"]()
+    items = len(app["load_workflow_modules"]()["workflow_cloture"]["checklist_obligatoire"])
+
+    assert set(preparation.index) == {op["id"] for op in app["load_operations"]()}
+    assert (preparation["items_total"] == items).all()
+    # Même évaluation que la checklist d'une opération
+    assert preparation.loc[3, "items_valides"] == app["get_cloture"](3)["checklist"]["valide"].sum()
+    assert "Bilan opération rédigé" not in preparation.loc[3, "bloquants"]
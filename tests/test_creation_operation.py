@@ -0,0 +1,21 @@
+from streamlit.testing.v1 import AppTest
+
+from conftest import RACINE
+
+
+def test_creation_operation_enregistre_champs_specifiques(app):
+    at = AppTest.from_file(str(RACINE / "opcopilot_v4_app.py"), default_timeout=60)
+    at.session_state.page = "creation_operation"
+    at.run()
+    at.text_input[0].input("RÉSIDENCE TEST")
+    at.number_input[0].set_value(42)
+    next(b for b in at.button if b.key and b.key.startswith("FormSubmitter:creation_operation")).click()
+    at.run()
+    assert not at.exception
+
+    operation = app["load_operation"](at.session_state.selected_operation_id)
+    assert operation["nom"] == "RÉSIDENCE TEST"
+    assert operation["type_operation"] == "OPP"
+    assert operation["nb_logements_total"] == 42
+    assert operation["rem_totale_prevue"] == 120000
+    assert operation.get("promoteur_nom") is None
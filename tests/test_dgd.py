@@ -0,0 +1,43 @@
+import os
+from decimal import Decimal
+
+import openpyxl
+from sqlalchemy import insert, select, update
+
+
+def test_dgd_operation_demo(app):
+    dgd = app["get_dgd"](1)
+    assert dgd["synthese"]["montant_final"] == Decimal("1096900.00")
+    assert dgd["synthese"]["ecart_pourcentage"] == Decimal("-1.2")
+    assert dgd["lots"]["final_centimes"].tolist() == [83300000, 12240000, 9975000, 4175000]
+
+
+def test_dgd_lots_identiques_sur_deux_operations(app):
+    LotDGD = app["LotDGD"]
+    colonnes = ["nom", "marche_initial", "quantites_reelles", "plus_moins_value", "penalites", "statut"]
+    with app["get_session"]() as session:
+        lots = session.execute(select(*(getattr(LotDGD, c) for c in colonnes)).where(LotDGD.operation_id == 1)).all()
+        session.execute(insert(LotDGD), [{"operation_id": 3, **dict(zip(colonnes, lot))} for lot in lots])
+        session.commit()
+    app["invalidate_operation"](3, "dgd")
+
+    dgd_1, dgd_3 = app["get_dgd"](1), app["get_dgd"](3)
+    assert set(dgd_3["lots"]["operation_id"]) == {3}
+    assert set(dgd_3["lots"]["id"]).isdisjoint(dgd_1["lots"]["id"])
+    assert dgd_3["synthese"] == dgd_1["synthese"]
+
+
+def test_export_montant_final_recalcule(app):
+    LotDGD = app["LotDGD"]
+    with app["get_session"]() as session:
+        session.execute(update(LotDGD).where(LotDGD.operation_id == 1).values(montant_final=1))
+        session.commit()
+
+    chemin = app["exporter_xlsx"]([1], ["Lots DGD"])
+    try:
+        feuille = openpyxl.load_workbook(chemin, read_only=True).worksheets[0]
+        lignes = list(feuille.iter_rows(values_only=True))
+    finally:
+        os.remove(chemin)
+    position = lignes[0].index("Montant final")
+    assert [ligne[position] for ligne in lignes[1:]] == [833000, 122400, 99750, 41750]
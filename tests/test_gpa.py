@@ -0,0 +1,28 @@
+from datetime import date, timedelta
+
+
+def test_reclamation_creee_entre_au_registre(app):
+    delais, defaut = app["delais_intervention_gpa"]()
+    reclamation = app["creer_reclamation_gpa"](2, "D401", "Plomberie", "Fuite sous évier", "M. TEST", "PLOMBERIE EXPERT")
+
+    assert reclamation["statut"] == "SIGNALE"
+    assert reclamation["delai_intervention"] == -(-delais.get("PLOMBERIE", defaut) // 24)
+    ligne = app["get_registre_gpa"]().rechercher(operation_id=2, logement="D401").iloc[0]
+    assert ligne["ouverte"] and not ligne["hors_delai"]
+    assert ligne["echeance"].date() == date.today() + timedelta(days=reclamation["delai_intervention"])
+    assert any(r["logement"] == "D401" for r in app["get_gpa"](2))
+
+
+def test_reclamations_hors_delai_signalees(app):
+    registre = app["get_registre_gpa"]()
+
+    # Démo : C304 (peinture, signalée le 25/08/2024) toujours ouverte ; A101 résolue en 2 jours
+    hors_delai = registre.hors_delai(operation_id=2)
+    assert "C304" in set(hors_delai["logement"])
+    assert "A101" not in set(hors_delai["logement"])
+    ligne = hors_delai[hors_delai["logement"] == "C304"].iloc[0]
+    assert ligne["retard_jours"] == (date.today() - ligne["echeance"].date()).days > 0
+
+    totaux = registre.totaux("entreprise", operation_id=2)
+    assert totaux.loc["PEINTURE MODERNE", "hors_delai"] >= 1
+    assert registre.duree_mediane(operation_id=2, logement="A101") == 2
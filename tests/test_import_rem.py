@@ -0,0 +1,40 @@
+import io
+
+import pandas as pd
+from sqlalchemy import select
+
+
+def _csv(lignes):
+    entete = "operation_id;trimestre;rem_projetee;rem_realisee;depenses_projetees;depenses_facturees\n"
+    return io.BytesIO((entete + "\n".join(lignes) + "\n").encode("utf-8"))
+
+
+def test_montants_formates_a_la_francaise(app):
+    montants = app["_montants"](pd.Series(["26 000", "24500,50 €", "1 200", "", None], dtype=object))
+    assert montants.tolist()[:3] == [26000, 24500.5, 1200]
+    assert montants[3:].isna().all()
+    # Type chaîne dédié (pandas >= 3, read_csv(dtype=str))
+    assert app["_montants"](pd.Series(["26 000", "24500,50 €"], dtype="string")).tolist() == [26000, 24500.5]
+
+
+def test_import_csv_montants_formates(app):
+    rapport = app["importer_rem"](_csv(["1;T1 2030;30 000;26 000;25000;24500,50 €"]), "rem.csv")
+    assert rapport["erreurs"].empty
+    RemTrimestre = app["RemTrimestre"]
+    with app["get_session"]() as session:
+        ligne = session.execute(select(RemTrimestre.rem_realisee, RemTrimestre.depenses_facturees)
+                                .where(RemTrimestre.operation_id == 1, RemTrimestre.trimestre == "T1 2030")).one()
+    assert tuple(ligne) == (26000, 24500)
+
+
+def test_import_csv_montant_illisible_signale(app):
+    rapport = app["importer_rem"](_csv(["1;T2 2030;30000;vingt mille;25000;", "1;T3 2030;30000;;25000;"]), "rem.csv")
+    erreurs = rapport["erreurs"]
+    assert erreurs["ligne"].tolist() == [2]
+    assert "rem_realisee" in erreurs["erreur"].iloc[0]
+    # Réalisé laissé vide : non encore saisi, importé à 0
+    RemTrimestre = app["RemTrimestre"]
+    with app["get_session"]() as session:
+        trimestres = session.scalars(select(RemTrimestre.trimestre).where(RemTrimestre.operation_id == 1,
+                                                                          RemTrimestre.trimestre.like("T_ 2030"))).all()
+    assert "T3 2030" in trimestres and "T2 2030" not in trimestres
@@ -0,0 +1,57 @@
+from datetime import date, timedelta
+
+
+def _echeance_med_depassee(app, operation_id, jours):
+    med = app["creer_med"](operation_id, "RETARD_TRAVAUX", "ENTREPRISE", "Retard constaté", 10)
+    with app["get_session"]() as session:
+        session.get(app["Med"], med["id"]).date_envoi = date.today() - timedelta(days=10 + jours)
+        session.commit()
+    return med
+
+
+def test_med_escaladee_ne_declenche_plus_d_alerte(app):
+    med = _echeance_med_depassee(app, 4, 30)
+    indicateurs = app["load_indicateurs_operations"](date.today())
+    assert indicateurs.loc[4, "med_depassement_jours"] == 30
+
+    with app["get_session"]() as session:
+        session.get(app["Med"], med["id"]).statut = "ESCALADEE"
+        session.commit()
+    indicateurs = app["load_indicateurs_operations"](date.today())
+    assert indicateurs["med_depassement_jours"].isna()[4]
+
+
+def test_regle_invalide_signalee_et_ignoree(app):
+    workflow = {"workflow_rem": {"alertes": [
+        {"type": "ECART_CRITIQUE", "seuil": 15, "action": "Alerte"},
+        {"type": "RETARD_SAISIE", "seuil": "7"},
+        {"type": "INCONNUE", "seuil": 3}
+    ]}}
+
+    regles, erreurs = app["compiler_regles_workflow"](workflow)
+
+    assert [regle.type for regle in regles] == ["ECART_CRITIQUE"]
+    assert len(erreurs) == 2
+    assert any("RETARD_SAISIE" in erreur and "seuil" in erreur for erreur in erreurs)
+    assert app["get_moteur_regles"]().erreurs == []  # workflow_modules.json livré valide
+
+
+def test_evaluation_vectorisee_des_regles(app):
+    pd = app["pd"]
+    moteur = app["MoteurRegles"]({"workflow_avenants": {"seuils_validation": [
+        {"type": "IMPACT_BUDGET", "seuil_montant": 10000, "validateur": "RESPONSABLE_FINANCIER"},
+        {"type": "IMPACT_MAJEUR", "seuil_montant": 50000, "validateur": "DIRECTION"}
+    ]}})
+    indicateurs = pd.DataFrame({
+        "nom": ["A", "B", "C", "D"], "aco_responsable": "ACO", "commune": "Les Abymes",
+        "statut": ["EN_COURS", "EN_COURS", "EN_COURS", "CLOTUREE"],
+        "avenant_budget_en_attente": [20000, 60000, float("nan"), 60000],
+        "avenant_delai_en_attente": float("nan"), "phases_retard_jours": float("nan"),
+        "med_depassement_jours": float("nan")
+    }, index=pd.Index([1, 2, 3, 4], name="id"))
+
+    alertes = moteur.evaluer(indicateurs).set_index("operation_id")
+
+    # Groupe gradué : seul le seuil le plus élevé déclenché ; indicateur manquant ou opération close : rien
+    assert alertes["type"].to_dict() == {2: "IMPACT_MAJEUR", 1: "IMPACT_BUDGET"}
+    assert alertes.loc[2, "cle"] == "2:avenant_budget"
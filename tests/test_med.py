@@ -0,0 +1,39 @@
+import io
+
+import docx
+
+
+def test_documents_med_generes_par_le_pool(app):
+    operation = app["get_operation"](1)
+    meds = [app["creer_med"](1, "RETARD_TRAVAUX", f"ENTREPRISE {i}", "Retard constaté", 15) for i in range(3)]
+
+    documents = [(nom, future.result(timeout=30)) for nom, future in app["soumettre_documents_med"](operation, meds)]
+
+    assert [nom for nom, _ in documents] == [f"{med['reference']}.docx" for med in meds]
+    for (_, contenu), med in zip(documents, meds):
+        texte = "\n".join(paragraphe.text for paragraphe in docx.Document(io.BytesIO(contenu)).paragraphs)
+        assert med["reference"] in texte
+
+
+def test_relance_ignore_med_escaladee(app):
+    escaladee = app["creer_med"](2, "RETARD_TRAVAUX", "ENTREPRISE ESCALADÉE", "Retard constaté", 15)
+    ouverte = app["creer_med"](2, "RETARD_TRAVAUX", "ENTREPRISE OUVERTE", "Retard constaté", 15)
+    with app["get_session"]() as session:
+        session.get(app["Med"], escaladee["id"]).statut = "ESCALADEE"
+        session.commit()
+
+    relancees = {med["id"]: med for med in app["relancer_meds"](2)}
+
+    assert escaladee["id"] not in relancees
+    assert relancees[ouverte["id"]]["relance_effectuee"]
+    with app["get_session"]() as session:
+        assert not session.get(app["Med"], escaladee["id"]).relance_effectuee
+
+
+def test_modele_med_parse_une_seule_fois(app):
+    modele = app["get_template_med"]("RETARD_TRAVAUX")
+
+    assert app["get_template_med"]("RETARD_TRAVAUX") is modele
+    contenu = app["generer_document_med"](app["get_operation"](1), {"reference": "MED-TEST-001", "type": "RETARD_TRAVAUX"})
+    assert "MED-TEST-001" in "\n".join(p.text for p in docx.Document(io.BytesIO(contenu)).paragraphs)
+    assert "{{reference}}" in "\n".join(p.text for p in modele.paragraphs)  # modèle partagé intact
@@ -0,0 +1,46 @@
+from datetime import date
+
+
+def _planning_recharge(app, operation_id):
+    """Planning reconstruit depuis la base, sans passer par le cache"""
+    Phase = app["Phase"]
+    return app["construire_planning"](app["load_operation"](operation_id),
+                                      app["load_operation_records"](Phase, operation_id, Phase.ordre))
+
+
+def test_enregistrer_phase_planning_identique_au_rechargement(app):
+    operation_id = 2
+    planning = app["get_planning"](app["get_operation"](operation_id))
+    ordres = planning.dag.ordres
+    ecritures = [
+        (ordres[20], {"date_debut_reelle": date(2025, 3, 1)}),
+        (ordres[25], {"date_debut_reelle": date(2025, 6, 1), "statut": "EN_COURS"}),
+        (ordres[25], {"date_debut_reelle": None}),
+        (ordres[10], {"statut": "VALIDEE", "date_fin_reelle": date(2024, 12, 1)}),
+    ]
+    for ordre, valeurs in ecritures:
+        app["enregistrer_phase"](operation_id, ordre, **valeurs)
+        en_cache = app["get_planning"](app["get_operation"](operation_id))
+        assert en_cache is planning  # mise à jour incrémentale, pas de reconstruction
+        assert en_cache.phases() == _planning_recharge(app, operation_id).phases()
+
+
+def test_portefeuille_reutilise_les_plannings_en_cache(app):
+    cache = app["get_cache_operations"]()
+    cache.invalidate_domaines("planning")
+    operation_ids = [op["id"] for op in app["load_operations"]()]
+
+    app["get_phases_portefeuille"]()
+    assert cache.absents("planning", operation_ids) == []  # plannings publiés par opération
+
+    plannings = {op_id: app["get_planning"](app["get_operation"](op_id)) for op_id in operation_ids}
+    ordre = plannings[2].dag.ordres[5]
+    app["enregistrer_phase"](2, ordre, statut="EN_COURS", date_debut_reelle=date(2025, 1, 15))
+    phases = app["get_phases_portefeuille"]()
+
+    # Aucun planning reconstruit : la phase modifiée figure déjà dans le planning en cache
+    assert all(app["get_planning"](app["get_operation"](op_id)) is planning for op_id, planning in plannings.items())
+    ligne = phases[(phases["operation_id"] == 2) & (phases["ordre"] == ordre)].iloc[0]
+    assert ligne["statut"] == "EN_COURS"
+    attendu = [p["date_fin_prevue"] for p in _planning_recharge(app, 2).phases()]
+    assert [d.date().isoformat() for d in phases.loc[phases["operation_id"] == 2, "fin"]] == attendu
@@ -0,0 +1,23 @@
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+
+
+def test_seed_ignore_les_cles_inconnues_du_json(app):
+    demo = app["_degeler"](app["load_demo_data"]())
+    for cle in ("avenants_demo", "med_demo", "gpa_demo"):
+        for enregistrements in demo[cle].values():
+            for enregistrement in enregistrements:
+                enregistrement["commentaire_interne"] = "clé hors schéma"
+    for dgd in demo["dgd_demo"].values():
+        for lot in dgd["lots"]:
+            lot["commentaire_interne"] = "clé hors schéma"
+
+    engine = create_engine("sqlite://")
+    app["Base"].metadata.create_all(engine)
+    with Session(engine) as session:
+        app["seed_database"](session, demo)
+        session.commit()
+        for modele, cle in ((app["Avenant"], "avenants_demo"), (app["Med"], "med_demo"), (app["ReclamationGPA"], "gpa_demo")):
+            attendu = sum(len(v) for v in demo[cle].values())
+            assert session.scalar(select(func.count()).select_from(modele)) == attendu
+        assert session.scalar(select(func.sum(app["LotDGD"].montant_final))) == 1096900